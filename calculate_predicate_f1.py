@@ -1,9 +1,12 @@
 import argparse
+import os
 import re
 
 
 from tqdm import tqdm
 from collections import Counter
+from error_index import ErrorIndex, CheckpointCounts, LARGE_DELTA
+from profiling import add_profile_arguments, open_profiler
 from simplify_graph import get_all_nodes_pattern
 
 
@@ -19,9 +22,21 @@ def main():
     parser.add_argument('--top', type=int, default=10,
             help='Prints top n predicates with debugging')
     parser.add_argument('--debug', action='store_true', default=False,
-            help='Turns on debugging output.')
+            help='Turns on debugging output: the most over- and '
+                 'underpredicted predicates and the number of predictions '
+                 'much shorter than their gold graph.')
+    parser.add_argument('--index', type=str, default=None,
+            help='Writes the per-predicate and per-sentence counts of the '
+                 'predicted file to this SQLite error index, to be queried '
+                 'with error_index.py.')
+    parser.add_argument('--checkpoint', type=str, default=None,
+            help='Name of the predicted file in the index, replacing an '
+                 'earlier entry of the same name. (default=the file name)')
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
+    profiler = open_profiler(args, [get_predicates, count_correct])
+
 
     with open(args.source, 'r') as source, open(args.predicted, 'r') as pred:
         labels = list(source.readlines())
@@ -30,26 +45,18 @@ def main():
     gold_counts = get_counter()
     pred_counts = get_counter(correct=True)
 
-    errors = {
-        'surface': set(),
-        'abstract': set(),
-        'overpredicted': Counter(),
-        'underpredicted': Counter()
-    }
-    sig_diff = []
+    # Rows of the error index, collected in the same pass
+    counts = None
+    if args.debug or args.index:
+        counts = CheckpointCounts()
 
     for i, (label, prediction) in tqdm(enumerate(zip(labels, predictions)), total=len(labels)):
         gold_surface, gold_abstract = get_predicates(label)
         pred_surface, pred_abstract = get_predicates(prediction)
 
-        if args.debug:
-            errors['surface'].update(gold_surface)
-            errors['surface'].update(pred_surface)
-            errors['abstract'].update(gold_abstract)
-            errors['abstract'].update(pred_abstract)
-
-            if len(label.split()) > len(prediction.split()) + 15:
-                sig_diff.append((i, label, prediction))
+        if counts is not None:
+            counts.add(label, prediction, gold_surface + gold_abstract,
+                       pred_surface + pred_abstract)
 
         gold_counts['abstract'] += len(gold_abstract)
         gold_counts['surface'] += len(gold_surface)
@@ -57,11 +64,9 @@ def main():
         pred_counts['surface']['total'] += len(pred_surface)
 
         pred_counts['surface']['correct'] += count_correct(gold_surface,
-                                                           pred_surface,
-                                                           errors)
+                                                           pred_surface)
         pred_counts['abstract']['correct'] += count_correct(gold_abstract,
-                                                            pred_abstract,
-                                                            errors)
+                                                            pred_abstract)
 
     print('Abstract results')
     print('------------------------------')
@@ -94,25 +99,40 @@ def main():
     print('Recall: {:.2f}'.format(recall))
     print('F1: {:.2f}\n'.format(2 * (precision * recall) / (precision + recall)))
 
-    if args.debug:
-        print('Number of Abstract predicates: {}'.format(len(errors['abstract'])))
-        print('Number of Surface predicates: {}'.format(len(errors['surface'])))
-        print('Number of pairs with large length difference: {}'.format(len(sig_diff)))
+    if profiler is not None:
+        profiler.close(args.profile)
+
+    if counts is None:
+        return
+
+    # Without --index the debugging output is queried from a temporary index
+    name = args.checkpoint or os.path.basename(args.predicted)
+    with ErrorIndex(args.index or ':memory:') as index:
+        index.add_checkpoint(name, args.source, args.predicted, counts)
+        if args.debug:
+            print_debug(index, name, counts, args.top)
 
-        for key in ['overpredicted', 'underpredicted']:
-            errors[key] = Counter({ pred : errors[key][pred]
-                                    for pred in errors[key]
-                                    if errors[key][pred] > 20 })
-            print()
-            print('Most commonly {} words:'.format(key))
-            print(errors[key].most_common(args.top))
 
+def print_debug(index, name, counts, top):
+    predicates = counts.gold.keys() | counts.pred.keys()
+    print('Number of Abstract predicates: {}'.format(
+        sum(1 for pred in predicates if not pred.startswith('_'))))
+    print('Number of Surface predicates: {}'.format(
+        sum(1 for pred in predicates if pred.startswith('_'))))
+    print('Number of pairs with large length difference: {}'.format(
+        index.count_sentences(name, LARGE_DELTA)))
 
-        print('importing ipdb for debugging purposes')
-        import ipdb; ipdb.set_trace()
+    # As before the index: overpredicted occurrences and underpredicted
+    # sentences, only for predicates with more than 20 of them
+    for key, kind in [('overpredicted', 'overpredicted'),
+                      ('underpredicted', 'underpredicted sentences')]:
+        print()
+        print('Most commonly {} words:'.format(key))
+        print([(pred, errors) for pred, errors, _, _, _
+               in index.errors(name, kind, top, min_errors=21)])
 
 
-def count_correct(gold, pred, errors):
+def count_correct(gold, pred):
     correct = 0
     counts = Counter()
     counts.update(gold)
@@ -120,11 +140,6 @@ def count_correct(gold, pred, errors):
         if counts[val]:
             correct += 1
             counts[val] -= 1
-        else:
-            errors['overpredicted'][val] += 1
-    for val in counts.keys():
-        if counts[val] > 0:
-            errors['underpredicted'][val] += 1
     return correct
 
 
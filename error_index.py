@@ -0,0 +1,295 @@
+import argparse
+import os
+import sqlite3
+import time
+
+
+from collections import Counter
+
+
+# Bump when the tables change, so an old index is rebuilt rather than misread
+INDEX_VERSION = 2
+
+QUERIES = ['checkpoints', 'errors', 'regressions', 'sentences']
+
+# How each kind of error is counted from a predicate's row. 'underpredicted
+# sentences' counts the sentences with fewer matches than gold occurrences,
+# which is what --debug has always reported as underpredicted.
+ERROR_COUNTS = {
+    'overpredicted': 'pred - matched',
+    'underpredicted': 'gold - matched',
+    'underpredicted sentences': 'under_sentences',
+}
+
+# Predictions this many tokens shorter than their gold graph are what --debug
+# called a large length difference
+LARGE_DELTA = 16
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Queries the predicate error index that '
+                    'calculate_predicate_f1.py --index writes, e.g. which '
+                    'predicates regressed between two checkpoints.'
+    )
+    parser.add_argument('index', type=str,
+                        help='SQLite index file.')
+    parser.add_argument('query', type=str, choices=QUERIES,
+                        help='"checkpoints" lists the indexed checkpoints, '
+                             '"errors" the most over- and underpredicted '
+                             'predicates of a checkpoint, "regressions" the '
+                             'predicates whose F1 dropped from the first '
+                             'checkpoint to the second and "sentences" the '
+                             'predictions much shorter than their gold graph.')
+    parser.add_argument('checkpoints', type=str, nargs='*',
+                        help='Checkpoint names: one for errors and sentences, '
+                             'two for regressions.')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Number of rows to print. (default=20)')
+    parser.add_argument('--min-gold', type=int, default=1,
+                        help='Only compare predicates that appear at least '
+                             'this often in the gold graphs. (default=1)')
+    parser.add_argument('--min-delta', type=int, default=LARGE_DELTA,
+                        help='Smallest number of tokens a prediction is '
+                             'shorter than its gold graph by for sentences. '
+                             '(default={})'.format(LARGE_DELTA))
+    args = parser.parse_args()
+
+    needed = {'checkpoints': 0, 'errors': 1, 'regressions': 2, 'sentences': 1}
+    if len(args.checkpoints) != needed[args.query]:
+        parser.error('{} takes {} checkpoint names'.format(
+            args.query, needed[args.query]))
+
+    start = time.perf_counter()
+    with ErrorIndex(args.index) as index:
+        if args.query == 'checkpoints':
+            print_rows(['checkpoint', 'graphs', 'predicted', 'created'],
+                       [(name, graphs, predicted, time.strftime(
+                           '%Y-%m-%d %H:%M', time.localtime(created)))
+                        for name, graphs, predicted, created
+                        in index.checkpoints()])
+        elif args.query == 'errors':
+            for kind in ['overpredicted', 'underpredicted']:
+                print('Most commonly {} predicates:'.format(kind))
+                print_rows(['predicate', kind, 'gold', 'pred', 'matched'],
+                           index.errors(args.checkpoints[0], kind, args.top))
+                print()
+        elif args.query == 'regressions':
+            print_rows(['predicate', 'gold', 'f1 before', 'f1 after',
+                        'matched change'],
+                       [(predicate, gold, '{:.3f}'.format(before),
+                         '{:.3f}'.format(after), '{:+d}'.format(change))
+                        for predicate, gold, before, after, change
+                        in index.regressions(*args.checkpoints, args.top,
+                                             args.min_gold)])
+        else:
+            print_rows(['sentence', 'gold tokens', 'pred tokens', 'matched'],
+                       index.sentences(args.checkpoints[0], args.min_delta,
+                                       args.top))
+    print('Query took {:.1f}ms'.format(1000 * (time.perf_counter() - start)))
+
+
+class ErrorIndex:
+    """
+    Per-checkpoint predicate error counts in a SQLite file. For every
+    checkpoint it holds the gold, predicted and matched counts of each
+    predicate over the corpus, and the token lengths and predicate counts of
+    each sentence. Tables are keyed by checkpoint, so comparing two
+    checkpoints only reads their rows.
+
+    A predicate that appears n times in the gold graph and m times in the
+    predicted graph counts as min(n, m) matches, like
+    calculate_predicate_f1.py.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, INDEX_VERSION):
+            raise ValueError('{} is an index of version {}, expected {}. '
+                             'Delete it to rebuild it.'.format(
+                                 path, version, INDEX_VERSION))
+
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                id INTEGER PRIMARY KEY, name TEXT UNIQUE, source TEXT,
+                predicted TEXT, graphs INTEGER, created REAL);
+            CREATE TABLE IF NOT EXISTS predicates (
+                checkpoint INTEGER, predicate TEXT, surface INTEGER,
+                gold INTEGER, pred INTEGER, matched INTEGER,
+                under_sentences INTEGER,
+                PRIMARY KEY (checkpoint, predicate)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sentences (
+                checkpoint INTEGER, sentence INTEGER, gold_tokens INTEGER,
+                pred_tokens INTEGER, delta INTEGER, gold INTEGER,
+                pred INTEGER, matched INTEGER,
+                PRIMARY KEY (checkpoint, sentence)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS sentences_delta
+                ON sentences (checkpoint, delta);
+        ''')
+        self.db.execute('PRAGMA user_version = {}'.format(INDEX_VERSION))
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def add_checkpoint(self, name, source, predicted, counts):
+        """
+        Stores the CheckpointCounts of the predicted file of a checkpoint,
+        replacing an earlier checkpoint of the same name.
+        """
+
+        with self.db:
+            self.db.execute('DELETE FROM predicates WHERE checkpoint IN '
+                            '(SELECT id FROM checkpoints WHERE name = ?)',
+                            (name,))
+            self.db.execute('DELETE FROM sentences WHERE checkpoint IN '
+                            '(SELECT id FROM checkpoints WHERE name = ?)',
+                            (name,))
+            self.db.execute('DELETE FROM checkpoints WHERE name = ?', (name,))
+
+            checkpoint = self.db.execute(
+                'INSERT INTO checkpoints (name, source, predicted, graphs, '
+                'created) VALUES (?, ?, ?, ?, ?)',
+                (name, os.path.abspath(source), os.path.abspath(predicted),
+                 len(counts.sentences), time.time())).lastrowid
+            self.db.executemany(
+                'INSERT INTO predicates VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((checkpoint, predicate, predicate.startswith('_'),
+                  counts.gold[predicate], counts.pred[predicate],
+                  counts.matched[predicate],
+                  counts.under_sentences[predicate])
+                 for predicate in counts.gold.keys() | counts.pred.keys()))
+            self.db.executemany(
+                'INSERT INTO sentences VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((checkpoint, i, gold_tokens, pred_tokens,
+                  gold_tokens - pred_tokens, gold, pred, matched)
+                 for i, (gold_tokens, pred_tokens, gold, pred, matched)
+                 in enumerate(counts.sentences)))
+
+    def checkpoints(self):
+        return self.db.execute('SELECT name, graphs, predicted, created '
+                               'FROM checkpoints ORDER BY created').fetchall()
+
+    def _id(self, name):
+        row = self.db.execute('SELECT id FROM checkpoints WHERE name = ?',
+                              (name,)).fetchone()
+        if row is None:
+            raise KeyError('no checkpoint named {!r} in the index'.format(name))
+        return row[0]
+
+    def errors(self, name, kind='overpredicted', top=20, min_errors=1):
+        """
+        Return
+        ------
+        list
+            (predicate, errors, gold, pred, matched) of the top predicates
+            with at least min_errors errors of kind (see ERROR_COUNTS):
+            overpredicted (predicted but not matched) or underpredicted
+            (gold but not matched) occurrences, or underpredicted sentences.
+        """
+
+        return self.db.execute(
+            'SELECT predicate, {0} AS errors, gold, pred, matched '
+            'FROM predicates WHERE checkpoint = ? AND {0} >= ? '
+            'ORDER BY errors DESC, predicate LIMIT ?'.format(
+                ERROR_COUNTS[kind]),
+            (self._id(name), max(min_errors, 1), top)).fetchall()
+
+    def regressions(self, before, after, top=20, min_gold=1):
+        """
+        Return
+        ------
+        list
+            (predicate, gold count, F1 before, F1 after, change in matches)
+            of the top predicates whose F1 dropped from checkpoint before to
+            after, the most lost matches first. Predicates missing from a
+            checkpoint have an F1 of 0 there.
+        """
+
+        return self.db.execute('''
+            SELECT predicate, MAX(gold),
+                   COALESCE(MAX(CASE WHEN checkpoint = :before
+                                THEN 2.0 * matched / (gold + pred) END), 0)
+                       AS f1_before,
+                   COALESCE(MAX(CASE WHEN checkpoint = :after
+                                THEN 2.0 * matched / (gold + pred) END), 0)
+                       AS f1_after,
+                   SUM(CASE WHEN checkpoint = :after THEN matched
+                       ELSE -matched END) AS change
+            FROM predicates
+            WHERE checkpoint IN (:before, :after)
+            GROUP BY predicate
+            HAVING MAX(gold) >= :min_gold AND f1_after < f1_before
+            ORDER BY change, f1_after - f1_before, predicate
+            LIMIT :top
+        ''', {'before': self._id(before), 'after': self._id(after),
+              'min_gold': min_gold, 'top': top}).fetchall()
+
+    def sentences(self, name, min_delta=LARGE_DELTA, top=20):
+        """
+        Return
+        ------
+        list
+            (sentence index, gold tokens, predicted tokens, matched
+            predicates) of the top predictions that are shorter than their
+            gold graph by at least min_delta tokens, the largest difference
+            first.
+        """
+
+        return self.db.execute(
+            'SELECT sentence, gold_tokens, pred_tokens, matched '
+            'FROM sentences WHERE checkpoint = ? AND delta >= ? '
+            'ORDER BY delta DESC, sentence LIMIT ?',
+            (self._id(name), min_delta, top)).fetchall()
+
+    def count_sentences(self, name, min_delta=LARGE_DELTA):
+        return self.db.execute(
+            'SELECT COUNT(*) FROM sentences WHERE checkpoint = ? '
+            'AND delta >= ?', (self._id(name), min_delta)).fetchone()[0]
+
+
+class CheckpointCounts:
+    """
+    Collects the rows of a checkpoint while its graphs are scored, so the
+    index is built in the same pass.
+    """
+
+    def __init__(self):
+        self.gold = Counter()
+        self.pred = Counter()
+        self.matched = Counter()
+        self.under_sentences = Counter()
+        self.sentences = []
+
+    def add(self, label, prediction, gold_predicates, pred_predicates):
+        gold = Counter(gold_predicates)
+        pred = Counter(pred_predicates)
+        matched = gold & pred
+        self.gold.update(gold)
+        self.pred.update(pred)
+        self.matched.update(matched)
+        self.under_sentences.update(predicate for predicate in gold
+                                    if gold[predicate] > matched[predicate])
+        self.sentences.append((len(label.split()), len(prediction.split()),
+                               len(gold_predicates), len(pred_predicates),
+                               sum(matched.values())))
+
+
+def print_rows(header, rows):
+    rows = [[str(value) for value in row] for row in rows]
+    widths = [max([len(name)] + [len(row[i]) for row in rows])
+              for i, name in enumerate(header)]
+    for row in [header] + rows:
+        print('  '.join(value.ljust(width)
+                        for value, width in zip(row, widths)).rstrip())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import os
+import random
+import sys
+
+
+from functools import partial
+from tqdm import tqdm
+from parallel import imap_lines, add_workers_argument
+from postprocess_predictions import INVALID_GRAPH
+from transform_cache import add_cache_arguments, open_cache
+
+
+# What get_amr_line makes of the placeholder of an invalid prediction
+INVALID = INVALID_GRAPH.strip()
+
+# Prefixes smatch renames the nodes of the predicted and gold graphs with
+TEST_PREFIX = 'a'
+GOLD_PREFIX = 'b'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Computes the SMATCH precision, recall and F1 of '
+                    'postprocessed predictions against the gold graphs, '
+                    'scoring the pairs in parallel. Predictions that are '
+                    'identical to their gold graph or invalid are scored '
+                    'without hill-climbing.'
+    )
+    parser.add_argument('predicted', type=str,
+                        help='Predicted graphs (the output of '
+                             'postprocess_predictions.py).')
+    parser.add_argument('gold', type=str,
+                        help='Gold graphs.')
+    parser.add_argument('--restarts', type=int, default=4,
+                        help='Random restarts of the hill-climbing, after the '
+                             'smart initialization. (default=4, smatch\'s '
+                             'default of 5 iterations)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random restarts. Every pair is '
+                             'scored with it, so the result does not depend '
+                             'on the order or the number of workers. '
+                             '(default=0)')
+    parser.add_argument('--smatch', type=str,
+                        default=os.path.join(os.path.dirname(
+                            os.path.abspath(__file__)), 'smatch'),
+                        help='Directory of smatch.py. (default=the smatch '
+                             'submodule)')
+    parser.add_argument('--scores', type=str, default=None,
+                        help='Writes the match, predicted and gold triple '
+                             'counts of every pair to this file.')
+    add_workers_argument(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+
+    # Added before the workers are started, so they can import it too
+    sys.path.insert(0, args.smatch)
+    from amr import AMR
+
+    with open(args.predicted, 'r') as predicted, open(args.gold, 'r') as gold:
+        pairs = list(read_pairs(AMR.get_amr_line, predicted, gold))
+
+    options = {'restarts': args.restarts, 'seed': args.seed}
+    transform = partial(score_pair, **options)
+    cache = open_cache(args, 'smatch', options)
+
+    total = [0, 0, 0]
+    fast = 0
+    scores = open(args.scores, 'w') if args.scores else None
+    results = imap_lines(transform, ('\n'.join(pair) for pair in pairs),
+                         args.workers, cache=cache)
+    for pair, counts in zip(pairs, tqdm(results, total=len(pairs))):
+        for i, count in enumerate(counts):
+            total[i] += count
+        if pair[0] == INVALID or pair[0] == pair[1]:
+            fast += 1
+        if scores is not None:
+            scores.write('{}\t{}\t{}\n'.format(*counts))
+    if scores is not None:
+        scores.close()
+
+    precision, recall, f1 = compute_f(*total)
+    print('{} pairs, {} identical or invalid'.format(len(pairs), fast))
+    print('Precision: {:.4f}'.format(precision))
+    print('Recall: {:.4f}'.format(recall))
+    print('F-score: {:.4f}'.format(f1))
+
+    if cache is not None:
+        cache.close()
+        print(cache.stats())
+
+
+def read_pairs(get_amr_line, predicted, gold):
+    """
+    Reads (predicted, gold) pairs of one-line graphs the way smatch does:
+    graphs are separated by empty lines and pairs stop at the end of the
+    shorter file.
+    """
+
+    while True:
+        pred = get_amr_line(predicted)
+        label = get_amr_line(gold)
+        if not pred or not label:
+            if pred or label:
+                print('The files have a different number of graphs, '
+                      'ignoring the rest', file=sys.stderr)
+            return
+        yield pred, label
+
+
+def score_pair(pair, restarts=4, seed=0):
+    """
+    Scores a '<predicted>\n<gold>' pair of one-line graphs with smatch.
+
+    A prediction identical to its gold graph is scored with the mapping of
+    every node to itself. smatch counts what that mapping matches the same
+    way as for any other, so repeated triples count as often as they would
+    after hill-climbing. The invalid placeholder is a single node, so the
+    best mapping is found by trying every gold node, which is where
+    hill-climbing ends up too.
+    Anything else is hill-climbed from smatch's smart initialization and
+    restarts random ones, drawn from a generator seeded with seed for every
+    pair.
+
+    Return
+    ------
+    list
+        The number of matching triples, predicted triples and gold triples.
+    """
+
+    import smatch
+
+    pred, label = pair.split('\n')
+    pred_triples = _triples(smatch, pred, TEST_PREFIX)
+    gold_triples = _triples(smatch, label, GOLD_PREFIX)
+    if pred == label or pred == INVALID:
+        candidates, weights = smatch.compute_pool(
+            *pred_triples, *gold_triples, TEST_PREFIX, GOLD_PREFIX)
+        if pred == label:
+            match = smatch.compute_match(list(range(len(candidates))),
+                                         weights)
+        else:
+            match = max([weights[(0, node)][-1] for node in candidates[0]],
+                        default=0)
+    else:
+        # smatch reseeds the random module before every restart, which
+        # would make the scores differ between runs
+        smatch.random = _SeededRandom(seed)
+        smatch.iteration_num = restarts + 1
+        _, match = smatch.get_best_match(*pred_triples, *gold_triples,
+                                         TEST_PREFIX, GOLD_PREFIX)
+
+    # smatch caches the matches of each mapping, which only hold for a pair
+    smatch.match_triple_dict.clear()
+    return [match, sum(map(len, pred_triples)), sum(map(len, gold_triples))]
+
+
+def _triples(smatch, line, prefix):
+    graph = smatch.amr.AMR.parse_AMR_line(line)
+    if graph is None:
+        raise ValueError('smatch could not parse {!r}'.format(line))
+    graph.rename_node(prefix)
+    return graph.get_triples()
+
+
+class _SeededRandom(random.Random):
+    """
+    A random generator that ignores being reseeded from the system, so the
+    restarts of one pair draw from a single seeded sequence.
+    """
+
+    def seed(self, a=None, *args, **kwargs):
+        if a is not None:
+            super().seed(a, *args, **kwargs)
+
+
+def compute_f(match, test, gold):
+    """
+    Same as smatch's compute_f.
+
+    Return
+    ------
+    float, float, float
+        The precision, recall and F1.
+    """
+
+    if test == 0 or gold == 0:
+        return 0.0, 0.0, 0.0
+    precision = match / test
+    recall = match / gold
+    if precision + recall == 0:
+        return precision, recall, 0.0
+    return precision, recall, 2 * precision * recall / (precision + recall)
+
+
+if __name__ == '__main__':
+    main()
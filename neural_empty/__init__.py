@@ -0,0 +1,3 @@
+from neural_empty.dataset_readers import SimplifiedGraphDatasetReader
+from neural_empty.iterators import LengthBucketIterator
+from neural_empty.models import ConstrainedSeq2Seq
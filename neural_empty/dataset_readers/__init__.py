@@ -0,0 +1,2 @@
+from neural_empty.dataset_readers.simplified_graph import \
+    SimplifiedGraphDatasetReader
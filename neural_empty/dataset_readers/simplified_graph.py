@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import os
+
+
+from allennlp.common.checks import ConfigurationError
+from allennlp.common.file_utils import cached_path
+from allennlp.common.util import START_SYMBOL, END_SYMBOL
+from allennlp.data.dataset_readers.dataset_reader import DatasetReader
+from allennlp.data.fields import TextField
+from allennlp.data.instance import Instance
+from allennlp.data.tokenizers import Token
+from allennlp.data.token_indexers import TokenIndexer, SingleIdTokenIndexer
+from allennlp.data.vocabulary import Vocabulary
+
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+# Bump when the instances or the cache format change so old caches are not
+# reused
+CACHE_VERSION = 1
+
+
+@DatasetReader.register('simplified_graph')
+class SimplifiedGraphDatasetReader(DatasetReader):
+    """
+    Reads '<source>\t<target>' lines of simplified graphs (the output of
+    scripts/preprocess.py) into the same instances as the seq2seq reader
+    with just_spaces tokenization. Graph tokens are always separated by
+    spaces, so no tokenizer is needed.
+
+    If cache_directory is set, the tokens of every instance are stored there
+    the first time a file is read, keyed by a hash of the file and the
+    reader's options, and later reads (and runs) load them from the cache.
+    If vocabulary_directory is also set, the cached instances are indexed
+    with that vocabulary and the key includes a hash of its files. The model
+    has to be trained with the same vocabulary, e.g. the vocabulary/
+    directory of an earlier run given as the vocabulary's directory_path.
+
+    max_source_length and max_target_length drop the examples with more
+    tokens (not counting START and END). Only set them for the training
+    data, i.e. not in a validation_dataset_reader, so every dev graph is
+    still scored.
+
+    With lazy set, instances are streamed from the file or the cache on
+    every pass instead of being held in memory.
+    """
+
+    def __init__(self, source_token_indexers=None, target_token_indexers=None,
+                 source_add_start_token=True, max_source_length=None,
+                 max_target_length=None, cache_directory=None,
+                 vocabulary_directory=None, lazy=False):
+        super().__init__(lazy)
+        self._source_token_indexers = (source_token_indexers or
+                                       {'tokens': SingleIdTokenIndexer()})
+        self._target_token_indexers = (target_token_indexers or
+                                       self._source_token_indexers)
+        self._source_add_start_token = source_add_start_token
+        self._max_source_length = max_source_length
+        self._max_target_length = max_target_length
+        self._cache_directory = cache_directory
+        self._vocabulary_directory = vocabulary_directory
+        self._vocab = None
+        if vocabulary_directory is not None:
+            self._vocab = Vocabulary.from_files(vocabulary_directory)
+
+    def _read(self, file_path):
+        file_path = cached_path(file_path)
+        if self._cache_directory is None:
+            yield from self._read_lines(file_path)
+            return
+
+        cache_path = self._cache_path(file_path)
+        if os.path.exists(cache_path):
+            logger.info('Reading cached instances from %s', cache_path)
+            with open(cache_path, 'r') as cache:
+                for line in cache:
+                    yield self._from_cache(json.loads(line))
+            return
+
+        # The cache is only moved into place once the whole file has been
+        # read, so an interrupted pass does not leave a partial cache
+        os.makedirs(self._cache_directory, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as cache:
+                for instance in self._read_lines(file_path):
+                    cache.write(json.dumps(self._to_cache(instance)) + '\n')
+                    yield instance
+            os.replace(tmp_path, cache_path)
+            logger.info('Cached instances at %s', cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _read_lines(self, file_path):
+        dropped = 0
+        with open(file_path, 'r') as data_file:
+            logger.info('Reading instances from lines in file at: %s',
+                        file_path)
+            for line_num, line in enumerate(data_file):
+                line = line.strip('\n')
+                if not line:
+                    continue
+
+                line_parts = line.split('\t')
+                if len(line_parts) != 2:
+                    raise ConfigurationError(
+                        'Invalid line format: {} (line number {})'.format(
+                            line, line_num + 1))
+
+                if self._too_long(*line_parts):
+                    dropped += 1
+                    continue
+                yield self.text_to_instance(*line_parts)
+
+        if dropped:
+            logger.info('Dropped %d examples over the maximum length', dropped)
+
+    def _too_long(self, source_string, target_string):
+        return ((self._max_source_length is not None and
+                 len(source_string.split()) > self._max_source_length) or
+                (self._max_target_length is not None and
+                 len(target_string.split()) > self._max_target_length))
+
+    def text_to_instance(self, source_string, target_string=None):
+        # pylint: disable=arguments-differ
+        source_tokens = [Token(token) for token in source_string.split()]
+        if self._source_add_start_token:
+            source_tokens.insert(0, Token(START_SYMBOL))
+        source_tokens.append(Token(END_SYMBOL))
+        fields = {'source_tokens': TextField(source_tokens,
+                                             self._source_token_indexers)}
+
+        if target_string is not None:
+            target_tokens = [Token(token) for token in target_string.split()]
+            target_tokens.insert(0, Token(START_SYMBOL))
+            target_tokens.append(Token(END_SYMBOL))
+            fields['target_tokens'] = TextField(target_tokens,
+                                                self._target_token_indexers)
+
+        return Instance(fields)
+
+    def _to_cache(self, instance):
+        if self._vocab is not None:
+            instance.index_fields(self._vocab)
+
+        entry = {}
+        for name, field in instance.fields.items():
+            entry[name] = {'tokens': [token.text for token in field.tokens]}
+            if self._vocab is not None:
+                entry[name]['indices'] = field._indexed_tokens
+        return entry
+
+    def _from_cache(self, entry):
+        indexers = {'source_tokens': self._source_token_indexers,
+                    'target_tokens': self._target_token_indexers}
+
+        fields = {}
+        for name, cached in entry.items():
+            field = TextField([Token(token) for token in cached['tokens']],
+                              indexers[name])
+            if 'indices' in cached:
+                field._indexed_tokens = cached['indices']
+            fields[name] = field
+
+        instance = Instance(fields)
+
+        # The iterator would index the instance again otherwise
+        instance.indexed = self._vocab is not None
+        return instance
+
+    def _cache_path(self, file_path):
+        """
+        Return
+        ------
+        str
+            The cache file for file_path. Its name is a hash of the file's
+            contents, the reader's options and the vocabulary's files.
+        """
+
+        options = [CACHE_VERSION, self._source_add_start_token,
+                   self._max_source_length, self._max_target_length]
+        for indexers in [self._source_token_indexers,
+                         self._target_token_indexers]:
+            options.append(sorted(
+                (name, type(indexer).__name__, sorted(vars(indexer).items()))
+                for name, indexer in indexers.items()))
+
+        digest = hashlib.sha1(repr(options).encode('utf-8'))
+        _update_with_file(digest, file_path)
+        if self._vocabulary_directory is not None:
+            for name in sorted(os.listdir(self._vocabulary_directory)):
+                path = os.path.join(self._vocabulary_directory, name)
+                if os.path.isfile(path):
+                    digest.update(name.encode('utf-8'))
+                    _update_with_file(digest, path)
+
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(self._cache_directory, '{}.{}.jsonl'.format(
+            name, digest.hexdigest()))
+
+    @classmethod
+    def from_params(cls, params):
+        source_indexers = params.pop('source_token_indexers', None)
+        if source_indexers is not None:
+            source_indexers = TokenIndexer.dict_from_params(source_indexers)
+        target_indexers = params.pop('target_token_indexers', None)
+        if target_indexers is not None:
+            target_indexers = TokenIndexer.dict_from_params(target_indexers)
+        source_add_start_token = params.pop_bool('source_add_start_token', True)
+        max_source_length = params.pop_int('max_source_length', None)
+        max_target_length = params.pop_int('max_target_length', None)
+        cache_directory = params.pop('cache_directory', None)
+        vocabulary_directory = params.pop('vocabulary_directory', None)
+        lazy = params.pop_bool('lazy', False)
+        params.assert_empty(cls.__name__)
+        return cls(source_token_indexers=source_indexers,
+                   target_token_indexers=target_indexers,
+                   source_add_start_token=source_add_start_token,
+                   max_source_length=max_source_length,
+                   max_target_length=max_target_length,
+                   cache_directory=cache_directory,
+                   vocabulary_directory=vocabulary_directory,
+                   lazy=lazy)
+
+
+def _update_with_file(digest, path):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
@@ -0,0 +1 @@
+from neural_empty.iterators.length_bucket import LengthBucketIterator
@@ -0,0 +1,70 @@
+from allennlp.common.checks import ConfigurationError
+from allennlp.common.util import add_noise_to_dict_values
+from allennlp.data.iterators.bucket_iterator import BucketIterator
+from allennlp.data.iterators.data_iterator import DataIterator
+
+
+COMBINE = {'max': max, 'sum': sum}
+
+
+@DataIterator.register('length_bucket')
+class LengthBucketIterator(BucketIterator):
+    """
+    A bucket iterator that sorts by a single length combining all of
+    sorting_keys (their max or sum) instead of sorting by each key in turn.
+
+    The bucket iterator adds noise to every length, so its later keys only
+    break exact ties and batches sorted by the source length still pad the
+    target heavily. Graph targets are as long as their sources on average,
+    and the decoder runs for the longest target in the batch.
+    scripts/length_stats.py reports the padding of each sort key.
+    """
+
+    def __init__(self, sorting_keys, combine='max', padding_noise=0.1,
+                 biggest_batch_first=False, batch_size=32,
+                 instances_per_epoch=None, max_instances_in_memory=None):
+        if combine not in COMBINE:
+            raise ConfigurationError('combine has to be one of {}'.format(
+                sorted(COMBINE)))
+
+        self._combine = COMBINE[combine]
+        super().__init__(sorting_keys, padding_noise=padding_noise,
+                         biggest_batch_first=biggest_batch_first,
+                         batch_size=batch_size,
+                         instances_per_epoch=instances_per_epoch,
+                         max_instances_in_memory=max_instances_in_memory)
+
+    def _sort_by_padding(self, instances, sorting_keys, padding_noise=0.0):
+        keyed = []
+        for instance in instances:
+            # Make sure instance is indexed before calling .get_padding
+            instance.index_fields(self.vocab)
+            padding_lengths = instance.get_padding_lengths()
+            if padding_noise > 0.0:
+                padding_lengths = {
+                    name: add_noise_to_dict_values(lengths, padding_noise)
+                    for name, lengths in padding_lengths.items()
+                }
+            length = self._combine(padding_lengths[name][key]
+                                   for name, key in sorting_keys)
+            keyed.append((length, instance))
+
+        keyed.sort(key=lambda pair: pair[0])
+        return [instance for _, instance in keyed]
+
+    @classmethod
+    def from_params(cls, params):
+        sorting_keys = params.pop('sorting_keys')
+        combine = params.pop('combine', 'max')
+        padding_noise = params.pop_float('padding_noise', 0.1)
+        biggest_batch_first = params.pop_bool('biggest_batch_first', False)
+        batch_size = params.pop_int('batch_size', 32)
+        instances_per_epoch = params.pop_int('instances_per_epoch', None)
+        max_instances_in_memory = params.pop_int('max_instances_in_memory',
+                                                 None)
+        params.assert_empty(cls.__name__)
+        return cls(sorting_keys, combine=combine, padding_noise=padding_noise,
+                   biggest_batch_first=biggest_batch_first,
+                   batch_size=batch_size,
+                   instances_per_epoch=instances_per_epoch,
+                   max_instances_in_memory=max_instances_in_memory)
@@ -0,0 +1 @@
+from neural_empty.models.constrained_seq2seq import ConstrainedSeq2Seq
@@ -0,0 +1,253 @@
+import time
+
+
+import torch
+import torch.nn.functional as F
+
+
+from allennlp.common.util import START_SYMBOL, END_SYMBOL
+from allennlp.models.encoder_decoders.simple_seq2seq import SimpleSeq2Seq
+from allennlp.models.model import Model
+from allennlp.nn.util import get_text_field_mask
+
+
+from graph_constraints import TRANSITIONS, DEPTH_CHANGE, MIN_REMAINING, \
+                              NUM_STATES, NUM_KINDS, START, NODE_LABEL, \
+                              REENTRANT_LABEL, DONE, ROLE, CLOSE, LABEL, \
+                              OTHER, token_kind, can_reenter
+from postprocess_predictions import recover_prediction
+from scoring_service import RunScore
+from simplify_graph import reverse
+
+
+@Model.register('constrained_seq2seq')
+class ConstrainedSeq2Seq(SimpleSeq2Seq):
+    """
+    SimpleSeq2Seq whose greedy decoding only generates well-formed
+    simplified graphs, following graph_constraints.GraphState: the next
+    token is masked by the paren depth, what the graph expects next and the
+    labels of the nodes introduced so far. Decoding stops once every graph
+    in the batch has closed its root, and a graph is always closed before
+    max_decoding_steps runs out.
+
+    Training is unchanged and the parameters are the same as SimpleSeq2Seq,
+    so a trained simple_seq2seq archive can be evaluated with this model by
+    overriding its type. Set constrained to False to decode as
+    SimpleSeq2Seq does and compare.
+
+    Outside of training, the metrics are the share of invalid graphs and
+    the predicate F1 after postprocess_predictions.py's recovery (for
+    batches with targets), and the decoding time per graph in ms.
+    """
+
+    def __init__(self, vocab, source_embedder, encoder, max_decoding_steps,
+                 target_namespace='tokens', target_embedding_dim=None,
+                 attention_function=None, scheduled_sampling_ratio=0.0,
+                 constrained=True):
+        super().__init__(vocab, source_embedder, encoder, max_decoding_steps,
+                         target_namespace=target_namespace,
+                         target_embedding_dim=target_embedding_dim,
+                         attention_function=attention_function,
+                         scheduled_sampling_ratio=scheduled_sampling_ratio)
+        self._constrained = constrained
+        self._tables = self._constraint_tables()
+        self._score = RunScore()
+        self._decode_seconds = 0.0
+        self._decoded = 0
+
+    def _constraint_tables(self):
+        """
+        Vocabulary sized lookup tables of graph_constraints' rules. They are
+        not buffers, so the state dict stays the same as SimpleSeq2Seq's.
+        """
+
+        num_classes = self.vocab.get_vocab_size(self._target_namespace)
+        tokens = [self.vocab.get_token_from_index(i, self._target_namespace)
+                  for i in range(num_classes)]
+        kinds = [OTHER if token in (START_SYMBOL, END_SYMBOL)
+                 else token_kind(token) for token in tokens]
+
+        next_state = torch.full((NUM_STATES, NUM_KINDS), -1).long()
+        cost = torch.zeros(NUM_STATES, NUM_KINDS).long()
+        for (state, kind), following in TRANSITIONS.items():
+            next_state[state, kind] = following
+            cost[state, kind] = (MIN_REMAINING[following] +
+                                 DEPTH_CHANGE.get(kind, 0))
+
+        kinds = torch.LongTensor(kinds)
+        allowed = (next_state[:, kinds] >= 0)
+        allowed[DONE, self._end_index] = 1
+
+        return {
+            'kinds': kinds,
+            'next_state': next_state,
+            'depth_change': torch.LongTensor([DEPTH_CHANGE.get(kind, 0)
+                                              for kind in range(NUM_KINDS)]),
+            'allowed': allowed,
+            'cost': cost[:, kinds],
+            'not_roles': kinds != ROLE,
+            'reenterable': torch.ByteTensor([
+                kind == LABEL and can_reenter(token)
+                for kind, token in zip(kinds.tolist(), tokens)]),
+        }
+
+    def forward(self, source_tokens, target_tokens=None):
+        # pylint: disable=arguments-differ
+        if self.training:
+            return super().forward(source_tokens, target_tokens)
+
+        start = time.perf_counter()
+        if self._constrained:
+            output_dict = self._constrained_forward(source_tokens,
+                                                    target_tokens)
+        else:
+            output_dict = super().forward(source_tokens, target_tokens)
+        self._decode_seconds += time.perf_counter() - start
+        self._decoded += output_dict['predictions'].size(0)
+
+        if target_tokens:
+            self._score_batch(output_dict['predictions'],
+                              target_tokens['tokens'])
+        return output_dict
+
+    def _constrained_forward(self, source_tokens, target_tokens=None):
+        embedded_input = self._source_embedder(source_tokens)
+        batch_size, _, _ = embedded_input.size()
+        source_mask = get_text_field_mask(source_tokens)
+        encoder_outputs = self._encoder(embedded_input, source_mask)
+
+        # With targets the logits have to cover them for the loss, so
+        # decoding only stops early without. The graphs are then also closed
+        # within the target length, which SimpleSeq2Seq cuts them to anyway.
+        if target_tokens:
+            num_decoding_steps = target_tokens['tokens'].size(1) - 1
+        else:
+            num_decoding_steps = self._max_decoding_steps
+
+        device = source_mask.device
+        tables = {name: table.to(device)
+                  for name, table in self._tables.items()}
+        rows = torch.arange(batch_size, device=device).long()
+        state = source_mask.new_full((batch_size,), START).long()
+        depth = source_mask.new_zeros(batch_size).long()
+        labels = source_mask.new_zeros(batch_size,
+                                       tables['kinds'].size(0)).byte()
+
+        decoder_hidden = encoder_outputs[:, -1]
+        decoder_context = encoder_outputs.new_zeros(batch_size,
+                                                    self._decoder_output_dim)
+        last_predictions = source_mask.new_full((batch_size,),
+                                                self._start_index).long()
+        step_logits = []
+        step_probabilities = []
+        step_predictions = []
+        for timestep in range(num_decoding_steps):
+            decoder_input = self._prepare_decode_step_input(
+                last_predictions, decoder_hidden, encoder_outputs, source_mask)
+            decoder_hidden, decoder_context = self._decoder_cell(
+                decoder_input, (decoder_hidden, decoder_context))
+            output_projections = self._output_projection_layer(decoder_hidden)
+            step_logits.append(output_projections.unsqueeze(1))
+
+            allowed = self._allowed(tables, state, depth, labels,
+                                    num_decoding_steps - timestep)
+            masked = output_projections.masked_fill(allowed == 0,
+                                                    -float('inf'))
+            class_probabilities = F.softmax(masked, dim=-1)
+            _, predicted_classes = torch.max(masked, 1)
+
+            # Updates what every graph expects next
+            kinds = tables['kinds'][predicted_classes]
+            introduced = ((state == NODE_LABEL) &
+                          tables['reenterable'][predicted_classes])
+            labels[rows, predicted_classes] |= introduced
+            depth = depth + tables['depth_change'][kinds]
+            state = tables['next_state'][state, kinds]
+            state[(kinds == CLOSE) & (depth == 0)] = DONE
+
+            # The end symbol is the fallback when nothing else is allowed
+            state[state < 0] = DONE
+
+            step_probabilities.append(class_probabilities.unsqueeze(1))
+            step_predictions.append(predicted_classes.unsqueeze(1))
+            last_predictions = predicted_classes
+            if not target_tokens and bool((state == DONE).all()):
+                break
+
+        logits = torch.cat(step_logits, 1)
+        output_dict = {'logits': logits,
+                       'class_probabilities': torch.cat(step_probabilities, 1),
+                       'predictions': torch.cat(step_predictions, 1)}
+        if target_tokens:
+            target_mask = get_text_field_mask(target_tokens)
+            output_dict['loss'] = self._get_loss(
+                logits, target_tokens['tokens'], target_mask)
+        return output_dict
+
+    def _allowed(self, tables, state, depth, labels, steps_left):
+        """
+        Return
+        ------
+        torch.ByteTensor
+            (batch_size, num_classes) mask of the tokens each graph allows
+            next, given that steps_left tokens can still be generated.
+        """
+
+        allowed = tables['allowed'][state]
+
+        # Keeps enough steps to close every open node
+        allowed &= ((tables['cost'][state] + depth.unsqueeze(1))
+                    <= steps_left - 1)
+
+        # A reentrancy can only name a node introduced earlier, so a role
+        # without '(' needs at least one
+        allowed &= (state != REENTRANT_LABEL).unsqueeze(1) | labels
+        allowed &= ((labels.sum(1) > 0).unsqueeze(1) |
+                    tables['not_roles'].unsqueeze(0))
+
+        # Rows with nothing allowed (max_decoding_steps is too short) end
+        stuck = allowed.sum(1) == 0
+        allowed[stuck, self._end_index] = 1
+        return allowed
+
+    def _score_batch(self, predictions, targets):
+        recovered = []
+        gold = []
+        for predicted, target in zip(self._to_tokens(predictions),
+                                     self._to_tokens(targets[:, 1:])):
+            recovered.append(recover_prediction(' '.join(predicted)))
+            gold.append(reverse(' '.join(target)))
+        self._score.add(recovered, gold)
+
+    def _to_tokens(self, indices):
+        all_tokens = []
+        for row in indices.detach().cpu().tolist():
+            if self._end_index in row:
+                row = row[:row.index(self._end_index)]
+            all_tokens.append([
+                self.vocab.get_token_from_index(i, self._target_namespace)
+                for i in row])
+        return all_tokens
+
+    def get_metrics(self, reset=False):
+        metrics = {}
+        if self._score.graphs:
+            score = self._score.metrics()
+            metrics['invalid_rate'] = (sum(score['invalid'].values())
+                                       / score['graphs'])
+            metrics['predicate_f1'] = score['total']['f1']
+        if self._decoded:
+            metrics['decode_ms'] = 1000 * self._decode_seconds / self._decoded
+
+        if reset:
+            self._score = RunScore()
+            self._decode_seconds = 0.0
+            self._decoded = 0
+        return metrics
+
+    @classmethod
+    def from_params(cls, vocab, params):
+        constrained = params.pop_bool('constrained', True)
+        model = super().from_params(vocab, params)
+        model._constrained = constrained
+        return model
@@ -0,0 +1,194 @@
+import argparse
+import logging
+import time
+import numpy as np
+
+
+from collections import Counter
+from tqdm import tqdm
+from postprocess_predictions import recover_prediction
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Predicts graphs with a trained model archive and writes '
+                    'them in a format that can be evaluated using SMATCH. '
+                    'Sentences are batched by length on the CPU, and the '
+                    'throughput and the per-sentence and per-batch latency '
+                    'are reported.'
+    )
+    parser.add_argument('archive', type=str,
+                        help='Trained model archive, e.g. '
+                             'models/baseline/model.tar.gz.')
+    parser.add_argument('input', type=str,
+                        help='Source sentences, one per line, or the output '
+                             'of preprocess.py (only the source is used).')
+    parser.add_argument('output', type=str,
+                        help='Output file.')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='Sentences per batch. (default=64)')
+    parser.add_argument('--window', type=int, default=16,
+                        help='Sorts sentences by length within windows of '
+                             'this many batches, so graphs are written as '
+                             'each window is done. 0 sorts the whole input, '
+                             'which pads the least but writes nothing until '
+                             'almost every graph is predicted. (default=16)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Number of threads torch uses. (default=torch\'s '
+                             'default)')
+    parser.add_argument('--cuda-device', type=int, default=-1,
+                        help='GPU to predict on. (default=-1, the CPU)')
+    parser.add_argument('--overrides', type=str, default='',
+                        help='JSON overrides of the archive\'s config, e.g. '
+                             '\'{"model": {"constrained": false}}\'.')
+    parser.add_argument('--include-package', type=str, nargs='+',
+                        default=['neural_empty'],
+                        help='Packages with the registered models and dataset '
+                             'readers. (default=neural_empty)')
+    parser.add_argument('--raw', type=str, default=None,
+                        help='Also writes the predicted tokens, one graph per '
+                             'line, to this file.')
+    parser.add_argument('--remove-all-features', action='store_true',
+                        help='Removes all features.')
+    parser.add_argument('--include-features', nargs='+', default=[],
+                        help='Features to include separated by spaces.')
+    args = parser.parse_args()
+
+    # Imported here so --help works without torch
+    import torch
+    from allennlp.common.util import import_submodules
+    from allennlp.data.dataset_readers.dataset_reader import DatasetReader
+    from allennlp.models.archival import load_archive
+
+    logging.getLogger('allennlp.common.params').disabled = True
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    for package in args.include_package:
+        import_submodules(package)
+
+    archive = load_archive(args.archive, args.cuda_device, args.overrides)
+    model = archive.model
+    model.eval()
+
+    # The validation reader is the one that does not drop long examples
+    config = archive.config
+    reader_params = config.pop('validation_dataset_reader', None)
+    if reader_params is None:
+        reader_params = config.pop('dataset_reader')
+    reader = DatasetReader.from_params(reader_params)
+
+    with open(args.input, 'r') as f:
+        sources = [line.rstrip('\n').split('\t')[0] for line in f]
+
+    options = {'include_features': args.include_features,
+               'remove_all_features': args.remove_all_features}
+
+    failures = Counter()
+    latencies = []
+    sizes = []
+    start = time.perf_counter()
+    with open(args.output, 'w') as output:
+        raw = open(args.raw, 'w') if args.raw else None
+        writer = OrderedWriter(output, raw)
+        progress = tqdm(total=len(sources))
+        for indices, preds, latency in predict_batches(
+                model, reader, sources, args.batch_size, options,
+                args.window):
+            latencies.append(latency)
+            sizes.append(len(indices))
+            for index, (pred, recovered) in zip(indices, preds):
+                if recovered[1]:
+                    failures[recovered[1]] += 1
+                writer.add(index, pred, recovered[0])
+            progress.update(len(indices))
+        progress.close()
+        if raw is not None:
+            raw.close()
+    elapsed = time.perf_counter() - start
+
+    print_report(len(sources), elapsed, latencies, sizes, args.batch_size)
+    print('{} of {} graphs were invalid'.format(sum(failures.values()),
+                                                len(sources)))
+    for reason, count in failures.most_common():
+        print('{:<20} {}'.format(reason, count))
+
+
+def predict_batches(model, reader, sources, batch_size, options={},
+                    window=16):
+    """
+    Predicts the graphs of sources in batches of similar length, so little
+    of each batch is padding. Sources are sorted within windows of window
+    batches (the whole input if 0), so the batches of a window are done
+    before any later source is predicted.
+
+    Return
+    ------
+    iterator
+        For every batch, the indices of its sources, a (prediction, result
+        of recover_prediction) pair per source and the seconds the batch
+        took from its instances to the recovered graphs.
+    """
+
+    size = window * batch_size if window > 0 else len(sources)
+    order = []
+    for begin in range(0, len(sources), max(size, 1)):
+        order.extend(sorted(range(begin, min(begin + size, len(sources))),
+                            key=lambda i: len(sources[i].split())))
+    for begin in range(0, len(order), batch_size):
+        indices = order[begin:begin + batch_size]
+        start = time.perf_counter()
+        instances = [reader.text_to_instance(sources[i]) for i in indices]
+        outputs = model.forward_on_instances(instances)
+        preds = [' '.join(output['predicted_tokens']) for output in outputs]
+        recovered = [recover_prediction(pred, **options) for pred in preds]
+        yield indices, list(zip(preds, recovered)), time.perf_counter() - start
+
+
+class OrderedWriter:
+    """
+    Writes graphs in the order of the input although they are predicted in
+    length order, as soon as all the graphs before them are done. At most
+    one window of predict_batches is held back.
+    """
+
+    def __init__(self, output, raw=None):
+        self.output = output
+        self.raw = raw
+        self.pending = {}
+        self.written = 0
+
+    def add(self, index, pred, graph):
+        self.pending[index] = (pred, graph)
+        while self.written in self.pending:
+            pred, graph = self.pending.pop(self.written)
+
+            # Graphs are separated by an empty line, as in
+            # postprocess_predictions.py
+            if self.written > 0:
+                self.output.write('\n')
+            self.output.write(graph)
+            if self.raw is not None:
+                self.raw.write(pred + '\n')
+            self.written += 1
+
+
+def print_report(sentences, elapsed, latencies, sizes, batch_size):
+    """
+    Prints the throughput and the latency percentiles. A sentence's graph is
+    ready when its batch is, so its latency is that of its batch, counted
+    once per sentence.
+    """
+
+    print('{} sentences in {:.1f}s: {:.1f} sentences/sec'.format(
+        sentences, elapsed, sentences / elapsed if elapsed else 0.0))
+    if latencies:
+        for name, values in [('Sentence', np.repeat(latencies, sizes)),
+                             ('Batch', np.array(latencies))]:
+            p50, p95 = np.percentile(values, [50, 95]) * 1000
+            print('{} latency (batch size {}): p50 {:.1f}ms, p95 {:.1f}ms, '
+                  'max {:.1f}ms'.format(name, batch_size, p50, p95,
+                                         values.max() * 1000))
+
+
+if __name__ == '__main__':
+    main()
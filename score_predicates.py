@@ -0,0 +1,224 @@
+import argparse
+import numpy as np
+
+
+from calculate_predicate_f1 import get_predicates
+
+
+# Sparse count vectors are stored as sorted int64 keys where the graph index
+# is in the high bits and the predicate id in the low bits
+ID_BITS = 32
+
+CATEGORIES = ['abstract', 'surface']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Computes the precision, recall, and F1 on predicates for '
+                    'any number of predicted files against the same source '
+                    'graphs, with optional paired bootstrap significance '
+                    'against the first predicted file.'
+    )
+    parser.add_argument('source', type=str,
+                        help='Source graphs.')
+    parser.add_argument('predicted', type=str, nargs='+',
+                        help='Predicted graphs, e.g. one file per checkpoint.')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help='Number of bootstrap samples. 0 turns off '
+                             'confidence intervals and significance testing.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed for bootstrap resampling.')
+    args = parser.parse_args()
+
+    vocab = {}
+    gold = read_counts(args.source, vocab)
+
+    systems = []
+    for path in args.predicted:
+        pred = read_counts(path, vocab)
+        systems.append(score_counts(gold, pred, vocab))
+
+    for path, stats in zip(args.predicted, systems):
+        print(path)
+        print('------------------------------')
+        for category in CATEGORIES + ['total']:
+            precision, recall, f1 = prf(*stats[category].sum(axis=1))
+            print('{:<10} P: {:.2f}  R: {:.2f}  F1: {:.2f}'.format(
+                category.capitalize(), precision, recall, f1))
+
+        if args.bootstrap and stats is not systems[0]:
+            result = paired_bootstrap(systems[0]['total'], stats['total'],
+                                      args.bootstrap, args.seed)
+            print('Delta F1 vs {}: {:+.4f} (95% CI {:+.4f} to {:+.4f}), '
+                  'p = {:.4f}'.format(args.predicted[0], result['delta'],
+                                      *result['delta_ci'], result['p_value']))
+        elif args.bootstrap:
+            low, high = bootstrap_ci(stats['total'], args.bootstrap, args.seed)
+            print('Total F1 95% CI: {:.4f} to {:.4f}'.format(low, high))
+        print()
+
+
+def read_counts(path, vocab):
+    with open(path, 'r') as f:
+        return predicate_counts(f, vocab)
+
+
+def predicate_counts(graphs, vocab):
+    """
+    Interns the predicates of every graph and builds one sparse count vector
+    per graph.
+
+    vocab maps predicates to integer ids and is updated in place, so gold
+    and predicted graphs have to be counted with the same vocab.
+
+    Return
+    ------
+    np.ndarray, np.ndarray, int
+        Sorted keys (graph index << ID_BITS | predicate id), the count for
+        each key and the number of graphs.
+    """
+
+    keys = []
+    num_graphs = 0
+    for i, graph in enumerate(graphs):
+        surface, abstract = get_predicates(graph)
+        offset = i << ID_BITS
+        keys.extend(offset + vocab.setdefault(pred, len(vocab))
+                    for pred in surface + abstract)
+        num_graphs = i + 1
+
+    keys, counts = np.unique(np.array(keys, dtype=np.int64),
+                             return_counts=True)
+    return keys, counts, num_graphs
+
+
+def score_counts(gold, pred, vocab):
+    """
+    Computes matched, gold and predicted predicate counts for every graph
+    pair at once. A predicate that appears n times in the gold graph and m
+    times in the predicted graph counts as min(n, m) matches.
+
+    Graphs are paired by index. Like calculate_predicate_f1.py, extra graphs
+    in the longer file are ignored.
+
+    Return
+    ------
+    dict
+        Maps 'abstract', 'surface' and 'total' to an int64 array of shape
+        (3, num_graphs) holding the matched, gold and predicted counts.
+    """
+
+    gold_keys, gold_counts, num_gold = gold
+    pred_keys, pred_counts, num_pred = pred
+    num_graphs = min(num_gold, num_pred)
+
+    is_surface = np.zeros(len(vocab), dtype=bool)
+    for pred_name, i in vocab.items():
+        is_surface[i] = pred_name.startswith('_')
+
+    _, gold_index, pred_index = np.intersect1d(gold_keys, pred_keys,
+                                               assume_unique=True,
+                                               return_indices=True)
+    matched_keys = gold_keys[gold_index]
+    matched = np.minimum(gold_counts[gold_index], pred_counts[pred_index])
+
+    stats = {}
+    for category, mask in [('abstract', ~is_surface), ('surface', is_surface)]:
+        stats[category] = np.stack([
+            graph_sums(matched_keys, matched, mask, num_graphs),
+            graph_sums(gold_keys, gold_counts, mask, num_graphs),
+            graph_sums(pred_keys, pred_counts, mask, num_graphs),
+        ])
+    stats['total'] = stats['abstract'] + stats['surface']
+    return stats
+
+
+def graph_sums(keys, counts, mask, num_graphs):
+    """
+    Sums counts per graph, keeping only predicates selected by mask.
+    """
+
+    graphs = keys >> ID_BITS
+    keep = mask[keys & ((1 << ID_BITS) - 1)] & (graphs < num_graphs)
+    return np.bincount(graphs[keep], weights=counts[keep],
+                       minlength=num_graphs).astype(np.int64)
+
+
+def prf(matched, gold, pred):
+    """
+    Return
+    ------
+    float, float, float
+        Precision, recall and F1. Empty denominators give 0.
+    """
+
+    precision = matched / pred if pred else 0.0
+    recall = matched / gold if gold else 0.0
+    if precision + recall == 0:
+        return precision, recall, 0.0
+    return precision, recall, 2 * precision * recall / (precision + recall)
+
+
+def resampled_f1(stats, samples, seed, batch_size=100):
+    """
+    Corpus F1 of stats (a (3, num_graphs) array as returned by score_counts)
+    for each of the bootstrap samples. Graph indices are drawn with the
+    given seed, so two systems resampled with the same seed are paired.
+    """
+
+    rng = np.random.RandomState(seed)
+    num_graphs = stats.shape[1]
+    f1s = []
+
+    # Samples are drawn in batches so memory is batch_size * num_graphs
+    for start in range(0, samples, batch_size):
+        size = min(batch_size, samples - start)
+        index = rng.randint(0, num_graphs, size=(size, num_graphs))
+        matched, gold, pred = stats[:, index].sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(pred > 0, matched / pred, 0.0)
+            recall = np.where(gold > 0, matched / gold, 0.0)
+            f1 = np.where(precision + recall > 0,
+                          2 * precision * recall / (precision + recall), 0.0)
+        f1s.append(f1)
+    return np.concatenate(f1s)
+
+
+def bootstrap_ci(stats, samples=1000, seed=0, alpha=0.05):
+    f1s = resampled_f1(stats, samples, seed)
+    return tuple(np.percentile(f1s, [100 * alpha / 2, 100 * (1 - alpha / 2)]))
+
+
+def paired_bootstrap(stats_a, stats_b, samples=1000, seed=0, alpha=0.05):
+    """
+    Paired bootstrap test (Koehn, 2004) of whether system b's F1 differs
+    from system a's. Both systems are resampled with the same graph indices.
+
+    Return
+    ------
+    dict
+        'delta' is F1(b) - F1(a) on the full corpus, 'delta_ci' its
+        confidence interval and 'p_value' the fraction of samples in which b
+        does not beat a (or a does not beat b, if b is worse).
+    """
+
+    f1_a = resampled_f1(stats_a, samples, seed)
+    f1_b = resampled_f1(stats_b, samples, seed)
+    deltas = f1_b - f1_a
+
+    delta = prf(*stats_b.sum(axis=1))[2] - prf(*stats_a.sum(axis=1))[2]
+    if delta >= 0:
+        p_value = np.mean(deltas <= 0)
+    else:
+        p_value = np.mean(deltas >= 0)
+
+    return {
+        'delta': delta,
+        'delta_ci': tuple(np.percentile(deltas, [100 * alpha / 2,
+                                                 100 * (1 - alpha / 2)])),
+        'p_value': float(p_value),
+    }
+
+
+if __name__ == '__main__':
+    main()
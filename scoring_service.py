@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+
+
+from collections import Counter
+from calculate_predicate_f1 import get_predicates
+from postprocess_predictions import recover_prediction
+from score_predicates import CATEGORIES, prf
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Long-lived service that postprocesses predicted graphs '
+                    'and scores their predicates in memory. Reads one JSON '
+                    'request per line from stdin (or from each connection '
+                    'to --socket) and replies with the running metrics of '
+                    'the request\'s run after every batch.'
+    )
+    parser.add_argument('--source', type=str, default=None,
+                        help='Source graphs, one per line. Empty lines are '
+                             'skipped, so graphs separated by empty lines as '
+                             'for SMATCH work too. The predictions of a run '
+                             'are paired with them in order, unless a '
+                             'request has its own "gold" list.')
+    parser.add_argument('--socket', type=str, default=None,
+                        help='Listens on this Unix socket instead of stdin.')
+    parser.add_argument('--remove-all-features', action='store_true',
+                        help='Removes all features.')
+    parser.add_argument('--include-features', nargs='+', default=[],
+                        help='Features to include separated by spaces.')
+    args = parser.parse_args()
+
+    gold = read_gold(args.source) if args.source else None
+
+    service = ScoringService(gold, {
+        'include_features': args.include_features,
+        'remove_all_features': args.remove_all_features
+    })
+
+    if args.socket:
+        serve_socket(service, args.socket)
+    else:
+        serve_lines(service, sys.stdin, sys.stdout)
+
+
+def read_gold(path):
+    """
+    Reads one graph per line, skipping empty lines, so both the one graph
+    per line source files and the empty line separated files that SMATCH
+    reads line up with the predictions.
+    """
+
+    with open(path, 'r') as f:
+        return [line for line in f if line.strip()]
+
+
+class RunScore:
+    """
+    Running predicate counts of one run (e.g. one epoch's predictions).
+    Counts a predicate that appears n times in the gold graph and m times in
+    the predicted graph as min(n, m) matches, like calculate_predicate_f1.py.
+    """
+
+    def __init__(self, output=None):
+        self.graphs = 0
+        self.failures = Counter()
+
+        # matched, gold and predicted counts per category
+        self.counts = {category: [0, 0, 0] for category in CATEGORIES}
+        self.output = open(output, 'w') if output else None
+
+    def add(self, recovered, gold):
+        for (pred, reason), label in zip(recovered, gold):
+            if reason:
+                self.failures[reason] += 1
+
+            # Graphs are separated by an empty line, as in
+            # postprocess_predictions.py
+            if self.output is not None:
+                if self.graphs > 0:
+                    self.output.write('\n')
+                self.output.write(pred)
+            self.graphs += 1
+
+            pred_predicates = get_predicates(pred)
+            gold_predicates = get_predicates(label)
+            for category, gold_preds, pred_preds in zip(
+                    ['surface', 'abstract'], gold_predicates, pred_predicates):
+                counts = self.counts[category]
+                counts[0] += sum((Counter(gold_preds)
+                                  & Counter(pred_preds)).values())
+                counts[1] += len(gold_preds)
+                counts[2] += len(pred_preds)
+
+    def metrics(self):
+        counts = dict(self.counts)
+        counts['total'] = [sum(values) for values in zip(*counts.values())]
+
+        metrics = {'graphs': self.graphs, 'invalid': dict(self.failures)}
+        for category in CATEGORIES + ['total']:
+            precision, recall, f1 = prf(*counts[category])
+            metrics[category] = {'precision': precision, 'recall': recall,
+                                 'f1': f1}
+        return metrics
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+
+
+class ScoringService:
+    """
+    Scores batches of predicted graphs for any number of named runs.
+
+    A request is a JSON object:
+
+        {"run": "epoch-3", "predictions": [...], "gold": [...],
+         "output": "path", "graphs": true, "end": true}
+
+    Only "run" is required. "gold" defaults to the next lines of the source
+    graphs, "output" (read with the first batch of a run) writes the
+    recovered graphs to a file for SMATCH, "graphs" returns them in the
+    reply and "end" drops the run once its final metrics are returned.
+    Replies hold the metrics of every batch of the run so far, or an
+    "error".
+    """
+
+    def __init__(self, gold=None, options={}):
+        self.gold = gold
+        self.options = options
+        self.runs = {}
+        self.lock = threading.Lock()
+
+    def handle_line(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('request has to be a JSON object')
+            return self.handle(request)
+        except (ValueError, TypeError, KeyError, OSError) as e:
+            return {'error': str(e)}
+
+    def handle(self, request):
+        run = request['run']
+        predictions = request.get('predictions', [])
+
+        with self.lock:
+            if run not in self.runs:
+                self.runs[run] = RunScore(request.get('output'))
+            score = self.runs[run]
+
+            gold = request.get('gold')
+            if gold is None:
+                if self.gold is None:
+                    raise ValueError('no gold graphs: start the service with '
+                                     '--source or send "gold"')
+                gold = self.gold[score.graphs:score.graphs + len(predictions)]
+            if len(gold) != len(predictions):
+                raise ValueError('{} predictions but {} gold graphs'.format(
+                    len(predictions), len(gold)))
+
+            recovered = [recover_prediction(pred, **self.options)
+                         for pred in predictions]
+            score.add(recovered, gold)
+
+            reply = {'run': run}
+            reply.update(score.metrics())
+            if request.get('graphs'):
+                reply['predictions'] = [pred for pred, _ in recovered]
+            if request.get('end'):
+                score.close()
+                del self.runs[run]
+                reply['end'] = True
+            return reply
+
+
+def serve_lines(service, requests, replies):
+    for line in requests:
+        if not line.strip():
+            continue
+
+        # Flushes so a client can read each reply as soon as it is written
+        replies.write(json.dumps(service.handle_line(line)) + '\n')
+        replies.flush()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = self.server.service.handle_line(line.decode('utf-8'))
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+def serve_socket(service, path):
+    """
+    Serves requests on a Unix socket until interrupted. Each connection is
+    handled in its own thread, so a trainer can keep one connection open
+    and read replies while it trains. Runs are shared between connections.
+    """
+
+    if os.path.exists(path):
+        os.unlink(path)
+
+    with socketserver.ThreadingUnixStreamServer(path, _RequestHandler) as server:
+        server.service = service
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,15 @@
 import argparse
+import os
 import re
+import sqlite3
+import tempfile
+
+
+from parallel import imap_lines, add_workers_argument
+from penman_reader import read_blocks
+
+
+DATASETS = ['train', 'dev', 'test']
 
 
 def main():
@@ -7,59 +17,227 @@ def main():
         description='Takes parallel penman graphs and removes entries in which '
                     'graphs could not be generated. Keeps only graphs with '
                     'were able to be parsed in both languages')
-    parser.add_argument('input_lang1', type=str,
+    parser.add_argument('input_lang1', type=str, nargs='?',
                         help='File for the first language graphs.')
-    parser.add_argument('input_lang2', type=str,
+    parser.add_argument('input_lang2', type=str, nargs='?',
                         help='File for the second language graphs.')
-    parser.add_argument('output1', type=str,
+    parser.add_argument('output1', type=str, nargs='?',
                         help='Output file for the first language.')
-    parser.add_argument('output2', type=str,
+    parser.add_argument('output2', type=str, nargs='?',
                         help='Output file for the second language.')
+    parser.add_argument('--data-root', type=str,
+                        help='Aggregates every train/dev/test.{en,jp}/*/graphs '
+                             'pair under this directory in one run instead of '
+                             'a single pair of files.')
+    parser.add_argument('--output-dir', type=str,
+                        help='Where to write {train,dev,test}.{en,jp} when '
+                             'using --data-root.')
+    parser.add_argument('--sub-dirs', type=str, nargs='+', default=None,
+                        help='Only aggregate subdirectories starting with one '
+                             'of these prefixes when using --data-root.')
+    add_workers_argument(parser)
     args = parser.parse_args()
 
-    with open(args.input_lang1, 'r') as text:
-        text = list(reversed(text.readlines()))
-        eng_id = map_parses(text)
-
-    with open(args.input_lang2, 'r') as text:
-        text = list(reversed(text.readlines()))
-        jpn_id = map_parses(text)
+    if args.data_root:
+        if not args.output_dir:
+            parser.error('--output-dir is required with --data-root')
+        aggregate_root(args.data_root, args.output_dir, args.sub_dirs,
+                       args.workers)
+        return
 
-    # Set intersction between the graph IDs
-    common_keys = list(eng_id.keys() & jpn_id.keys())
+    if not (args.input_lang1 and args.input_lang2
+            and args.output1 and args.output2):
+        parser.error('input_lang1, input_lang2, output1 and output2 are '
+                     'required without --data-root')
 
     with open(args.output1, 'a') as lang1, \
         open(args.output2, 'a') as lang2:
-        for key in common_keys:
-            for line in eng_id[key]:
-                lang1.write(line)
-                lang1.write('\n')
-            lang1.write('\n')
+        write_parses(align_parses((args.input_lang1, args.input_lang2)),
+                     lang1, lang2)
 
-            for line in jpn_id[key]:
-                lang2.write(line)
-                lang2.write('\n')
-            lang2.write('\n')
 
+def aggregate_root(data_root, output_dir, sub_dirs=None, workers=1):
+    """
+    Aggregates every subdirectory pair of each dataset into
+    output_dir/{dataset}.{en,jp}. Subdirectories are written in sorted
+    order regardless of how many workers parse them.
+    """
 
-def map_parses(graphs):
-    id_map = {}
-    while graphs:
-        parse = []
-        while graphs and graphs[-1].strip():
-            feat = graphs.pop().strip()
+    for dataset in DATASETS:
+        pairs = find_graph_pairs(data_root, dataset, sub_dirs)
+        if pairs is None:
+            continue
 
-            if feat.startswith('# ::id'):
-                id_map[feat] = parse
-            elif feat.startswith('#'):
-                continue
+        print('aggregating {}'.format(dataset))
+        with open(os.path.join(output_dir, dataset + '.en'), 'w') as lang1, \
+            open(os.path.join(output_dir, dataset + '.jp'), 'w') as lang2:
+            if workers <= 1:
+                for pair in pairs:
+                    write_parses(align_parses(pair), lang1, lang2)
             else:
-                parse.append(feat)
+                for aligned in imap_lines(align_parses_list, pairs, workers,
+                                          chunksize=1):
+                    write_parses(aligned, lang1, lang2)
+
+
+def find_graph_pairs(data_root, dataset, sub_dirs=None):
+    """
+    Return
+    ------
+    list or None
+        (en graphs, jp graphs) paths for every subdirectory of dataset.en
+        that has graphs in both languages, in sorted order. None if
+        dataset.en does not exist.
+    """
+
+    en_dir = os.path.join(data_root, dataset + '.en')
+    jp_dir = os.path.join(data_root, dataset + '.jp')
+    if not os.path.isdir(en_dir):
+        return None
+
+    pairs = []
+    for sub in sorted(os.listdir(en_dir)):
+        if sub_dirs and not any(sub.startswith(prefix) for prefix in sub_dirs):
+            continue
+
+        en_graphs = os.path.join(en_dir, sub, 'graphs')
+        jp_graphs = os.path.join(jp_dir, sub, 'graphs')
+        if os.path.exists(en_graphs) and os.path.exists(jp_graphs):
+            pairs.append((en_graphs, jp_graphs))
+    return pairs
+
+
+def align_parses(paths):
+    """
+    Aligns the graphs of two files by their '# ::id' line, streaming both
+    files so memory does not grow with their size.
+
+    If the ids of both files are sorted, the files are merge-joined.
+    Otherwise the graphs are indexed in a temporary SQLite database on disk.
+    Either way, pairs come out in the order their ids first appear in the
+    first file.
+
+    Return
+    ------
+    iterator
+        (first language lines, second language lines) for every graph id
+        parsed in both of the files in paths.
+    """
+
+    path1, path2 = paths
+    if ids_sorted(path1) and ids_sorted(path2):
+        return merge_join(path1, path2)
+    return indexed_join(path1, path2)
+
+
+def align_parses_list(paths):
+    # Worker processes have to send back a list rather than a generator
+    return list(align_parses(paths))
+
+
+def iter_parses(lines):
+    """
+    Yields (id, parse) for each block in lines. Blocks without an id are
+    skipped.
+    """
 
-        # pop off space separating graphs
-        if graphs:
-            graphs.pop()
-    return id_map
+    for block in read_blocks(lines):
+        if block.id is not None:
+            yield block.id, block.lines
+
+
+def id_key(graph_id):
+    """
+    Sort key for '# ::id' lines. Numeric ids sort numerically and the whole
+    line breaks ties, so keys are only equal for identical lines.
+    """
+
+    value = graph_id[len('# ::id'):].strip()
+    if value.isdigit():
+        return (0, int(value), graph_id)
+    return (1, value, graph_id)
+
+
+def ids_sorted(path):
+    """
+    Returns True if the ids in path are strictly increasing by id_key.
+    """
+
+    last = None
+    with open(path, 'r') as text:
+        for line in text:
+            line = line.strip()
+            if line.startswith('# ::id'):
+                key = id_key(line)
+                if last is not None and key <= last:
+                    return False
+                last = key
+    return True
+
+
+def merge_join(path1, path2):
+    with open(path1, 'r') as text1, open(path2, 'r') as text2:
+        parses1 = iter_parses(text1)
+        parses2 = iter_parses(text2)
+        id1, parse1 = next(parses1, (None, None))
+        id2, parse2 = next(parses2, (None, None))
+        while id1 is not None and id2 is not None:
+            key1, key2 = id_key(id1), id_key(id2)
+            if key1 == key2:
+                yield parse1, parse2
+                id1, parse1 = next(parses1, (None, None))
+                id2, parse2 = next(parses2, (None, None))
+            elif key1 < key2:
+                id1, parse1 = next(parses1, (None, None))
+            else:
+                id2, parse2 = next(parses2, (None, None))
+
+
+def indexed_join(path1, path2):
+    """
+    Joins unsorted files through a temporary SQLite index. As with a dict,
+    a repeated id keeps the position of its first occurrence and the graph
+    of its last one.
+    """
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = sqlite3.connect(os.path.join(tmp_dir, 'index.db'))
+        try:
+            for table, path in [('lang1', path1), ('lang2', path2)]:
+                db.execute('CREATE TABLE {} (id TEXT PRIMARY KEY, '
+                           'pos INTEGER, parse TEXT)'.format(table))
+                with open(path, 'r') as text:
+                    db.executemany(
+                        'INSERT INTO {} VALUES (?, ?, ?) ON CONFLICT(id) '
+                        'DO UPDATE SET parse = excluded.parse'.format(table),
+                        ((graph_id, pos, '\n'.join(parse)) for pos, (graph_id, parse)
+                         in enumerate(iter_parses(text)))
+                    )
+
+            rows = db.execute('SELECT lang1.parse, lang2.parse FROM lang1 '
+                              'JOIN lang2 ON lang1.id = lang2.id '
+                              'ORDER BY lang1.pos')
+            for parse1, parse2 in rows:
+                yield split_parse(parse1), split_parse(parse2)
+        finally:
+            db.close()
+
+
+def split_parse(parse):
+    return parse.split('\n') if parse else []
+
+
+def write_parses(aligned, lang1, lang2):
+    for eng_parse, jpn_parse in aligned:
+        for line in eng_parse:
+            lang1.write(line)
+            lang1.write('\n')
+        lang1.write('\n')
+
+        for line in jpn_parse:
+            lang2.write(line)
+            lang2.write('\n')
+        lang2.write('\n')
 
 
 if __name__ == '__main__':
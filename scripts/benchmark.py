@@ -0,0 +1,472 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+from functools import partial
+from aggregate_cleaner import align_parses
+from parallel import imap_lines
+from graph_corpus import GraphCorpus, parse_line, write_corpus
+from penman_reader import read_blocks, clean_block, clean_pairs
+from simplify_graph import simplify, simplify_regex, reverse, reverse_regex, \
+                           transform_graphs, expand, squash, squash_regex, \
+                           filter_feats, filter_feats_regex, \
+                           find_features, check_parens, check_parens_stack, \
+                           validate, get_all_nodes_pattern
+from synthetic_graphs import generate_lines
+
+# calculate_predicate_f1.py lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from calculate_predicate_f1 import get_predicates
+
+
+# Depths of the chain graphs (each node the only child of the one before)
+# that the features and suite benchmarks time, so work that grows with the
+# depth of a graph shows up
+DEEP_TIERS = [500, 5000]
+DEEP_COUNT = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Times graph transforms on a file of tab separated graph '
+                    'pairs (i.e. the output of clean_parse.py) and reports '
+                    'throughput in graphs per second. The blocks benchmark '
+                    'reads raw parser output instead. The suite benchmark '
+                    'generates its own graphs and compares the throughput '
+                    'with a saved baseline.'
+    )
+    parser.add_argument('benchmark', type=str, choices=sorted(BENCHMARKS),
+                        help='Which transform to time.')
+    parser.add_argument('input', type=str, nargs='?', default=None,
+                        help='Input file, e.g. the full train split. Not used '
+                             'by the suite benchmark.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs. The best run is reported.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16],
+                        help='Worker counts to time for the workers '
+                             'benchmark. (default=1 4 16)')
+    parser.add_argument('--full', action='store_true',
+                        help='Keep all features in the blocks benchmark, as '
+                             'clean_parse.py --full does.')
+
+    suite = parser.add_argument_group('suite benchmark')
+    suite.add_argument('--tiers', type=int, nargs='+', default=[8, 32, 128],
+                       help='Nodes per graph of each size tier. '
+                            '(default=8 32 128)')
+    suite.add_argument('--deep-tiers', type=int, nargs='*',
+                       default=DEEP_TIERS,
+                       help='Depths of the chain graphs to time. '
+                            '(default={})'.format(
+                                ' '.join(map(str, DEEP_TIERS))))
+    suite.add_argument('--count', type=int, default=500,
+                       help='Graph pairs per tier. (default=500)')
+    suite.add_argument('--seed', type=int, default=0,
+                       help='Seed of the generated graphs. (default=0)')
+    suite.add_argument('--reentrancy', type=float, default=0.15,
+                       help='Reentrancy rate of the generated graphs. '
+                            '(default=0.15)')
+    suite.add_argument('--features', type=float, default=0.3,
+                       help='Feature density of the generated graphs. '
+                            '(default=0.3)')
+    suite.add_argument('--baseline', type=str, default=None,
+                       help='JSON baseline to compare with. Exits with an '
+                            'error if any throughput regressed past '
+                            '--threshold.')
+    suite.add_argument('--save-baseline', type=str, default=None,
+                       help='Writes the results as a JSON baseline to this '
+                            'file.')
+    suite.add_argument('--threshold', type=float, default=0.2,
+                       help='Largest allowed drop in throughput relative to '
+                            'the baseline, e.g. 0.2 for 20%%. (default=0.2)')
+    args = parser.parse_args()
+
+    lines = None
+    if args.benchmark != 'suite':
+        if args.input is None:
+            parser.error('the {} benchmark needs an input '
+                         'file'.format(args.benchmark))
+        with open(args.input, 'r') as f:
+            lines = f.readlines()
+
+    BENCHMARKS[args.benchmark](lines, args)
+
+
+def bench_simplify(lines, args):
+    graphs = split_graphs(lines)
+    baseline = [simplify_regex(graph) for graph in graphs]
+    if [simplify(graph) for graph in graphs] != baseline:
+        raise ValueError('simplify output differs from simplify_regex')
+
+    for fn in [simplify_regex, simplify]:
+        report(fn.__name__, time_graphs(fn, graphs, args.repeat), len(graphs))
+
+
+def bench_reverse(lines, args):
+    # reverse expects the simplified graphs that the model predicts
+    graphs = [simplify(graph) for graph in split_graphs(lines)]
+    baseline = [reverse_regex(graph) for graph in graphs]
+    if [reverse(graph) for graph in graphs] != baseline:
+        raise ValueError('reverse output differs from reverse_regex')
+
+    for fn in [reverse_regex, reverse]:
+        report(fn.__name__, time_graphs(fn, graphs, args.repeat), len(graphs))
+
+
+def bench_features(lines, args):
+    # Times each feature transform on the input it sees in the pipeline.
+    # Meant for feature-heavy graphs, i.e. clean_parse.py --full output.
+    all_nodes_pattern = get_all_nodes_pattern()
+    graphs = [simplify(graph) for graph in split_graphs(lines)]
+
+    # The regex version is timed with the find_features call it needs
+    squash_features = lambda graph: squash_regex(
+        graph, find_features(graph, list(all_nodes_pattern.finditer(graph))))
+    squashed = [squash_features(graph) for graph in graphs]
+    if [squash(graph) for graph in graphs] != squashed:
+        raise ValueError('squash output differs from squash_regex')
+    expanded = [expand(graph) for graph in squashed]
+
+    filters = [('filter_feats', ['sf', 'tense'], False),
+               ('filter_feats (all)', [], True)]
+    for name, keep, filter_all in filters:
+        if ([filter_feats(graph, keep, filter_all) for graph in expanded]
+                != [filter_feats_regex(graph, keep, filter_all)
+                    for graph in expanded]):
+            raise ValueError('{} output differs from the regex '
+                             'version'.format(name))
+
+    benchmarks = [
+        ('squash_regex', squash_features, graphs),
+        ('squash', squash, graphs),
+        ('expand', expand, squashed),
+    ]
+    for name, keep, filter_all in filters:
+        benchmarks.append((name.replace('filter_feats', 'filter_feats_regex'),
+                           partial(filter_feats_regex, features_to_keep=keep,
+                                   filter_all=filter_all), expanded))
+        benchmarks.append((name, partial(filter_feats, features_to_keep=keep,
+                                         filter_all=filter_all), expanded))
+    # Several roots in a row, e.g. '( a ) ( b )', are well-formed too
+    multi_root = expanded + [first.rstrip() + ' ' + second for first, second
+                             in zip(expanded, expanded[1:])]
+    if ([check_parens(graph) for graph in multi_root]
+            != [check_parens_stack(graph) for graph in multi_root]):
+        raise ValueError('check_parens output differs from '
+                         'check_parens_stack')
+
+    benchmarks += [
+        ('check_parens_stack', check_parens_stack, expanded),
+        ('check_parens', check_parens, expanded),
+        ('validate', validate, expanded),
+        ('get_predicates', get_predicates, expanded),
+    ]
+    for name, fn, data in benchmarks:
+        report(name, time_graphs(fn, data, args.repeat), len(data))
+
+    for depth in DEEP_TIERS:
+        deep = split_graphs(line.rstrip('\n') for line in generate_lines(
+            DEEP_COUNT, depth, layout='single', chain=True))
+        deep = [expand(squash(simplify(graph))) for graph in deep]
+        multi_root = deep + [first.rstrip() + ' ' + second for first, second
+                             in zip(deep, deep[1:])]
+        if ([check_parens(graph) for graph in multi_root]
+                != [check_parens_stack(graph) for graph in multi_root]):
+            raise ValueError('check_parens output differs from '
+                             'check_parens_stack')
+        for fn in [check_parens_stack, check_parens]:
+            report('{} (depth {})'.format(fn.__name__, depth),
+                   time_graphs(fn, deep, args.repeat), len(deep))
+
+
+def bench_blocks(lines, args):
+    # Input is the raw parser output, i.e. what clean_parse.py reads
+    num_graphs = sum(1 for _ in read_blocks(lines))
+    read = lambda lines: sum(1 for _ in read_blocks(lines))
+    clean = lambda lines: [clean_block(block.lines, args.full)
+                           for block in read_blocks(lines)]
+
+    report('read_blocks', time_graphs(read, [lines], args.repeat), num_graphs)
+    report('read + clean_block', time_graphs(clean, [lines], args.repeat),
+           num_graphs)
+
+
+def bench_workers(lines, args):
+    # Same transform as preprocess.py
+    transform = partial(transform_graphs, feature_type='squash')
+    num_graphs = len(split_graphs(lines))
+
+    serial = None
+    for workers in args.workers:
+        seconds = time_graphs(
+            lambda lines: list(imap_lines(transform, lines, workers)),
+            [lines], args.repeat
+        )
+        serial = serial or seconds
+        report('{} workers'.format(workers), seconds, num_graphs)
+        print('{:<24} {:>10.2f}x speedup'.format('', serial / seconds))
+
+
+def bench_corpus(lines, args):
+    # Compares parsing simplified text with reading the binary corpus that
+    # graph_corpus.py builds from it
+    simplified = [transform_graphs(line) for line in lines]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus')
+        write_corpus(map(parse_line, simplified), path)
+
+        with GraphCorpus(path) as corpus:
+            graphs = split_graphs(line.rstrip('\n') for line in simplified)
+            if [corpus.text(g) for g in range(corpus.num_graphs)] != graphs:
+                raise ValueError('corpus text differs from the input')
+
+            # skips graphs reverse cannot recover, which have no predicates
+            text_predicates = lambda graph: get_predicates(reverse(graph))
+            if any(corpus.raw(g) is None and sorted(corpus.graph_predicates(g))
+                   != sorted(sum(text_predicates(graph), []))
+                   and not reverse(graph).startswith('(999999999 / invalid)')
+                   for g, graph in enumerate(graphs)):
+                raise ValueError('corpus predicates differ from the text')
+
+            indices = range(corpus.num_graphs)
+            benchmarks = [
+                ('parse_line', parse_line, simplified),
+                ('text predicates', text_predicates, graphs),
+                ('corpus predicates', corpus.graph_predicates, indices),
+                ('corpus text', corpus.text, indices),
+            ]
+            for name, fn, data in benchmarks:
+                report(name, time_graphs(fn, data, args.repeat), len(graphs))
+
+        print('{:<24} {:>10} bytes (text {} bytes)'.format(
+            'corpus size', os.path.getsize(path),
+            sum(len(line.encode('utf-8')) for line in simplified)))
+
+        # Chains deeper than the recursion limit have to round trip too
+        for depth in DEEP_TIERS:
+            chains = [transform_graphs(line) for line in generate_lines(
+                DEEP_COUNT, depth, chain=True)]
+            write_corpus(map(parse_line, chains), path)
+            with GraphCorpus(path) as corpus:
+                graphs = split_graphs(line.rstrip('\n') for line in chains)
+                if (corpus.num_graphs != len(graphs)
+                        or any(corpus.raw(g) is not None
+                               for g in range(corpus.num_graphs))
+                        or [corpus.text(g) for g in range(corpus.num_graphs)]
+                        != graphs):
+                    raise ValueError('corpus text differs from the input '
+                                     '(depth {})'.format(depth))
+                report('parse_line (depth {})'.format(depth),
+                       time_graphs(parse_line, chains, args.repeat),
+                       len(graphs))
+                report('corpus text (depth {})'.format(depth),
+                       time_graphs(corpus.text, range(corpus.num_graphs),
+                                   args.repeat), len(graphs))
+
+
+def bench_suite(lines, args):
+    # Generated graphs stand in for the data, which is a separate download,
+    # so results are comparable between checkouts on the same machine
+    config = {'tiers': args.tiers, 'count': args.count, 'seed': args.seed,
+              'reentrancy': args.reentrancy, 'features': args.features,
+              'deep_tiers': args.deep_tiers, 'repeat': args.repeat}
+    results = {}
+    for nodes in args.tiers:
+        print('{} nodes per graph'.format(nodes))
+        results[str(nodes)] = suite_tier(nodes, args)
+    for depth in args.deep_tiers:
+        print('chains of {} nodes'.format(depth))
+        results['chain {}'.format(depth)] = suite_deep_tier(depth, args)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline['config'] != config:
+            print('Warning: the baseline was run with {}'.format(
+                baseline['config']), file=sys.stderr)
+        regressions = compare_baseline(results, baseline['results'],
+                                       args.threshold)
+        if regressions:
+            print('{} benchmarks regressed by more than {:.0%}: {}'.format(
+                len(regressions), args.threshold, ', '.join(regressions)),
+                file=sys.stderr)
+            sys.exit(1)
+
+
+def suite_tier(nodes, args):
+    """
+    Times every transform and reader on generated graphs with nodes nodes.
+
+    Return
+    ------
+    dict
+        Graphs per second of each benchmark.
+    """
+
+    pairs = generate_lines(args.count, nodes, args.reentrancy, args.features,
+                           'pairs', args.seed)
+    graphs = split_graphs(line.rstrip('\n') for line in pairs)
+    simplified = [simplify(graph) for graph in graphs]
+    reversed_graphs = [reverse(graph) for graph in simplified]
+    if any(graph.startswith('(999999999 / invalid)')
+           for graph in reversed_graphs):
+        raise ValueError('reverse could not recover a generated graph')
+    squashed = [squash(graph) for graph in simplified]
+
+    benchmarks = [
+        ('simplify', simplify, graphs),
+        ('reverse', reverse, simplified),
+        ('squash', squash, simplified),
+        ('expand', expand, squashed),
+        ('filter_feats', partial(filter_feats, features_to_keep=['sf', 'tense']),
+         reversed_graphs),
+        ('check_parens', check_parens, reversed_graphs),
+        ('get_predicates', get_predicates, reversed_graphs),
+    ]
+    results = {}
+    for name, fn, data in benchmarks:
+        seconds = time_graphs(fn, data, args.repeat)
+        report(name, seconds, len(data))
+        results[name] = len(data) / seconds
+
+    # The readers take the raw parser output of both languages
+    parses1 = generate_lines(args.count, nodes, args.reentrancy,
+                             args.features, 'parses', args.seed)
+    parses2 = generate_lines(args.count, nodes, args.reentrancy,
+                             args.features, 'parses', args.seed + 1)
+    clean = lambda _: sum(1 for _ in clean_pairs(parses1, parses2, True))
+    seconds = time_graphs(clean, [None], args.repeat)
+    report('clean_pairs', seconds, 2 * args.count)
+    results['clean_pairs'] = 2 * args.count / seconds
+
+    # Sorted ids are merge-joined, shuffled ones indexed
+    shuffled = split_blocks(parses2)
+    random.Random(args.seed).shuffle(shuffled)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, name)
+                 for name in ['lang1', 'lang2', 'shuffled']]
+        for path, text in zip(paths, [parses1, parses2, sum(shuffled, [])]):
+            with open(path, 'w') as f:
+                f.writelines(text)
+
+        align = lambda paths: sum(1 for _ in align_parses(paths))
+        for name, aligned in [('align_parses (sorted)', paths[:2]),
+                              ('align_parses (shuffled)',
+                               [paths[0], paths[2]])]:
+            seconds = time_graphs(align, [aligned], args.repeat)
+            report(name, seconds, 2 * args.count)
+            results[name] = 2 * args.count / seconds
+    return results
+
+
+def suite_deep_tier(depth, args):
+    """
+    Times the transforms that walk the whole graph on chain graphs of depth
+    nodes.
+
+    Return
+    ------
+    dict
+        Graphs per second of each benchmark.
+    """
+
+    graphs = split_graphs(line.rstrip('\n') for line in generate_lines(
+        DEEP_COUNT, depth, args.reentrancy, args.features, 'single',
+        args.seed, chain=True))
+    simplified = [simplify(graph) for graph in graphs]
+    reversed_graphs = [reverse(graph) for graph in simplified]
+
+    benchmarks = [
+        ('simplify', simplify, graphs),
+        ('reverse', reverse, simplified),
+        ('check_parens', check_parens, reversed_graphs),
+        ('validate', validate, simplified),
+    ]
+    results = {}
+    for name, fn, data in benchmarks:
+        seconds = time_graphs(fn, data, args.repeat)
+        report(name, seconds, len(data))
+        results[name] = len(data) / seconds
+    return results
+
+
+def compare_baseline(results, baseline, threshold):
+    """
+    Prints the change in throughput of every benchmark in both results and
+    baseline.
+
+    Return
+    ------
+    list
+        'tier/name' of the benchmarks that regressed by more than threshold.
+    """
+
+    regressions = []
+    for tier, tier_results in results.items():
+        for name, throughput in tier_results.items():
+            expected = baseline.get(tier, {}).get(name)
+            if not expected:
+                continue
+            change = throughput / expected - 1
+            flag = ''
+            if throughput < expected * (1 - threshold):
+                regressions.append('{}/{}'.format(tier, name))
+                flag = ' REGRESSED'
+            print('{:<32} {:>+8.1%}{}'.format('{} nodes {}'.format(tier, name),
+                                              change, flag))
+    return regressions
+
+
+def split_blocks(lines):
+    """
+    Splits parser output into the lines of each blank line terminated block.
+    """
+
+    blocks = [[]]
+    for line in lines:
+        blocks[-1].append(line)
+        if not line.strip():
+            blocks.append([])
+    return [block for block in blocks if block]
+
+
+def split_graphs(lines):
+    return [graph for line in lines for graph in line.split('\t')]
+
+
+def time_graphs(fn, graphs, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for graph in graphs:
+            fn(graph)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(name, seconds, num_graphs):
+    print('{:<24} {:>10.0f} graphs/sec ({:.2f}s for {} graphs)'.format(
+        name, num_graphs / seconds, seconds, num_graphs))
+
+
+BENCHMARKS = {
+    'blocks': bench_blocks,
+    'corpus': bench_corpus,
+    'features': bench_features,
+    'reverse': bench_reverse,
+    'simplify': bench_simplify,
+    'suite': bench_suite,
+    'workers': bench_workers,
+}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import re
+
+
+from tqdm import tqdm
+from simplify_graph import reverse, validate
+
+
+# What a token of a simplified, squashed (or featureless) graph is
+OPEN = 0            # '(', the root node
+ROLE_OPEN = 1       # ':ARG1-NEQ(', a child node
+ROLE = 2            # ':ARG2', followed by a reentrancy
+REENTRANT = 3       # '<*>'
+LABEL = 4           # '_dog_n_1'
+FEATURE = 5         # ':num=SG:pers=3'
+CLOSE = 6           # ')'
+OTHER = 7           # anything else, e.g. padding or an unknown token
+NUM_KINDS = 8
+
+# What the graph expects next
+START = 0           # the root '('
+NODE_LABEL = 1      # the label of a node that was just opened
+FEATURES = 2        # right after a label: features, roles or ')'
+NODE = 3            # roles or ')'
+REENTRANCY = 4      # '<*>' after a role without '('
+REENTRANT_LABEL = 5 # the label of a node introduced earlier
+DONE = 6            # the root is closed, nothing but the end of the graph
+NUM_STATES = 7
+
+# (state, kind) -> state. Missing pairs are not allowed. CLOSE goes to DONE
+# instead of NODE when it closes the root.
+TRANSITIONS = {
+    (START, OPEN): NODE_LABEL,
+    (NODE_LABEL, LABEL): FEATURES,
+    (FEATURES, FEATURE): NODE,
+    (FEATURES, ROLE_OPEN): NODE_LABEL,
+    (FEATURES, ROLE): REENTRANCY,
+    (FEATURES, CLOSE): NODE,
+    (NODE, ROLE_OPEN): NODE_LABEL,
+    (NODE, ROLE): REENTRANCY,
+    (NODE, CLOSE): NODE,
+    (REENTRANCY, REENTRANT): REENTRANT_LABEL,
+    (REENTRANT_LABEL, LABEL): NODE,
+}
+
+# How much a token of each kind changes the paren depth
+DEPTH_CHANGE = {OPEN: 1, ROLE_OPEN: 1, CLOSE: -1}
+
+# Fewest tokens that finish the graph from each state, not counting the
+# closing parens of the open nodes
+MIN_REMAINING = {
+    START: 3,
+    NODE_LABEL: 1,
+    FEATURES: 0,
+    NODE: 0,
+    REENTRANCY: 2,
+    REENTRANT_LABEL: 1,
+    DONE: 0,
+}
+
+# The same characters simplify_graph's patterns accept. Reentrancies are
+# resolved with '<*> \w+' in reverse, so their labels cannot contain '+'.
+_label_pattern = re.compile(r'[\w+]+')
+_reentrant_label_pattern = re.compile(r'\w+')
+_role_open_pattern = re.compile(r':[\w-]*\(')
+_role_pattern = re.compile(r':[\w-]+')
+_feature_pattern = re.compile(r'(:[a-z][\w-]*=[\w+-]+)+')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Checks which simplified graphs the constrained decoder '
+                    'can generate. Gold graphs should all be accepted. '
+                    'Predictions it rejects are the ones constrained '
+                    'decoding prevents.'
+    )
+    parser.add_argument('input', type=str,
+                        help='Simplified graphs, one per line, or lines of '
+                             'tab separated graphs.')
+    parser.add_argument('--column', type=int, default=-1,
+                        help='Which of the tab separated graphs to check. '
+                             '(default=-1, the last)')
+    args = parser.parse_args()
+
+    total = 0
+    accepted = 0
+    rejected_valid = 0
+    with open(args.input, 'r') as f:
+        for line in tqdm(f):
+            graph = line.rstrip('\n').split('\t')[args.column]
+            total += 1
+            if accepts(graph.split()):
+                accepted += 1
+            elif validate(graph) is None and 'invalid' not in reverse(graph):
+                rejected_valid += 1
+
+    print('{} of {} graphs accepted'.format(accepted, total))
+    print('{} rejected graphs are valid for postprocess_predictions.py'.format(
+        rejected_valid))
+
+
+def token_kind(token):
+    if token == '(':
+        return OPEN
+    if token == ')':
+        return CLOSE
+    if token == '<*>':
+        return REENTRANT
+    if _role_open_pattern.fullmatch(token):
+        return ROLE_OPEN
+    if _feature_pattern.fullmatch(token):
+        return FEATURE
+    if _role_pattern.fullmatch(token):
+        return ROLE
+    if _label_pattern.fullmatch(token):
+        return LABEL
+    return OTHER
+
+
+def can_reenter(token):
+    return bool(_reentrant_label_pattern.fullmatch(token))
+
+
+class GraphState:
+    """
+    Tracks a graph while it is generated one token at a time, so that only
+    tokens that keep it well-formed are allowed.
+
+    The rules are the ones postprocess_predictions.py checks afterwards:
+    parens stay balanced (check_parens), an opened node is followed by its
+    label (get_invalid_node_pattern) and a reentrancy names a node that was
+    already introduced (the reentrancy check in reverse). The grammar is
+    stricter than those checks in two ways: it ends the graph once the root
+    is closed, where check_parens also accepts several roots in a row, and
+    reverse also accepts reentrancies to nodes introduced later in the graph.
+    """
+
+    def __init__(self):
+        self.state = START
+        self.depth = 0
+        self.labels = set()
+
+    @property
+    def done(self):
+        return self.state == DONE
+
+    def next_state(self, kind):
+        """
+        Return
+        ------
+        int, int or None
+            The state and depth after a token of kind, or None if it is not
+            allowed.
+        """
+
+        state = TRANSITIONS.get((self.state, kind))
+        if state is None:
+            return None
+
+        depth = self.depth + DEPTH_CHANGE.get(kind, 0)
+        if kind == CLOSE and depth == 0:
+            state = DONE
+        return state, depth
+
+    def allows(self, token, steps_left=None):
+        """
+        Whether token can come next. With steps_left (the number of tokens
+        that can still be generated, including this one), tokens after
+        which the graph could not be closed in time are not allowed either.
+        """
+
+        kind = token_kind(token)
+        if self.state == REENTRANT_LABEL and token not in self.labels:
+            return False
+
+        # A reentrancy needs a node to point to
+        if kind == ROLE and not self.labels:
+            return False
+
+        following = self.next_state(kind)
+        if following is None:
+            return False
+        if steps_left is not None:
+            state, depth = following
+            return MIN_REMAINING[state] + depth <= steps_left - 1
+        return True
+
+    def advance(self, token):
+        kind = token_kind(token)
+        if not self.allows(token):
+            raise ValueError('{!r} is not allowed here'.format(token))
+
+        if self.state == NODE_LABEL and can_reenter(token):
+            self.labels.add(token)
+        self.state, self.depth = self.next_state(kind)
+
+
+def accepts(tokens):
+    """
+    Whether the grammar generates exactly this (complete) graph.
+    """
+
+    state = GraphState()
+    for token in tokens:
+        if not state.allows(token):
+            return False
+        state.advance(token)
+    return state.done
+
+
+if __name__ == '__main__':
+    main()
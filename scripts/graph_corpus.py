@@ -0,0 +1,442 @@
+import argparse
+import json
+import mmap
+import numpy as np
+
+
+from array import array
+from tqdm import tqdm
+from graph_lexer import scan, OPEN, CLOSE, ROLE, FEATURE, LABEL, \
+                        REENTRANCY, WHITESPACE
+from parallel import imap_lines, add_workers_argument
+
+
+MAGIC = b'DMRSGRF\x00'
+VERSION = 1
+
+# Arrays are aligned so they can be viewed straight out of the mmap
+ALIGNMENT = 8
+
+# Every table in the file. Offset arrays have one more entry than the table
+# they index, so the rows of i are offsets[i]:offsets[i + 1]. Each array is
+# written with the smallest unsigned dtype that holds its values, which is
+# recorded in the header.
+ARRAYS = [
+    'line_graphs',     # lines -> graphs
+    'graph_nodes',     # graphs -> nodes
+    'graph_raw',       # 1 + raw text id of a graph, or 0
+    'node_pred',       # predicate id
+    'node_squashed',   # whether features are a single token
+    'node_feats',      # nodes -> features
+    'node_edges',      # nodes -> edges
+    'feature',         # (key, value) id
+    'edge_role',       # role id
+    'edge_target',     # child node within the graph, or predicate id
+    'edge_reentrant',
+    'raw_offsets',     # raw texts -> raw_bytes
+    'raw_bytes',
+]
+
+VOCABS = ['predicates', 'roles', 'features']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Converts the output of simplify_graph.py into a compact '
+                    'binary corpus that can be memory-mapped for random '
+                    'access without parsing any text.'
+    )
+    parser.add_argument('input', type=str,
+                        help='Simplified graphs, one line of tab separated '
+                             'graphs per example.')
+    parser.add_argument('output', type=str,
+                        help='Output file.')
+    add_workers_argument(parser)
+    args = parser.parse_args()
+
+    with open(args.input, 'r') as f:
+        lines = imap_lines(parse_line, f, args.workers)
+        stats = write_corpus(tqdm(lines), args.output)
+
+    print('Wrote {lines} lines, {graphs} graphs ({raw} stored as text) and '
+          '{nodes} nodes'.format(**stats))
+
+
+def parse_line(line):
+    """
+    Return
+    ------
+    list
+        parse_graph of every tab separated graph in the line, with the text
+        of any graph that cannot be stored as tables instead.
+    """
+
+    graphs = []
+    for graph in line.rstrip('\n').split('\t'):
+        nodes = parse_graph(graph)
+        if nodes is None or render_graph(nodes) != graph:
+            nodes = graph
+        graphs.append(nodes)
+    return graphs
+
+
+def parse_graph(graph):
+    """
+    Parses a simplified graph into its nodes in preorder. Each node is
+    (predicate, squashed, features, edges) where features is a list of
+    (key, value) and edges a list of (role, target, reentrant). target is
+    the index of the child node or, for a reentrancy, the predicate.
+
+    Return
+    ------
+    list or None
+        None if the graph is not a single well-formed graph, e.g. a model
+        prediction with unbalanced parens.
+    """
+
+    tokens = [m for m in scan(graph) if m.lastgroup != WHITESPACE]
+    if len(tokens) < 3 or tokens[0].lastgroup != OPEN \
+       or tokens[1].lastgroup != LABEL:
+        return None
+
+    nodes = [(tokens[1].group(), False, [], [])]
+    stack = [0]
+    i = 2
+    while i < len(tokens):
+        if not stack:
+            return None
+
+        kind = tokens[i].lastgroup
+        text = tokens[i].group()
+        node = nodes[stack[-1]]
+
+        if kind == FEATURE:
+            # features always come before the edges of a node
+            if node[3]:
+                return None
+            if text.find('=') != -1:
+                if node[2]:
+                    return None
+                nodes[stack[-1]] = node = (node[0], True, node[2], node[3])
+                for feat in text[1:].split(':'):
+                    key, _, value = feat.partition('=')
+                    node[2].append((key, value))
+            else:
+                key, _, value = text[1:].partition(' ')
+                node[2].append((key, value or None))
+            i += 1
+
+        elif kind == ROLE and text.endswith('('):
+            if i + 1 >= len(tokens) or tokens[i + 1].lastgroup != LABEL:
+                return None
+            node[3].append((text[:-1], len(nodes), False))
+            stack.append(len(nodes))
+            nodes.append((tokens[i + 1].group(), False, [], []))
+            i += 2
+
+        elif kind == ROLE:
+            if i + 2 >= len(tokens) or tokens[i + 1].lastgroup != REENTRANCY \
+               or tokens[i + 2].lastgroup != LABEL:
+                return None
+            node[3].append((text, tokens[i + 2].group(), True))
+            i += 3
+
+        elif kind == CLOSE:
+            stack.pop()
+            i += 1
+
+        else:
+            return None
+
+    if stack:
+        return None
+    return nodes
+
+
+def render_graph(nodes):
+    """
+    Writes nodes, as returned by parse_graph, back out as a simplified graph.
+    """
+
+    parts = []
+
+    # Written with a stack rather than recursion, so graphs can be nested
+    # deeper than the recursion limit. A node index opens that node, a
+    # string is written as it is.
+    stack = [0]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+
+        pred, squashed, features, edges = nodes[item]
+        parts.append('( ')
+        parts.append(pred)
+
+        if squashed:
+            parts.append(' ')
+            parts.extend(':{}={}'.format(key, value)
+                         for key, value in features)
+        else:
+            for key, value in features:
+                parts.append(' :' + key if value is None
+                             else ' :{} {}'.format(key, value))
+
+        stack.append(' )')
+        for role, target, reentrant in reversed(edges):
+            if reentrant:
+                stack.append(' {} <*> {}'.format(role, target))
+            else:
+                stack.append(target)
+                stack.append(' ' + role)
+
+    return ''.join(parts)
+
+
+def write_corpus(lines, path):
+    """
+    Writes the output of parse_line for every line to path.
+
+    The file starts with MAGIC, the length of a JSON header as a uint64 and
+    the header itself, which holds the vocabularies and the dtype, offset
+    and length of every array in ARRAYS. The arrays follow, each aligned to
+    ALIGNMENT bytes. Offsets in the header are relative to the first array.
+
+    Return
+    ------
+    dict
+        Number of lines, graphs, raw graphs and nodes written.
+    """
+
+    vocabs = {name: {} for name in VOCABS}
+    tables = {name: array('q') for name in ARRAYS}
+    tables['raw_bytes'] = bytearray()
+    for name in ['line_graphs', 'graph_nodes', 'node_feats', 'node_edges',
+                 'raw_offsets']:
+        tables[name].append(0)
+
+    def intern(vocab, value):
+        return vocabs[vocab].setdefault(value, len(vocabs[vocab]))
+
+    for graphs in lines:
+        for nodes in graphs:
+            if isinstance(nodes, str):
+                tables['graph_raw'].append(len(tables['raw_offsets']))
+                tables['raw_bytes'].extend(nodes.encode('utf-8'))
+                tables['raw_offsets'].append(len(tables['raw_bytes']))
+                tables['graph_nodes'].append(tables['graph_nodes'][-1])
+                continue
+
+            for pred, squashed, features, edges in nodes:
+                tables['node_pred'].append(intern('predicates', pred))
+                tables['node_squashed'].append(squashed)
+                for feature in features:
+                    tables['feature'].append(intern('features', feature))
+                for role, target, reentrant in edges:
+                    tables['edge_role'].append(intern('roles', role))
+                    tables['edge_target'].append(
+                        intern('predicates', target) if reentrant else target)
+                    tables['edge_reentrant'].append(reentrant)
+                tables['node_feats'].append(len(tables['feature']))
+                tables['node_edges'].append(len(tables['edge_role']))
+
+            tables['graph_raw'].append(0)
+            tables['graph_nodes'].append(len(tables['node_pred']))
+        tables['line_graphs'].append(len(tables['graph_raw']))
+
+    header = {
+        'version': VERSION,
+        'vocabs': {name: list(vocab) for name, vocab in vocabs.items()},
+        'arrays': {},
+    }
+    data = []
+    offset = 0
+    for name in ARRAYS:
+        if name == 'raw_bytes':
+            values = np.frombuffer(bytes(tables[name]), dtype=np.uint8)
+        else:
+            values = np.asarray(tables[name], dtype=np.int64)
+            values = values.astype(_smallest_dtype(values))
+        header['arrays'][name] = [values.dtype.str, offset, len(values)]
+        data.append((offset, values))
+        offset = _align(offset + values.nbytes)
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for array_offset, values in data:
+            f.write(b'\0' * (data_start + array_offset - f.tell()))
+            f.write(values.tobytes())
+
+    return {
+        'lines': len(tables['line_graphs']) - 1,
+        'graphs': len(tables['graph_raw']),
+        'raw': len(tables['raw_offsets']) - 1,
+        'nodes': len(tables['node_pred']),
+    }
+
+
+def _smallest_dtype(values):
+    largest = int(values.max()) if len(values) else 0
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if largest <= np.iinfo(dtype).max:
+            return np.dtype(dtype).newbyteorder('<')
+    return np.dtype('<u8')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class GraphCorpus:
+    """
+    Read-only view of a file written by write_corpus. The file is
+    memory-mapped and every array in ARRAYS is an attribute viewing it
+    directly, so opening a corpus only reads the header and a graph's rows
+    are only paged in when it is accessed.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a graph corpus'.format(path))
+        header_start = len(MAGIC) + 8
+        header_size = int(np.frombuffer(self._mmap, '<u8', 1, len(MAGIC))[0])
+        header = json.loads(
+            self._mmap[header_start:header_start + header_size].decode('utf-8'))
+        if header['version'] != VERSION:
+            raise ValueError('{} has version {}, expected {}'.format(
+                path, header['version'], VERSION))
+
+        self.predicates = header['vocabs']['predicates']
+        self.roles = header['vocabs']['roles']
+        self.features = [tuple(feature)
+                         for feature in header['vocabs']['features']]
+
+        data_start = _align(header_start + header_size)
+        for name, (dtype, offset, length) in header['arrays'].items():
+            setattr(self, name, np.frombuffer(self._mmap, dtype, length,
+                                              data_start + offset))
+
+    def __len__(self):
+        return len(self.line_graphs) - 1
+
+    def __getitem__(self, i):
+        return self.line(i)
+
+    @property
+    def num_graphs(self):
+        return len(self.graph_raw)
+
+    def graphs(self, i):
+        """
+        Return
+        ------
+        range
+            Indices of the graphs in line i.
+        """
+
+        return range(self.line_graphs[i], self.line_graphs[i + 1])
+
+    def line(self, i):
+        """
+        Returns line i as it was in the simplify_graph.py output, without
+        the trailing newline.
+        """
+
+        return '\t'.join(self.text(g) for g in self.graphs(i))
+
+    def raw(self, g):
+        """
+        Returns the text of graph g if it was stored as text, otherwise None.
+        """
+
+        raw = int(self.graph_raw[g])
+        if not raw:
+            return None
+        start, end = self.raw_offsets[raw - 1], self.raw_offsets[raw]
+        return self.raw_bytes[start:end].tobytes().decode('utf-8')
+
+    def predicate_ids(self, g):
+        """
+        Return
+        ------
+        np.ndarray
+            Predicate ids of the nodes of graph g in preorder (a view, not a
+            copy). Empty for graphs stored as text.
+        """
+
+        return self.node_pred[self.graph_nodes[g]:self.graph_nodes[g + 1]]
+
+    def graph_predicates(self, g):
+        """
+        Return
+        ------
+        list
+            Predicates of the nodes of graph g in preorder, i.e. the
+            predicates calculate_predicate_f1.py finds once reverse has
+            recovered the graph. Graphs stored as text have to be parsed
+            instead.
+        """
+
+        return [self.predicates[p] for p in self.predicate_ids(g)]
+
+    def nodes(self, g):
+        """
+        Return
+        ------
+        list or str
+            Graph g in the format returned by parse_graph, or its text if it
+            was stored as text.
+        """
+
+        raw = self.raw(g)
+        if raw is not None:
+            return raw
+
+        nodes = []
+        for n in range(self.graph_nodes[g], self.graph_nodes[g + 1]):
+            features = [self.features[f] for f
+                        in self.feature[self.node_feats[n]:self.node_feats[n + 1]]]
+
+            edges = []
+            for e in range(self.node_edges[n], self.node_edges[n + 1]):
+                target = int(self.edge_target[e])
+                if self.edge_reentrant[e]:
+                    target = self.predicates[target]
+                edges.append((self.roles[self.edge_role[e]], target,
+                              bool(self.edge_reentrant[e])))
+
+            nodes.append((self.predicates[self.node_pred[n]],
+                          bool(self.node_squashed[n]), features, edges))
+        return nodes
+
+    def text(self, g):
+        nodes = self.nodes(g)
+        if isinstance(nodes, str):
+            return nodes
+        return render_graph(nodes)
+
+    def close(self):
+        # the views have to go before the mmap can be closed
+        for name in ARRAYS:
+            delattr(self, name)
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import re
+
+
+from collections import namedtuple
+
+
+# Token kinds emitted by the lexer
+WHITESPACE = 'whitespace'
+OPEN = 'open'
+CLOSE = 'close'
+ROLE = 'role'
+FEATURE = 'feature'
+NODE = 'node'
+REF = 'ref'
+REENTRANCY = 'reentrancy'
+LABEL = 'label'
+OTHER = 'other'
+
+
+Token = namedtuple('Token', ['kind', 'text', 'start'])
+
+
+# Order matters: earlier alternatives win at the same position. Node
+# instances ("10001 / _dog_n_1") have to be tried before bare node ids and
+# labels so the id is not lexed as a label on its own.
+_TOKEN_PATTERN = re.compile(r'''
+      (?P<whitespace>\s+)
+    | (?P<open>\()
+    | (?P<close>\))
+    | (?P<node>\d{5}\ /\ [\w+]+)
+    | (?P<ref>\d{5}(?![\w+]))
+    | (?P<reentrancy><\*>)
+    | (?P<role>:[A-Z][\w-]*\(?)
+    | (?P<feature>:[a-z][\w-]*(?:=[^\s()]*|\ [^\s():<]+)?)
+    | (?P<label>[\w+]+)
+    | (?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+
+_LONG_DIGITS_PATTERN = re.compile(r'\d{5,}')
+
+
+def scan(graph):
+    """
+    Lexes a penman graph string in a single left-to-right pass.
+
+    Works on both the numbered graphs produced by clean_parse.py and the
+    simplified graphs produced by simplify_graph.py. The lexer is lossless:
+    joining the text of every match reproduces the input exactly.
+
+    Return
+    ------
+    iterator of re.Match
+        One match per token where match.lastgroup is the token kind. Hot
+        loops should use this directly rather than tokenize.
+    """
+
+    return _TOKEN_PATTERN.finditer(graph)
+
+
+def tokenize(graph):
+    """
+    Return
+    ------
+    list of Token
+        Tokens in the order they appear in the graph.
+    """
+
+    return [Token(m.lastgroup, m.group(), m.start()) for m in scan(graph)]
+
+
+def has_ambiguous_ids(graph, num_ids):
+    """
+    Returns True if the graph contains digit runs that the regex based
+    transforms would treat differently from the lexer, i.e. runs of five or
+    more digits that are not a node id or a reference on their own.
+
+    num_ids is the number of node and ref tokens the lexer found.
+    """
+
+    return len(_LONG_DIGITS_PATTERN.findall(graph)) != num_ids
@@ -0,0 +1,215 @@
+import argparse
+import json
+import numpy as np
+
+
+# Tokens the dataset reader adds to every source and target (START and END)
+SYMBOLS = 2
+
+PERCENTILES = [50, 90, 95, 99, 99.9]
+
+# Sort keys the padding of a bucket iterator is simulated with, as functions
+# of the (source, target) lengths. 'random' is no bucketing at all. The
+# bucket iterator adds noise to every key, so a second key only breaks exact
+# ties and a key has to combine both lengths to account for the target.
+SORT_KEYS = {
+    'random': None,
+    'source': lambda lengths: lengths[:, 0],
+    'target': lambda lengths: lengths[:, 1],
+    'source+target': lambda lengths: lengths.sum(axis=1),
+    'max': lambda lengths: lengths.max(axis=1),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Reports the source and target length distribution of '
+                    'preprocessed graphs, recommended bucket boundaries and '
+                    'how much padding batching by each sort key needs.'
+    )
+    parser.add_argument('input', type=str, nargs='+',
+                        help='Output files of preprocess.py, e.g. train.txt.')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Batch size to simulate. (default=32)')
+    parser.add_argument('--padding-noise', type=float, default=0.1,
+                        help='Padding noise of the bucket iterator. '
+                             '(default=0.1)')
+    parser.add_argument('--buckets', type=int, default=8,
+                        help='Number of recommended buckets. (default=8)')
+    parser.add_argument('--max-length', type=int, default=None,
+                        help='Also reports the padding when examples with a '
+                             'longer source or target are dropped.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Writes the statistics to this JSON file.')
+    args = parser.parse_args()
+
+    lengths = []
+    for path in args.input:
+        with open(path, 'r') as f:
+            lengths.extend(map(line_lengths, f))
+
+    stats = length_stats(lengths, args.batch_size, args.padding_noise,
+                         args.buckets, args.max_length)
+    print_stats(stats)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(stats, f, indent=2)
+
+
+def line_lengths(line):
+    """
+    Return
+    ------
+    int, int
+        The number of source and target tokens of a '<source>\t<target>'
+        line.
+    """
+
+    source, _, target = line.rstrip('\n').partition('\t')
+    return len(source.split()), len(target.split())
+
+
+def length_stats(lengths, batch_size=32, padding_noise=0.1, num_buckets=8,
+                 max_length=None, seed=0):
+    """
+    Computes the statistics length_stats.py reports for a list of (source,
+    target) token counts.
+
+    Return
+    ------
+    dict
+        'source' and 'target' hold percentiles, a histogram and recommended
+        bucket boundaries of each side, 'padding' the padding ratio of each
+        sort key and, with max_length, 'capped' the same for the examples
+        that fit in max_length.
+    """
+
+    lengths = np.array(lengths, dtype=np.int64).reshape(-1, 2)
+    stats = {'examples': len(lengths), 'batch_size': batch_size,
+             'padding_noise': padding_noise}
+    if not len(lengths):
+        return stats
+
+    for i, side in enumerate(['source', 'target']):
+        stats[side] = side_stats(lengths[:, i], num_buckets)
+
+    # Decoding stops at the target length, so the longest target (plus the
+    # END symbol) is the most decoding steps that are ever useful
+    stats['max_decoding_steps'] = int(lengths[:, 1].max()) + SYMBOLS - 1
+
+    stats['padding'] = padding_ratios(lengths, batch_size, padding_noise, seed)
+    if max_length is not None:
+        keep = (lengths <= max_length).all(axis=1)
+        stats['capped'] = {
+            'max_length': max_length,
+            'dropped': int((~keep).sum()),
+            'padding': padding_ratios(lengths[keep], batch_size,
+                                      padding_noise, seed),
+        }
+    return stats
+
+
+def side_stats(lengths, num_buckets):
+    percentiles = np.percentile(lengths, PERCENTILES)
+    counts, edges = np.histogram(lengths, bins=min(20, len(set(lengths))))
+
+    # Boundaries that split the examples into buckets of equal size
+    boundaries = np.percentile(lengths, np.linspace(0, 100, num_buckets + 1))
+    boundaries = sorted(set(int(np.ceil(b)) for b in boundaries[1:-1]))
+
+    return {
+        'mean': float(lengths.mean()),
+        'max': int(lengths.max()),
+        'tokens': int(lengths.sum()),
+        'percentiles': {str(p): float(v) for p, v in zip(PERCENTILES,
+                                                         percentiles)},
+        'histogram': {'counts': counts.tolist(), 'edges': edges.tolist()},
+        'buckets': boundaries,
+    }
+
+
+def padding_ratios(lengths, batch_size, padding_noise, seed=0):
+    """
+    Simulates batching the examples like a bucket iterator sorting by each
+    of SORT_KEYS, with the same multiplicative padding noise.
+
+    Return
+    ------
+    dict
+        Maps each sort key to the fraction of source and target positions
+        in its batches that are padding.
+    """
+
+    lengths = lengths + SYMBOLS
+    ratios = {}
+    for name, key in SORT_KEYS.items():
+        rng = np.random.RandomState(seed)
+        if key is None:
+            order = rng.permutation(len(lengths))
+        else:
+            noise = rng.uniform(1 - padding_noise, 1 + padding_noise,
+                                len(lengths))
+            order = np.argsort(key(lengths) * noise, kind='stable')
+        ratios[name] = padding_ratio(lengths[order], batch_size)
+    return ratios
+
+
+def padding_ratio(lengths, batch_size):
+    """
+    Fraction of the positions that are padding when lengths (in batch order)
+    are cut into consecutive batches.
+    """
+
+    if not len(lengths):
+        return 0.0
+
+    padded = 0
+    for start in range(0, len(lengths), batch_size):
+        batch = lengths[start:start + batch_size]
+        padded += len(batch) * batch.max(axis=0).sum()
+    return 1 - lengths.sum() / padded
+
+
+def print_stats(stats):
+    print('{} examples'.format(stats['examples']))
+    if not stats['examples']:
+        return
+
+    for side in ['source', 'target']:
+        summary = stats[side]
+        print()
+        print('{} length: mean {:.1f}, max {}'.format(
+            side.capitalize(), summary['mean'], summary['max']))
+        print('  percentiles: {}'.format(', '.join(
+            'p{} {:.0f}'.format(p, v)
+            for p, v in summary['percentiles'].items())))
+        print('  bucket boundaries: {}'.format(summary['buckets']))
+
+        counts = summary['histogram']['counts']
+        edges = summary['histogram']['edges']
+        scale = 40 / max(counts)
+        for count, low, high in zip(counts, edges, edges[1:]):
+            print('  {:>6.0f}-{:<6.0f} {:>8} {}'.format(
+                low, high, count, '#' * int(round(count * scale))))
+
+    print()
+    print('max_decoding_steps needed: {}'.format(stats['max_decoding_steps']))
+
+    print()
+    print('Padding ratio (batch size {}, padding noise {})'.format(
+        stats['batch_size'], stats['padding_noise']))
+    capped = stats.get('capped')
+    for name, ratio in stats['padding'].items():
+        line = '  {:<16} {:.1%}'.format(name, ratio)
+        if capped:
+            line += '   {:.1%} with max length {}'.format(
+                capped['padding'][name], capped['max_length'])
+        print(line)
+    if capped:
+        print('  {} examples are longer than {} tokens'.format(
+            capped['dropped'], capped['max_length']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+
+# Number of lines sent to a worker at a time. Graphs are small, so larger
+# chunks keep the pickling overhead per line low.
+CHUNKSIZE = 256
+
+
+# Number of chunks per worker that may be queued or in flight at once. Bounds
+# memory when lines is a lazily read file.
+CHUNKS_PER_WORKER = 4
+
+
+def imap_lines(fn, lines, workers=1, chunksize=CHUNKSIZE, cache=None):
+    """
+    Maps fn over lines, in order, using a pool of worker processes.
+
+    fn has to be picklable (i.e. a module level function or a
+    functools.partial of one). With a single worker, lines are processed in
+    this process so there is no pool overhead. lines may be any iterable
+    (e.g. an open file); it is consumed lazily so at most
+    workers * CHUNKS_PER_WORKER chunks are held in memory.
+
+    If cache (a transform_cache.TransformCache) is given, results are looked
+    up one chunk at a time and only the lines that miss are passed to fn.
+    fn must then return JSON serializable results. Tuples come back from
+    the cache as lists.
+
+    Return
+    ------
+    iterator
+        The results of fn in the same order as lines.
+    """
+
+    lines = iter(lines)
+    if workers <= 1:
+        if cache is None:
+            yield from map(fn, lines)
+            return
+
+        while True:
+            chunk = list(islice(lines, chunksize))
+            if not chunk:
+                return
+            keys, found, misses = _lookup_chunk(cache, chunk)
+            yield from _merge_chunk(cache, keys, found, _map_chunk(fn, misses))
+
+    with Pool(workers) as pool:
+        pending = deque()
+        while True:
+            while len(pending) < workers * CHUNKS_PER_WORKER:
+                chunk = list(islice(lines, chunksize))
+                if not chunk:
+                    break
+                if cache is None:
+                    pending.append((None, None,
+                                    pool.apply_async(_map_chunk, (fn, chunk))))
+                    continue
+
+                keys, found, misses = _lookup_chunk(cache, chunk)
+                pending.append((keys, found,
+                                pool.apply_async(_map_chunk, (fn, misses))))
+
+            if not pending:
+                return
+
+            keys, found, result = pending.popleft()
+            if cache is None:
+                yield from result.get()
+            else:
+                yield from _merge_chunk(cache, keys, found, result.get())
+
+
+def _map_chunk(fn, chunk):
+    return [fn(line) for line in chunk]
+
+
+def _lookup_chunk(cache, chunk):
+    """
+    Return
+    ------
+    list, dict, list
+        The cache key of every line, the cached results by key and the
+        distinct lines that still have to be computed, in order.
+    """
+
+    keys = [cache.key(line) for line in chunk]
+    found = cache.get_many(keys)
+
+    # Repeated lines are only computed once
+    misses = {}
+    for key, line in zip(keys, chunk):
+        if key not in found and key not in misses:
+            misses[key] = line
+    return keys, found, list(misses.values())
+
+
+def _merge_chunk(cache, keys, found, computed):
+    """
+    Stores the computed results and returns the results of the whole chunk
+    in input order.
+    """
+
+    computed = iter(computed)
+    results = []
+    new = {}
+    for key in keys:
+        if key in found:
+            results.append(found[key])
+        else:
+            if key not in new:
+                new[key] = next(computed)
+            results.append(new[key])
+
+    if new:
+        cache.put_many(new.items())
+    return results
+
+
+def add_workers_argument(parser):
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes to use. Output '
+                             'order is the same as the input. (default=1)')
@@ -0,0 +1,174 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+
+LANGS = ['jp', 'en']
+DATASETS = ['train', 'dev', 'test']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Parses every subdirectory of train.{en,jp}, '
+                    'dev.{en,jp} and test.{en,jp} into penman graphs with '
+                    'ACE, running several parser processes at once. Each '
+                    'subdirectory gets a "graphs" file. Subdirectories that '
+                    'already have one are skipped, so an interrupted run '
+                    'can be resumed.'
+    )
+    parser.add_argument('ace', type=str,
+                        help='ACE binary.')
+    parser.add_argument('erg', type=str,
+                        help='ERG grammar image, used for English.')
+    parser.add_argument('jacy', type=str,
+                        help='Jacy grammar image, used for Japanese.')
+    parser.add_argument('data', type=str,
+                        help='Data folder. Should contain train.{en,jp}, '
+                             'dev.{en,jp}, test.{en,jp}.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='Number of parser processes to run at once. '
+                             '(default=number of CPUs)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Seconds a subdirectory may take before its '
+                             'parser is killed. (default=no limit)')
+    parser.add_argument('--retries', type=int, default=1,
+                        help='Number of times to retry a subdirectory that '
+                             'failed or timed out. (default=1)')
+    parser.add_argument('--parser', type=str,
+                        default='parser/mrs_to_penman.py',
+                        help='Script converting ACE output to penman. '
+                             '(default="parser/mrs_to_penman.py")')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Reparse subdirectories that already have a '
+                             '"graphs" file.')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data):
+        print('{} does not exist. Exiting.'.format(args.data))
+        sys.exit(1)
+
+    grammars = {'en': args.erg, 'jp': args.jacy}
+    shards = [(path, grammars[lang]) for lang, path
+              in find_shards(args.data, args.overwrite)]
+
+    failed = parse_shards(shards, args.ace, args.parser, args.jobs,
+                          args.timeout, args.retries)
+
+    if failed:
+        print('Failed to parse {} subdirectories:'.format(len(failed)))
+        for path in failed:
+            print(path)
+        sys.exit(1)
+
+
+def find_shards(data, overwrite=False):
+    """
+    Yields (lang, path) for every subdirectory that still needs parsing, in
+    the same order parse_graphs.sh visited them.
+    """
+
+    for lang in LANGS:
+        for dataset in DATASETS:
+            lang_dir = os.path.join(data, '{}.{}'.format(dataset, lang))
+            if not os.path.isdir(lang_dir):
+                continue
+
+            for sub in sorted(os.listdir(lang_dir)):
+                path = os.path.join(lang_dir, sub)
+                if not os.path.isdir(path):
+                    continue
+                if overwrite or not os.path.exists(os.path.join(path, 'graphs')):
+                    yield lang, path
+
+
+def parse_shards(shards, ace, parser, jobs, timeout=None, retries=1):
+    """
+    Parses shards, a list of (path, grammar), with at most jobs parsers
+    running at once.
+
+    Return
+    ------
+    list
+        Paths of the shards that could not be parsed.
+    """
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {
+            executor.submit(parse_shard, path, grammar, ace, parser,
+                            timeout, retries): path
+            for path, grammar in shards
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            if not future.result():
+                failed.append(futures[future])
+    return sorted(failed)
+
+
+def parse_shard(path, grammar, ace, parser, timeout=None, retries=1):
+    """
+    Runs the parser on one subdirectory, retrying on failure or timeout.
+
+    Output goes to a temporary file that is only renamed to "graphs" once
+    the parser exits cleanly, so an existing "graphs" file is always
+    complete.
+
+    Return
+    ------
+    bool
+        Whether the subdirectory was parsed.
+    """
+
+    output = os.path.join(path, 'graphs')
+    partial = output + '.partial'
+    command = [sys.executable, parser, '--ace-binary', ace, '-g', grammar,
+               '-i', path]
+
+    for attempt in range(retries + 1):
+        try:
+            with open(partial, 'w') as f:
+                run_group(command, f, timeout)
+        except subprocess.TimeoutExpired:
+            tqdm.write('{}: timed out (attempt {})'.format(path, attempt + 1))
+        except subprocess.CalledProcessError as e:
+            tqdm.write('{}: exited with {} (attempt {})'.format(
+                path, e.returncode, attempt + 1))
+        else:
+            os.replace(partial, output)
+            return True
+
+    if os.path.exists(partial):
+        os.remove(partial)
+    return False
+
+
+def run_group(command, stdout, timeout=None):
+    """
+    Runs command in its own process group, like subprocess.run with
+    check=True. On a timeout (or any other error while waiting) the whole
+    group is killed and reaped, so the ACE process the parser script started
+    does not outlive it and keep a CPU busy.
+    """
+
+    process = subprocess.Popen(command, stdout=stdout, start_new_session=True)
+    try:
+        process.wait(timeout=timeout)
+    except BaseException:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+        raise
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+if __name__ == '__main__':
+    main()
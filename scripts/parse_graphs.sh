@@ -5,24 +5,10 @@
 # $2 - erg
 # $3 - jacy
 # $4 - data folder. should contain train.{en,jp}, dev.{en,jp}, test.{en,jp}
+#
+# Any further arguments (e.g. --jobs 8 --timeout 3600) are passed on to
+# parse_graphs.py, which parses the subdirectories in parallel and skips the
+# ones that already have a graphs file.
 
 
-ace=$1
-erg=$2
-jacy=$3
-data=$4
-
-
-for lang in "jp" "en"; do
-    for dataset in "train" "dev" "test"; do
-        ls $data/$dataset.$lang | while read SUB; do
-            if [ $lang = "en" ]; then
-                grammar=$erg
-            else
-                grammar=$jacy
-            fi
-            full_path=$data/$dataset.$lang/$SUB
-            python parser/mrs_to_penman.py --ace-binary $ace -g $grammar -i $full_path > $full_path/graphs
-        done
-    done
-done
+python "$(dirname "$0")/parse_graphs.py" "$@"
@@ -0,0 +1,127 @@
+import re
+
+
+from collections import namedtuple
+
+
+Block = namedtuple('Block', ['id', 'sentence', 'lines'])
+
+
+# A line that starts a node, i.e. the root or a role (:ARG1-NEQ, :RSTR-H, ...)
+_node_line_pattern = re.compile(r'\(|:[A-Z]')
+
+
+def read_blocks(lines):
+    """
+    Reads the blank line separated blocks written by the parser in a single
+    pass over lines (e.g. an open file).
+
+    Every blank line ends a block, so consecutive blank lines produce empty
+    blocks. clean_parse.py relies on this to keep the two languages aligned.
+
+    Return
+    ------
+    iterator of Block
+        id is the whole '# ::id' line and sentence the text of the
+        '# ::snt' line (None if missing). lines holds the remaining stripped
+        lines, without comments.
+    """
+
+    graph_id = None
+    sentence = None
+    block = []
+    open_block = False
+    for line in lines:
+        line = line.strip()
+        if not line:
+            yield Block(graph_id, sentence, block)
+            graph_id = None
+            sentence = None
+            block = []
+            open_block = False
+            continue
+
+        open_block = True
+        if line.startswith('#'):
+            if line.startswith('# ::id'):
+                graph_id = line
+            elif line.startswith('# ::snt'):
+                sentence = line[len('# ::snt'):].strip()
+        else:
+            block.append(line)
+
+    if open_block:
+        yield Block(graph_id, sentence, block)
+
+
+def clean_block(lines, full=False):
+    """
+    Converts the lines of one parsed graph into the tokens clean_parse.py
+    writes: opening parens are attached to roles, closing parens are split
+    off, :lnk and :carg are dropped and, unless full is True, so is every
+    other feature.
+
+    Return
+    ------
+    list
+        The cleaned lines. The graph is ' '.join of them.
+    """
+
+    parse = []
+    for feat in lines:
+
+        # skip concrete args
+        if feat.startswith(':carg'):
+            continue
+
+        # separate opening paren from graph root
+        if feat.startswith('('):
+            feat = feat.replace('(', '( ')
+
+        # attach opening paren to node rather than label
+        elif '(' in feat:
+            feat = feat.replace(' (', '( ')
+
+        # splits a part closing brackets
+        if feat.endswith(')'):
+            feat = feat.replace(')', ' )')
+
+        # remove lines that have lnk while preserving closing brackets
+        if feat.startswith(':lnk'):
+
+            # append closing brackets to previous feature
+            if feat.endswith(')'):
+                paren_index = feat.find('>"')
+                prev = parse.pop()
+                parse.append(prev + feat[paren_index + 2:])
+
+        # keep everything else if we need the full representation
+        elif full:
+            parse.append(feat)
+        else:
+
+            # if it a node
+            if _node_line_pattern.match(feat):
+                parse.append(feat)
+
+            # or has closing parens
+            elif feat.endswith(')'):
+                paren_index = feat.find(' )')
+                prev = parse.pop()
+                parse.append(prev + feat[paren_index:])
+
+    return parse
+
+
+def clean_pairs(lines1, lines2, full=False):
+    """
+    Reads the graphs of two languages in lockstep, pairing blocks by
+    position, and yields (graph1, graph2) for every pair in which both
+    graphs could be generated.
+    """
+
+    for block1, block2 in zip(read_blocks(lines1), read_blocks(lines2)):
+        parse1 = clean_block(block1.lines, full)
+        parse2 = clean_block(block2.lines, full)
+        if len(parse1) > 1 and len(parse2) > 1:
+            yield ' '.join(parse1), ' '.join(parse2)
@@ -0,0 +1,472 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from aggregate_cleaner import align_parses, write_parses
+from parse_graphs import parse_shard
+from penman_reader import clean_pairs
+from simplify_graph import transform_graphs
+
+
+LANGS = ['en', 'jp']
+DATASETS = ['train', 'dev', 'test']
+
+STATE_FILE = 'pipeline.json'
+
+# Bump when a stage changes its output so old results are not reused
+PIPELINE_VERSION = 1
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs the steps from parallel text to training files '
+                    '(segmenting, parsing, aggregating, cleaning and '
+                    'simplifying) as a graph of stages. A stage only runs '
+                    'again if the contents of its inputs or its options '
+                    'changed since it last succeeded, and independent stages '
+                    '(e.g. the languages and splits) run in parallel.'
+    )
+    parser.add_argument('data', type=str,
+                        help='Data folder, as for parse_graphs.py. Should '
+                             'contain train.{en,jp}, dev.{en,jp}, '
+                             'test.{en,jp} with a subdirectory per parser '
+                             'run.')
+    parser.add_argument('output_dir', type=str,
+                        help='Where to write the stage outputs and the state '
+                             'of the last run. Training files are written to '
+                             '<output_dir>/simplified/{train,dev,test}.txt.')
+    parser.add_argument('--raw', type=str, default=None,
+                        help='Also segments {train,dev,test}.{en,jp} in this '
+                             'folder into <output_dir>/segmented/ with '
+                             'segment.py.')
+    parser.add_argument('--ace', type=str, default=None,
+                        help='ACE binary. Without --ace, --erg and --jacy, '
+                             'the existing "graphs" files are used as they '
+                             'are.')
+    parser.add_argument('--erg', type=str, default=None,
+                        help='ERG grammar image, used for English.')
+    parser.add_argument('--jacy', type=str, default=None,
+                        help='Jacy grammar image, used for Japanese.')
+    parser.add_argument('--parser', type=str,
+                        default='parser/mrs_to_penman.py',
+                        help='Script converting ACE output to penman. '
+                             '(default="parser/mrs_to_penman.py")')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Seconds a subdirectory may take before its '
+                             'parser is killed. (default=no limit)')
+    parser.add_argument('--retries', type=int, default=1,
+                        help='Number of times to retry a subdirectory that '
+                             'failed or timed out. (default=1)')
+    parser.add_argument('--sub-dirs', type=str, nargs='+', default=None,
+                        help='Only use subdirectories starting with one of '
+                             'these prefixes.')
+    parser.add_argument('--full', action='store_true',
+                        help='Keeps all features of the DMRS graphs, as '
+                             'clean_parse.py --full does.')
+    parser.add_argument('--feature-type', type=str, default='squash',
+                        choices=['squash', 'expand', 'stable'],
+                        help='Feature format of the training files, as for '
+                             'simplify_graph.py. (default="squash", as '
+                             'preprocess.py writes them)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='Number of stages to run at once. '
+                             '(default=number of CPUs)')
+    parser.add_argument('--force', type=str, nargs='+', default=[],
+                        help='Reruns the stages whose names start with one of '
+                             'these prefixes, e.g. "clean/" or "parse/".')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only prints the stages that would run.')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data):
+        print('{} does not exist. Exiting.'.format(args.data))
+        sys.exit(1)
+
+    grammars = None
+    if args.ace or args.erg or args.jacy:
+        if not (args.ace and args.erg and args.jacy):
+            parser.error('--ace, --erg and --jacy are required to parse')
+        grammars = {'en': args.erg, 'jp': args.jacy}
+
+    stages = build_stages(args.data, args.output_dir, args.raw, grammars,
+                          args.ace, args.parser, args.timeout, args.retries,
+                          args.sub_dirs, args.full, args.feature_type)
+    pipeline = Pipeline(stages, os.path.join(args.output_dir, STATE_FILE))
+    results = pipeline.run(args.jobs, args.force, args.dry_run)
+
+    print_summary(results)
+    if any(status == 'failed' for status, _ in results.values()):
+        sys.exit(1)
+
+
+class Stage:
+    """
+    A step of the pipeline. fn(**options) reads the inputs and writes the
+    outputs. It has to be picklable, since stages run in worker processes.
+    """
+
+    def __init__(self, name, fn, inputs, outputs, options=None):
+        self.name = name
+        self.fn = fn
+        self.inputs = [os.path.normpath(path) for path in inputs]
+        self.outputs = [os.path.normpath(path) for path in outputs]
+        self.options = options or {}
+
+    def run(self):
+        self.fn(**self.options)
+
+    def describe(self):
+        """
+        What the stage does apart from its inputs, i.e. the function and its
+        options.
+        """
+
+        fn = self.fn.func if isinstance(self.fn, partial) else self.fn
+        return repr((PIPELINE_VERSION, fn.__module__, fn.__name__,
+                     sorted(self.options.items())))
+
+
+class Pipeline:
+    """
+    Runs stages in dependency order. A stage depends on the stages that
+    write its inputs, and any other input has to exist before the run.
+
+    The state file records, for every stage that succeeded, a hash of its
+    inputs' contents and its options, and the hashes of the outputs it
+    wrote. A stage whose hash is unchanged and whose outputs are still the
+    ones it wrote is skipped. Like make, file hashes are reused while a
+    file's size and modification time stay the same, so unchanged files are
+    not read again.
+    """
+
+    def __init__(self, stages, state_path):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = state_path
+
+        producers = {}
+        for stage in stages:
+            for path in stage.outputs:
+                if path in producers:
+                    raise ValueError('{} is written by both {} and {}'.format(
+                        path, producers[path], stage.name))
+                producers[path] = stage.name
+        self.depends = {
+            stage.name: sorted({producers[path] for path in stage.inputs
+                                if path in producers})
+            for stage in stages
+        }
+
+        self.state = {'stages': {}, 'files': {}}
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                self.state = json.load(f)
+
+    def run(self, jobs=1, force=(), dry_run=False):
+        """
+        Return
+        ------
+        dict
+            Maps every stage name to (status, seconds), where status is
+            "done", "up to date", "failed", "blocked" (a dependency failed) or
+            "would run" for a dry run.
+        """
+
+        results = {}
+        waiting = set(self.stages)
+        running = {}
+        with ProcessPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            while waiting or running:
+                progress = len(waiting) + len(running)
+                for name in sorted(waiting):
+                    statuses = [results.get(dep, (None,))[0]
+                                for dep in self.depends[name]]
+                    if None in statuses:
+                        continue
+                    waiting.remove(name)
+
+                    if any(status in ('failed', 'blocked')
+                           for status in statuses):
+                        results[name] = ('blocked', 0.0)
+                        log(name, 'blocked')
+                    elif (dry_run and 'would run' in statuses
+                          or any(name.startswith(prefix) for prefix in force)):
+                        if dry_run:
+                            results[name] = ('would run', 0.0)
+                            log(name, 'would run')
+                        else:
+                            running[self._submit(executor, name)] = name
+                    elif self._missing_inputs(name):
+                        results[name] = ('failed', 0.0)
+                        log(name, 'failed', 'missing {}'.format(
+                            ', '.join(self._missing_inputs(name))))
+                    elif self._up_to_date(name):
+                        results[name] = ('up to date', 0.0)
+                        log(name, 'up to date')
+                    elif dry_run:
+                        results[name] = ('would run', 0.0)
+                        log(name, 'would run')
+                    else:
+                        running[self._submit(executor, name)] = name
+
+                if not running:
+                    if len(waiting) == progress:
+                        raise ValueError('the stages {} depend on each '
+                                         'other'.format(sorted(waiting)))
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        seconds = future.result()
+                    except Exception as e:
+                        results[name] = ('failed', 0.0)
+                        self.state['stages'].pop(name, None)
+                        log(name, 'failed', '{}: {}'.format(
+                            type(e).__name__, e))
+                    else:
+                        results[name] = ('done', seconds)
+                        self._record(name)
+                        log(name, 'done', '{:.2f}s'.format(seconds))
+                    self._save()
+        return results
+
+    def _submit(self, executor, name):
+        stage = self.stages[name]
+        for path in stage.outputs:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        log(name, 'running')
+        return executor.submit(_run_stage, stage)
+
+    def _missing_inputs(self, name):
+        return [path for path in self.stages[name].inputs
+                if not os.path.exists(path)]
+
+    def _stage_key(self, name):
+        stage = self.stages[name]
+        digest = hashlib.sha1(stage.describe().encode('utf-8'))
+        for path in stage.inputs:
+            digest.update(b'\0')
+            digest.update(path.encode('utf-8'))
+            digest.update(self._file_hash(path).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _up_to_date(self, name):
+        recorded = self.state['stages'].get(name)
+        if recorded is None or recorded['key'] != self._stage_key(name):
+            return False
+        return all(os.path.exists(path) and self._file_hash(path) == digest
+                   for path, digest in recorded['outputs'].items())
+
+    def _record(self, name):
+        stage = self.stages[name]
+        self.state['stages'][name] = {
+            'key': self._stage_key(name),
+            'outputs': {path: self._file_hash(path) for path in stage.outputs},
+        }
+
+    def _file_hash(self, path):
+        info = os.stat(path)
+        known = self.state['files'].get(path)
+        if known and known[:2] == [info.st_size, info.st_mtime_ns]:
+            return known[2]
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(partial(f.read, 1 << 20), b''):
+                digest.update(block)
+        self.state['files'][path] = [info.st_size, info.st_mtime_ns,
+                                     digest.hexdigest()]
+        return digest.hexdigest()
+
+    def _save(self):
+        # Written after every stage, so an interrupted run keeps what
+        # finished. The rename keeps the file whole if it is killed midway.
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        partial_path = self.state_path + '.partial'
+        with open(partial_path, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(partial_path, self.state_path)
+
+
+def _run_stage(stage):
+    start = time.perf_counter()
+    stage.run()
+    return time.perf_counter() - start
+
+
+def build_stages(data, output_dir, raw=None, grammars=None, ace=None,
+                 parser='parser/mrs_to_penman.py', timeout=None, retries=1,
+                 sub_dirs=None, full=False, feature_type='squash'):
+    """
+    Return
+    ------
+    list
+        The stages from segmenting (with raw) and parsing (with grammars) to
+        the simplified training files, one branch per split and language.
+    """
+
+    stages = []
+    if raw is not None:
+        for dataset in DATASETS:
+            source, target = [os.path.join(raw, '{}.{}'.format(dataset, lang))
+                              for lang in LANGS]
+            if not (os.path.exists(source) and os.path.exists(target)):
+                continue
+            output = os.path.join(output_dir, 'segmented')
+            stages.append(Stage(
+                'segment/{}'.format(dataset), segment_files,
+                [source, target],
+                [os.path.join(output, os.path.basename(path))
+                 for path in [source, target]],
+                {'source': source, 'target': target, 'output_dir': output}))
+
+    for dataset in DATASETS:
+        subs = find_subdirectories(data, dataset, sub_dirs)
+        if subs is None:
+            continue
+
+        graphs = {}
+        for lang in LANGS:
+            graphs[lang] = []
+            for sub in subs:
+                path = os.path.join(data, '{}.{}'.format(dataset, lang), sub)
+                graphs[lang].append(os.path.join(path, 'graphs'))
+                if grammars is None:
+                    continue
+
+                shard_inputs = [os.path.join(path, name)
+                                for name in sorted(os.listdir(path))
+                                if name not in ('graphs', 'graphs.partial')
+                                and os.path.isfile(os.path.join(path, name))]
+                stages.append(Stage(
+                    'parse/{}.{}/{}'.format(dataset, lang, sub), parse_files,
+                    shard_inputs + [ace, grammars[lang], parser],
+                    [os.path.join(path, 'graphs')],
+                    {'path': path, 'grammar': grammars[lang], 'ace': ace,
+                     'parser': parser, 'timeout': timeout,
+                     'retries': retries}))
+
+        # Without parsing, subdirectories are used as aggregate_cleaner.py
+        # does: only those with graphs in both languages
+        pairs = list(zip(graphs['en'], graphs['jp']))
+        if grammars is None:
+            pairs = [pair for pair in pairs
+                     if all(os.path.exists(path) for path in pair)]
+
+        aggregated = [os.path.join(output_dir, 'aggregated',
+                                   '{}.{}'.format(dataset, lang))
+                      for lang in LANGS]
+        stages.append(Stage(
+            'aggregate/{}'.format(dataset), aggregate_files,
+            [path for pair in pairs for path in pair], aggregated,
+            {'pairs': pairs,
+             'output1': aggregated[0], 'output2': aggregated[1]}))
+
+        cleaned = os.path.join(output_dir, 'clean', dataset + '.txt')
+        stages.append(Stage(
+            'clean/{}'.format(dataset), clean_files, aggregated, [cleaned],
+            {'input1': aggregated[0], 'input2': aggregated[1],
+             'output': cleaned, 'full': full}))
+
+        simplified = os.path.join(output_dir, 'simplified', dataset + '.txt')
+        stages.append(Stage(
+            'simplify/{}'.format(dataset), simplify_file, [cleaned],
+            [simplified],
+            {'input': cleaned, 'output': simplified,
+             'feature_type': feature_type}))
+    return stages
+
+
+def find_subdirectories(data, dataset, sub_dirs=None):
+    """
+    Return
+    ------
+    list or None
+        The subdirectories that dataset has in both languages, in sorted
+        order. None if dataset.en does not exist.
+    """
+
+    dirs = [os.path.join(data, '{}.{}'.format(dataset, lang))
+            for lang in LANGS]
+    if not os.path.isdir(dirs[0]):
+        return None
+
+    subs = []
+    for sub in sorted(os.listdir(dirs[0])):
+        if sub_dirs and not any(sub.startswith(prefix) for prefix in sub_dirs):
+            continue
+        if all(os.path.isdir(os.path.join(d, sub)) for d in dirs):
+            subs.append(sub)
+    return subs
+
+
+def segment_files(source, target, output_dir):
+    # segment.py needs MeCab, so it runs as its own process
+    subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, 'segment.py'),
+                    source, target, os.path.join(output_dir, '')],
+                   stdout=subprocess.DEVNULL, check=True)
+
+
+def parse_files(path, grammar, ace, parser, timeout=None, retries=1):
+    if not parse_shard(path, grammar, ace, parser, timeout, retries):
+        raise RuntimeError('could not parse {}'.format(path))
+
+
+def aggregate_files(pairs, output1, output2):
+    # Same as aggregate_cleaner.py --data-root for one dataset
+    with open(output1, 'w') as lang1, open(output2, 'w') as lang2:
+        for pair in pairs:
+            write_parses(align_parses(pair), lang1, lang2)
+
+
+def clean_files(input1, input2, output, full=False):
+    # Same as clean_parse.py, but pairs are written tab separated, which is
+    # what simplify_graph.py and preprocess.py read
+    with open(input1, 'r') as text1, open(input2, 'r') as text2, \
+         open(output, 'w') as f:
+        for graph1, graph2 in clean_pairs(text1, text2, full):
+            f.write('{}\t{}\n'.format(graph1, graph2))
+
+
+def simplify_file(input, output, feature_type='squash'):
+    transform = partial(transform_graphs, feature_type=feature_type)
+    with open(input, 'r') as f, open(output, 'w') as out:
+        for line in f:
+            out.write(transform(line))
+
+
+def log(name, status, detail=''):
+    print('{:<40} {:<10} {}'.format(name, status, detail).rstrip(), flush=True)
+
+
+def print_summary(results):
+    counts = {}
+    for status, _ in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    print(', '.join('{} {}'.format(count, status)
+                    for status, count in sorted(counts.items())))
+
+    timed = sorted(((seconds, name) for name, (status, seconds)
+                    in results.items() if status == 'done'), reverse=True)
+    if timed:
+        print('Slowest stages:')
+        for seconds, name in timed[:10]:
+            print('  {:<40} {:>8.2f}s'.format(name, seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,18 @@
 import argparse
 
 
+from collections import Counter
+from functools import partial
 from tqdm import tqdm
-from simplify_graph import get_all_nodes_pattern, \
-                           get_instance_node_pattern, \
-                           get_invalid_node_pattern, \
-                           expand, filter_feats, reverse, \
-                           check_parens
+from parallel import imap_lines, add_workers_argument
+from profiling import add_profile_arguments, open_profiler
+from simplify_graph import expand, filter_feats, reverse, validate, \
+                           INVALID_PARENS, INVALID_EMPTY, INVALID_REVERSE, \
+                           TRANSFORMS
+from transform_cache import add_cache_arguments, open_cache
+
+
+INVALID_GRAPH = '(999999999 / invalid)\n'
 
 
 def main():
@@ -22,43 +28,94 @@ def main():
                         help='Removes all features.')
     parser.add_argument('--include-features', nargs='+', default=[],
                         help='Features to include separated by spaces.')
+    add_workers_argument(parser)
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
-    with open(args.input, 'r') as f:
-        predictions = f.readlines()
+    profiler = open_profiler(args, [recover_prediction] + TRANSFORMS)
+    options = {'include_features': args.include_features,
+               'remove_all_features': args.remove_all_features}
+    transform = partial(recover_prediction, **options)
+    cache = open_cache(args, 'recover_prediction', options)
+
+    failures = Counter()
+    total = 0
 
-    # Reverse is true because model outputs simplified graphs
-    instance_nodes_pattern = get_instance_node_pattern(reverse=True)
-    all_nodes_pattern = get_all_nodes_pattern()
-    invalid_node_pattern = get_invalid_node_pattern()
+    # Streams the input so memory does not grow with the size of the file
+    with open(args.input, 'r') as f, open(args.output, 'w') as output:
+        preds = imap_lines(transform, f, args.workers, cache=cache)
+        for i, (pred, reason) in enumerate(tqdm(preds)):
+            total += 1
+            if reason:
+                failures[reason] += 1
+
+            # Graphs are separated by an empty line
+            if i > 0:
+                output.write('\n')
 
-    with open(args.output, 'w') as output:
-        for i, pred in enumerate(tqdm(predictions)):
+            # Write reversed, unsquashed graph to file
+            output.write(pred)
 
-            # Adds node labels
-            instance_nodes = [node[0] for node
-                              in list(instance_nodes_pattern.findall(pred))]
-            pred = reverse(pred, instance_nodes)
+    print('{} of {} graphs were invalid'.format(sum(failures.values()), total))
+    for reason, count in failures.most_common():
+        print('{:<20} {}'.format(reason, count))
 
-            # Expanding features
-            pred = expand(pred)
+    if cache is not None:
+        cache.close()
+        print(cache.stats())
 
-            # Filtering features
-            pred = filter_feats(pred, args.include_features,
-                                args.remove_all_features)
+    if profiler is not None:
+        profiler.close(args.profile)
 
-            if (not check_parens(pred) or invalid_node_pattern.search(pred)
-                or '　' in pred):
-                pred = '(999999999 / invalid)\n'
 
-            # Handles predicted predicates after the end of the graph
-            last_paren = pred.rfind(')')
-            pred = pred[:last_paren + 1] + '\n'
+def postprocess(pred, include_features=[], remove_all_features=False):
+    """
+    Recovers a single predicted graph so it can be evaluated with SMATCH.
+    Ill-formed graphs are replaced with '(999999999 / invalid)'.
+    """
 
-            # Write reversed, unsquashed graph to file
-            output.write(pred)
-            if i < len(predictions) - 1:
-                output.write('\n')
+    return recover_prediction(pred, include_features, remove_all_features)[0]
+
+
+def recover_prediction(pred, include_features=[], remove_all_features=False):
+    """
+    Same as postprocess, but also says why a graph was replaced.
+
+    Return
+    ------
+    str, str or None
+        The recovered graph and, if it is invalid, the validate reason code
+        or INVALID_REVERSE if reverse could not recover it.
+    """
+
+    # Rejects graphs that would be invalid whatever the transforms do. Only
+    # filtering features can fix a graph that reverse accepts (by removing
+    # the features of an unlabelled node), so without it every reason is
+    # final.
+    reason = validate(pred)
+    if reason in (INVALID_PARENS, INVALID_EMPTY) or (
+            reason and not include_features and not remove_all_features):
+        return INVALID_GRAPH, reason
+
+    # Adds node labels
+    pred = reverse(pred)
+    if pred == INVALID_GRAPH:
+        return INVALID_GRAPH, INVALID_REVERSE
+
+    # Expanding features
+    pred = expand(pred)
+
+    # Filtering features
+    pred = filter_feats(pred, include_features, remove_all_features)
+
+    reason = validate(pred, check_content=False)
+    if reason:
+        return INVALID_GRAPH, reason
+
+    # Handles predicted predicates after the end of the graph
+    last_paren = pred.rfind(')')
+    return pred[:last_paren + 1] + '\n', None
 
 
 if __name__ == '__main__':
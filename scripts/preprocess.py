@@ -1,61 +1,95 @@
 import argparse
+import json
 import re
 
 
+from functools import partial
 from tqdm import tqdm
-from simplify_graph import get_all_nodes_pattern, \
-                           get_instance_node_pattern, \
-                           squash, simplify, find_features
-
-
-parser = argparse.ArgumentParser(
-    description='Takes the parsed input and outputs the data in squashed '
-                'format in train, dev, and test datasets.'
-)
-parser.add_argument('input', type=str,
-                    help='Input file.')
-parser.add_argument('output', type=str,
-                    help='Output path.')
-args = parser.parse_args()
-
-
-instance_nodes_pattern = get_instance_node_pattern()
-all_nodes_pattern = get_all_nodes_pattern()
-
-
-with open(args.input, 'r') as f:
-    lines = list(f.readlines())
-
-    # Input should be in the format:
-    # <original graph> \t <translation graph> \n
-    for j, graphs in enumerate(tqdm(lines)):
-        graphs = graphs.split('\t')
-
-        for i in range(len(graphs)):
-            graph = graphs[i]
-
-            # Grabs all instance nodes
-            instance_nodes = list(instance_nodes_pattern.findall(graph))
-
-            # Removes or adds node labels depending on flags
-            graph = simplify(graph, instance_nodes)
-
-            all_nodes = list(all_nodes_pattern.finditer(graph))
-            features = find_features(graph, all_nodes)
-            graph = squash(graph, features)
-
-            graphs[i] = graph
-
-        lines[j] = '\t'.join(graphs)
-
-train_size = int(len(lines) * .8)
-dev_size = int(len(lines) * .1)
-
-train = lines[:train_size]
-dev = lines[train_size:train_size + dev_size]
-test = lines[train_size + dev_size:]
-
-for dataset, path in zip([train, dev, test], ['train.txt', 'dev.txt', 'test.txt']):
-    with open(args.output + path, 'w') as output:
-        for line in dataset:
-            output.write(line)
+from length_stats import line_lengths, length_stats, print_stats
+from parallel import imap_lines, add_workers_argument
+from profiling import add_profile_arguments, open_profiler
+from simplify_graph import transform_graphs, TRANSFORMS
+from transform_cache import add_cache_arguments, open_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Takes the parsed input and outputs the data in squashed '
+                    'format in train, dev, and test datasets.'
+    )
+    parser.add_argument('input', type=str,
+                        help='Input file.')
+    parser.add_argument('output', type=str,
+                        help='Output path.')
+    parser.add_argument('--stats', action='store_true',
+                        help='Reports the length distribution and padding '
+                             'of the train split (see length_stats.py) and '
+                             'writes it to <output>stats.json.')
+    add_workers_argument(parser)
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profiler = open_profiler(args, [transform_graphs] + TRANSFORMS)
+
+    # Removes node labels and squashes features
+    options = {'recover': False, 'feature_type': 'squash'}
+    transform = partial(transform_graphs, **options)
+    cache = open_cache(args, 'transform_graphs', options)
+
+    # First pass only counts lines so the split sizes are known before any
+    # line is written. Nothing is held in memory.
+    with open(args.input, 'r') as f:
+        total = sum(1 for _ in f)
+
+    train_size = int(total * .8)
+    dev_size = int(total * .1)
+
+    paths = ['train.txt', 'dev.txt', 'test.txt']
+    outputs = [open(args.output + path, 'w') for path in paths]
+    train_lengths = []
+    try:
+        with open(args.input, 'r') as f:
+
+            # Input should be in the format:
+            # <original graph> \t <translation graph> \n
+            lines = imap_lines(transform, f, args.workers, cache=cache)
+            for i, line in enumerate(tqdm(lines, total=total)):
+                split = split_index(i, train_size, dev_size)
+                outputs[split].write(line)
+                if args.stats and split == 0:
+                    train_lengths.append(line_lengths(line))
+    finally:
+        for output in outputs:
+            output.close()
+        if cache is not None:
+            cache.close()
+
+    if cache is not None:
+        print(cache.stats())
+
+    if args.stats:
+        stats = length_stats(train_lengths)
+        print_stats(stats)
+        with open(args.output + 'stats.json', 'w') as f:
+            json.dump(stats, f, indent=2)
+
+    if profiler is not None:
+        profiler.close(args.profile)
+
+
+def split_index(i, train_size, dev_size):
+    """
+    Returns 0, 1 or 2 for whether the i-th line belongs to the train, dev or
+    test split.
+    """
+
+    if i < train_size:
+        return 0
+    elif i < train_size + dev_size:
+        return 1
+    return 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import cProfile
+import functools
+import heapq
+import json
+import resource
+import sys
+import time
+import tracemalloc
+
+
+DEFAULT_TOP = 10
+
+
+class Profiler:
+    """
+    Records the wall time, calls and (with memory set) the peak traced
+    memory of instrumented functions, and the slowest graphs they were
+    called on. Only instrumented functions pay for the bookkeeping, so
+    nothing changes for a run that does not create a Profiler.
+
+    Times are inclusive. 'self_seconds' leaves out the time spent in other
+    instrumented functions, so the self times of all functions add up to
+    the time spent in them and the rest of the run is I/O and the script's
+    own loop. Peak memory is measured with tracemalloc, which slows every
+    allocation down, so times are only comparable between runs with the
+    same setting.
+    """
+
+    def __init__(self, top=DEFAULT_TOP, memory=False, stats_path=None):
+        self.top = top
+        self.memory = memory
+        self.stats_path = stats_path
+        self.functions = {}
+        self.slowest = []
+        self.stack = []
+        self.calls = 0
+
+        # Memory traced before tracemalloc was last restarted (see
+        # _reset_peak)
+        self.memory_offset = 0
+
+        self.start = time.perf_counter()
+        if memory:
+            tracemalloc.start()
+        self.cprofile = None
+        if stats_path:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def instrument(self, *functions):
+        """
+        Replaces every reference to functions in the loaded modules (e.g.
+        the names other scripts imported with 'from simplify_graph import')
+        with a recording wrapper, so calls between functions are recorded
+        too.
+        """
+
+        wrappers = {id(fn): self.wrap(fn) for fn in functions}
+        for module in list(sys.modules.values()):
+            for name, value in list(getattr(module, '__dict__', {}).items()):
+                if id(value) in wrappers:
+                    setattr(module, name, wrappers[id(value)])
+
+    def wrap(self, fn):
+        name = fn.__name__
+        entry = self.functions.setdefault(name, {
+            'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0, 'peak_kb': 0.0
+        })
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # [seconds spent in nested instrumented calls, their peak]
+            frame = [0.0, 0]
+            if self.memory:
+                self._reset_peak()
+                base = self._traced_memory()[0]
+            self.stack.append(frame)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.stack.pop()
+                entry['calls'] += 1
+                entry['seconds'] += elapsed
+                entry['self_seconds'] += elapsed - frame[0]
+
+                peak = 0
+                if self.memory:
+                    # A nested call resets the peak, so the parent's peak is
+                    # also the highest of its children's
+                    peak = max(self._traced_memory()[1], frame[1])
+                    entry['peak_kb'] = max(entry['peak_kb'],
+                                           (peak - base) / 1024)
+                    self._reset_peak()
+
+                if self.stack:
+                    self.stack[-1][0] += elapsed
+                    self.stack[-1][1] = max(self.stack[-1][1], peak)
+                else:
+                    self._record_graph(name, elapsed, args)
+
+        return wrapper
+
+    def _traced_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        return current + self.memory_offset, peak + self.memory_offset
+
+    def _reset_peak(self):
+        """
+        Sets the traced peak to the current traced memory.
+        tracemalloc.reset_peak is new in Python 3.9. Before that tracing is
+        restarted instead, which also forgets the blocks traced so far, so
+        their size is kept in memory_offset. Freeing one of those blocks
+        then no longer lowers the traced memory, so peaks can come out a
+        little high.
+        """
+
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+            return
+        self.memory_offset += tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+
+    def _record_graph(self, name, elapsed, args):
+        """
+        Keeps the top slowest outermost calls with the size of the graph
+        (the first argument) they were called on.
+        """
+
+        self.calls += 1
+        if not self.top:
+            return
+
+        graph = args[0] if args and isinstance(args[0], str) else ''
+        item = (elapsed, self.calls, name, len(graph), len(graph.split()))
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def report(self):
+        total = time.perf_counter() - self.start
+        tracked = sum(entry['self_seconds']
+                      for entry in self.functions.values())
+
+        functions = {}
+        for name, entry in sorted(self.functions.items(),
+                                  key=lambda item: -item[1]['self_seconds']):
+            if not entry['calls']:
+                continue
+            functions[name] = dict(entry)
+            if not self.memory:
+                del functions[name]['peak_kb']
+
+        return {
+            'seconds': total,
+            'untracked_seconds': total - tracked,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'functions': functions,
+            'slowest': [{'seconds': seconds, 'call': call, 'function': name,
+                         'chars': chars, 'tokens': tokens}
+                        for seconds, call, name, chars, tokens
+                        in sorted(self.slowest, reverse=True)],
+        }
+
+    def close(self, path):
+        """
+        Writes the JSON report to path, and the cProfile stats if they were
+        requested, and prints a summary.
+        """
+
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.stats_path)
+        report = self.report()
+        if self.memory:
+            tracemalloc.stop()
+
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print_report(report)
+
+
+def print_report(report):
+    print('Profile: {:.2f}s, {:.2f}s outside the instrumented functions'.format(
+        report['seconds'], report['untracked_seconds']))
+    for name, entry in report['functions'].items():
+        line = '  {:<20} {:>9} calls {:>9.3f}s {:>9.3f}s self'.format(
+            name, entry['calls'], entry['seconds'], entry['self_seconds'])
+        if 'peak_kb' in entry:
+            line += ' {:>10.1f}KB peak'.format(entry['peak_kb'])
+        print(line)
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Writes a JSON report of the time, calls and '
+                             'slowest graphs of each transform to this file. '
+                             'Transforms run in this process, so --workers is '
+                             'ignored.')
+    parser.add_argument('--profile-top', type=int, default=DEFAULT_TOP,
+                        help='Number of slowest graphs in the report. '
+                             '(default={})'.format(DEFAULT_TOP))
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='Also records the peak memory of each transform '
+                             'with tracemalloc, which slows the run down.')
+    parser.add_argument('--profile-stats', type=str, default=None,
+                        help='Also writes cProfile stats (for pstats or '
+                             'snakeviz) to this file.')
+
+
+def open_profiler(args, functions):
+    """
+    Returns a Profiler recording functions if --profile was given, otherwise
+    None. The workers of a pool would record their own calls, so the
+    transforms are run in this process instead.
+    """
+
+    if not args.profile:
+        return None
+
+    if getattr(args, 'workers', 1) > 1:
+        print('Profiling runs the transforms in this process, ignoring '
+              '--workers', file=sys.stderr)
+        args.workers = 1
+
+    profiler = Profiler(args.profile_top, args.profile_memory,
+                        args.profile_stats)
+    profiler.instrument(*functions)
+    return profiler
@@ -1,11 +1,17 @@
-import MeCab
 import argparse
+import time
 
 
+from functools import partial
 from tqdm import tqdm
+from parallel import imap_lines, add_workers_argument
 
 
-mt = MeCab.Tagger("-d /usr/local/lib/mecab/dic/mecab-ipadic-neologd")
+TAGGER_ARGS = '-d /usr/local/lib/mecab/dic/mecab-ipadic-neologd'
+
+
+# Each process creates its own tagger the first time it segments a sentence
+_taggers = {}
 
 
 def main():
@@ -20,49 +26,88 @@ def main():
     parser.add_argument('output_dir', type=str,
                         help='Directory where the output should go. The files '
                              'will have the same name as source and target.')
+    parser.add_argument('--tagger-args', type=str, default=TAGGER_ARGS,
+                        help='Arguments for MeCab.Tagger. (default="{}")'
+                             .format(TAGGER_ARGS))
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Number of sentence pairs sent to a worker at a '
+                             'time. (default=1000)')
+    add_workers_argument(parser)
     args = parser.parse_args()
 
-    with open(args.source, 'r') as engl, open(args.target, 'r') as jpn:
-        engl_sentences = engl.readlines()
-        jpn_sentences = jpn.readlines()
+    source_out = args.output_dir + args.source[args.source.rfind('/') + 1:]
+    target_out = args.output_dir + args.target[args.target.rfind('/') + 1:]
 
-    total = len(engl_sentences)
-    filtered = []
+    segment = partial(segment_pair, tagger_args=args.tagger_args)
+
+    start = time.perf_counter()
+    total = 0
+    kept = 0
+    with open(args.source, 'r') as engl_sentences, \
+         open(args.target, 'r') as jpn_sentences, \
+         open(source_out, 'w') as engl, open(target_out, 'w') as jpn:
+        pairs = zip(engl_sentences, jpn_sentences)
+        for pair in tqdm(imap_lines(segment, pairs, args.workers,
+                                    args.batch_size)):
+            total += 1
+            if pair is None:
+                continue
+
+            engl_sent, jpn_sent = pair
+            engl.write(engl_sent)
+            jpn.write(jpn_sent)
+            jpn.write('\n')
+            kept += 1
 
-    for engl, jpn in tqdm(zip(engl_sentences, jpn_sentences), total=total):
-        if '(' in engl or '（' in jpn or '(' in jpn:
-            continue
+    seconds = time.perf_counter() - start
+    print('Kept {} of {} sentence pairs in {:.2f}s ({:.0f} sentences/sec '
+          'with {} workers)'.format(kept, total, seconds,
+                                    total / seconds if seconds else 0,
+                                    args.workers))
 
-        engl_tokens = engl.split()
-        if len(engl_tokens) < 5:
-            continue
 
-        jpn_tokens = []
-        parsed = mt.parseToNode(jpn)
-        error = False
-        while parsed:
-            try:
-                jpn_tokens.append(parsed.surface)
-            except:
-                error = True
-                break
-            parsed = parsed.next
-        if error:
-            continue
+def segment_pair(pair, tagger_args=TAGGER_ARGS):
+    """
+    Return
+    ------
+    tuple or None
+        The English sentence and the segmented Japanese sentence, or None if
+        the pair should be filtered out.
+    """
 
-        jpn_split = ' '.join(jpn_tokens).strip()
+    engl, jpn = pair
+    if '(' in engl or '（' in jpn or '(' in jpn:
+        return None
 
-        filtered.append((engl, jpn_split))
+    engl_tokens = engl.split()
+    if len(engl_tokens) < 5:
+        return None
 
-    source_out = args.output_dir + args.source[args.source.rfind('/') + 1:]
-    target_out = args.output_dir + args.target[args.target.rfind('/') + 1:]
+    try:
+        jpn_tokens = surfaces(get_tagger(tagger_args).parse(jpn))
+    except UnicodeDecodeError:
+        return None
 
-    with open(source_out, 'w') as engl, open(target_out, 'w') as jpn:
-        for engl_sent, jpn_sent in tqdm(filtered):
-            engl.write(engl_sent)
-            jpn.write(jpn_sent)
-            jpn.write('\n')
+    return engl, ' '.join(jpn_tokens).strip()
+
+
+def get_tagger(tagger_args=TAGGER_ARGS):
+    # Imported here so the filtering and surfaces work without MeCab
+    import MeCab
+
+    if tagger_args not in _taggers:
+        _taggers[tagger_args] = MeCab.Tagger(tagger_args)
+    return _taggers[tagger_args]
+
+
+def surfaces(parsed):
+    """
+    Extracts the surface forms from MeCab's default output, where every
+    token is a 'surface\\tfeatures' line and the sentence ends with 'EOS'.
+    """
 
+    return [line.split('\t', 1)[0] for line in parsed.splitlines()
+            if line and line != 'EOS']
 
 
 if __name__ == '__main__':
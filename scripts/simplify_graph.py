@@ -1,13 +1,131 @@
 import argparse
 import re
-from collections import Counter
+from collections import Counter, namedtuple
+from functools import lru_cache, partial
+from itertools import accumulate
 from tqdm import tqdm
+from parallel import imap_lines, add_workers_argument
+from profiling import add_profile_arguments, open_profiler
+from transform_cache import add_cache_arguments, open_cache
+from graph_lexer import scan, has_ambiguous_ids, NODE, REF
 
 
 global_graph = ""
 
 
-def simplify(graph, instance_nodes):
+# Reasons validate gives for an invalid graph. reverse can also fail on a
+# graph that passes validate, e.g. when a reentrancy has no matching node.
+INVALID_PARENS = 'unbalanced_parens'
+INVALID_EMPTY = 'no_content'
+INVALID_NODE = 'unlabelled_node'
+INVALID_FULL_WIDTH_SPACE = 'full_width_space'
+INVALID_REVERSE = 'not_recoverable'
+
+
+# Patterns are compiled once at import and shared by every call (and every
+# worker process). The get_*_pattern functions return these same objects.
+_all_nodes_pattern = re.compile(r'((:[\w-]*)?((\()|( <\*>)) [\w+]+( / [\w+]+)?)')
+_instance_node_pattern = re.compile(r'\d{5} / [\w+]+')
+_simplified_instance_node_pattern = re.compile(r'((:[\w-]*)?\( [\w+]+)')
+_invalid_node_pattern = re.compile(r':[\w-]+\( :')
+
+# Everything check_parens ignores, and what counts as graph content
+_non_paren_pattern = re.compile(r'[/\t \+\w:=-](<\*>)?')
+_content_pattern = re.compile(r'[/\t\+\w:=-](<\*>)?')
+
+# Characters check_parens counts as closing parens, other than the '<', '*'
+# and '>' of a misplaced <*>
+_stray_pattern = re.compile(r'[^/\t \+\w:=()<*>-]')
+_non_paren_run_pattern = re.compile(r'[^()]+')
+
+# Instance nodes and reentrancies of a simplified graph. These never overlap,
+# so one scan finds the same matches as searching for each separately.
+_reverse_pattern = re.compile(r'(?P<node>(:[\w-]*)?\( [\w+]+)|(?P<reentrancy><\*> \w+)')
+
+# Feature formatting
+_expand_intra_feature_pattern = re.compile(r'([\w-]):')
+_squash_inter_feature_pattern = re.compile(r'\w [\+\w-]')
+_squash_intra_feature_pattern = re.compile(r'[\+\w-] :')
+_spaces_pattern = re.compile(' +')
+
+# A feature span the feature table can represent: ' :key value :key value '
+# with single spaces. expand leaves no space after a value ending in '+'
+# (':ind +:pt std'), so pairs may also follow each other directly. Keys end
+# in a word character so every key/value pair is matched by
+# _squash_inter_feature_pattern exactly once.
+_regular_span = (
+    r' :[a-z](?:[\w-]*\w)? [\w+-]+(?: ?:[a-z](?:[\w-]*\w)? [\w+-]+)* ')
+
+# Matches the same nodes as _all_nodes_pattern, each followed by its feature
+# span if it is regular and ends where find_features ends it (at a ')', the
+# next node or the end of the graph). Each node alternative starts with a
+# literal, so re can skip to the next candidate in C.
+_node = r'(?::[\w-]*(?:\(| <\*>)|\(| <\*>) [\w+]+(?: / [\w+]+)?'
+_node_features_pattern = re.compile(r'({0})((?:{1}(?=\)|\Z|{0}))?)'.format(
+    _node, _regular_span))
+_feature_pair_pattern = re.compile(r'(:[a-z](?:[\w-]*\w)?) ([\w+-]+)')
+_feature_name_pattern = re.compile(r'[\w-]+')
+
+# Features of a graph parsed once, one row per node. parts is the graph
+# split into [text, node, span, text, node, span, ..., text], where span is
+# '' for a node without features. The key/value pairs of node i are keys[j]
+# and values[j] for j in offsets[i]:offsets[i + 1]. spaced is False if any
+# pair directly follows the previous one.
+FeatureTable = namedtuple('FeatureTable', ['parts', 'offsets', 'keys',
+                                           'values', 'spaced'])
+
+
+def simplify(graph, instance_nodes=None):
+    """
+    Removes node ids from the graph and marks reentrancies with <*>.
+
+    Lexes the graph once, so the cost is linear in the size of the graph.
+    Graphs whose ids the lexer cannot resolve unambiguously (duplicate ids,
+    ids embedded in labels, etc.) are handed to simplify_regex so the output
+    is always identical to it.
+    """
+
+    pieces = []
+    refs = []
+    node_to_string = {}
+    nodes = []
+    for match in scan(graph):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == NODE:
+            num, _, string = text.split()
+            if num in node_to_string:
+                return simplify_regex(graph, instance_nodes)
+            node_to_string[num] = string
+            nodes.append(text)
+            text = string
+        elif kind == REF:
+            refs.append(len(pieces))
+        pieces.append(text)
+
+    if (has_ambiguous_ids(graph, len(nodes) + len(refs))
+        or (instance_nodes is not None and list(instance_nodes) != nodes)):
+        return simplify_regex(graph, instance_nodes)
+
+    # Maps reentrancies to the original label with reentrancy marker, <*>,
+    # preppended. Done after the scan since a node may be referenced before
+    # its instance appears.
+    for i in refs:
+        if pieces[i] in node_to_string:
+            pieces[i] = '<*> ' + node_to_string[pieces[i]]
+
+    return ''.join(pieces)
+
+
+def simplify_regex(graph, instance_nodes=None):
+    """
+    Reference implementation of simplify. Rewrites the whole graph once per
+    node, so it is quadratic in the size of the graph.
+    """
+
+    if instance_nodes is None:
+        instance_nodes = get_instance_node_pattern().findall(graph)
+
     node_to_string = {}
     for node in instance_nodes:
         num, _, string = node.split()
@@ -24,10 +142,45 @@ def simplify(graph, instance_nodes):
 
 def check_parens(graph):
     """
-    Should return True if the graph paren structure is well-formed.
+    Should return True if the graph paren structure is well-formed: the
+    depth never drops below 0 and is 0 at the end.
+
+    Characters are treated as in check_parens_stack: any character other
+    than a paren, a word character, one of '/\\t +:=-' or a <*> following
+    one of those counts as a closing paren. The depth is counted in one pass
+    over the parens that are left.
     """
 
-    graph = re.sub('[/\t \+\w:=-](<\*>)?', '', graph.strip())
+    graph = graph.strip()
+    num_reentrancies = graph.count('<*>')
+    if (_stray_pattern.search(graph)
+        or graph.count(' <*>') != num_reentrancies
+        or graph.count('<') != num_reentrancies
+        or graph.count('>') != num_reentrancies
+        or graph.count('*') != num_reentrancies):
+        parens = _non_paren_pattern.sub('', graph)
+    else:
+        parens = _non_paren_run_pattern.sub('', graph)
+    if parens.count('(') * 2 != len(parens):
+        return False
+
+    depth = 0
+    for char in parens:
+        if char == '(':
+            depth += 1
+        else:
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+
+def check_parens_stack(graph):
+    """
+    Reference implementation of check_parens.
+    """
+
+    graph = _non_paren_pattern.sub('', graph.strip())
     s = []
     for char in graph:
         if char == '(':
@@ -39,7 +192,115 @@ def check_parens(graph):
     return not s
 
 
-def reverse(graph, instance_nodes):
+def validate(graph, check_content=True):
+    """
+    Checks everything that makes postprocess_predictions.py replace a graph
+    with '(999999999 / invalid)', in order: the paren structure, whether
+    there is any content (only if check_content, as reverse does), nodes
+    without a label (e.g. ':ARG1-NEQ( :num SG') and full-width spaces.
+
+    Return
+    ------
+    str or None
+        One of the INVALID_* reason codes, or None if the graph is valid.
+    """
+
+    if not check_parens(graph):
+        return INVALID_PARENS
+    if check_content and not _content_pattern.search(graph):
+        return INVALID_EMPTY
+    if _invalid_node_pattern.search(graph):
+        return INVALID_NODE
+    if '　' in graph:
+        return INVALID_FULL_WIDTH_SPACE
+    return None
+
+
+def reverse(graph, instance_nodes=None):
+    """
+    Adds node ids back to a simplified graph and resolves <*> reentrancies.
+
+    Walks the graph once. Node ids are assigned exactly as reverse_regex
+    assigns them: nodes are ranked by label length (longest first, ties in
+    graph order), the i-th ranked label gets (i + 1) * 1000 where i is the
+    last rank of that label, and repeated labels are offset by i * 10.
+
+    Return
+    ------
+    str
+        The recovered graph, or '(999999999 / invalid)\n' if the graph is
+        not well-formed.
+    """
+
+    if not check_parens(graph) or not _content_pattern.search(graph):
+        return '(999999999 / invalid)\n'
+
+    matches = list(_reverse_pattern.finditer(graph))
+    nodes = [match for match in matches if match.lastgroup == 'node']
+    if (instance_nodes is not None
+        and list(instance_nodes) != [match.group() for match in nodes]):
+        return reverse_regex(graph, instance_nodes)
+
+    # Just features and no nodes
+    if not nodes:
+        return '(999999999 / invalid)\n'
+
+    # All digit labels could be confused with the assigned node ids
+    split_nodes = [match.group().split() for match in nodes]
+    if any(label.isdigit() for _, label in split_nodes):
+        return reverse_regex(graph, instance_nodes)
+
+    # Ranks nodes so the longest node label is first
+    order = sorted(range(len(nodes)), key=lambda i: -len(split_nodes[i][1]))
+
+    # Number labels
+    nodes_to_nums = { split_nodes[i][1] : (rank + 1) * 1000
+                      for rank, i in enumerate(order) }
+
+    # Repeated labels that are not reentrant (i.e udef_q or nominalizer) are
+    # offset by their rank
+    node_vals = {}
+    seen = set()
+    for rank, i in enumerate(order):
+        label = split_nodes[i][1]
+        val = nodes_to_nums[label]
+        if label in seen:
+            val += rank * 10
+        node_vals[nodes[i].start()] = val
+        seen.add(label)
+
+    pieces = []
+    last = 0
+    for match in matches:
+        pieces.append(graph[last:match.start()])
+        last = match.end()
+        arg, label = match.group().split()
+        if match.lastgroup == 'node':
+            pieces.append(' '.join([arg, str(node_vals[match.start()]), '/', label]))
+
+        # A node considered reentrant despite never appearing in the graph
+        # only occurs from model predictions. In this case, we return an
+        # invalid graph.
+        elif label not in nodes_to_nums:
+            return '(999999999 / invalid)\n'
+        else:
+            pieces.append(str(nodes_to_nums[label]))
+    pieces.append(graph[last:])
+
+    return ''.join(pieces)
+
+
+def reverse_regex(graph, instance_nodes=None):
+    """
+    Reference implementation of reverse. Rewrites the graph from the start
+    once per node and once per reentrancy, so it is quadratic in the size of
+    the graph.
+    """
+
+    if instance_nodes is None:
+        instance_nodes = [node[0] for node
+                          in get_instance_node_pattern(reverse=True).findall(graph)]
+
     if (not check_parens(graph)                           # Invalid Paren structure
         or not instance_nodes                             # Just features and no nodes
         or not re.search('[/\t\+\w:=-](<\*>)?', graph)):  # Just parens or nothing
@@ -89,69 +350,186 @@ def reverse(graph, instance_nodes):
 def expand(graph):
 
     # Handle inter feat separation
-    graph = re.sub('=', ' ', graph)
+    graph = graph.replace('=', ' ')
 
     # Handle intra feat separation
-    intra_feature_pattern = re.compile('[\w-]:')
-    intra_feats = set(intra_feature_pattern.findall(graph))
-    for feat in intra_feats:
-        repl = ' '.join(list(feat))
-        graph = re.sub(feat, repl, graph)
+    return _expand_intra_feature_pattern.sub(r'\1 :', graph)
 
-    return graph
+
+def feature_table(graph):
+    """
+    Splits the graph into its nodes and their feature spans (the same spans
+    find_features returns) and parses each span into keys (with the leading
+    ':') and values.
+
+    The regex transforms replace the first occurrence of each span's text
+    in the graph, not the span itself. Both are the same when every ':' in
+    the graph starts either a role or a feature of one of the spans: a
+    span's text can then only occur at a span, and earlier spans have
+    already been rewritten by the time it is replaced.
+
+    Return
+    ------
+    FeatureTable or None
+        None if a span is not a plain ' :key value ... ' list or there is a
+        ':' anywhere else, in which case the table cannot reproduce the
+        regex transforms.
+    """
+
+    parts = _node_features_pattern.split(graph)
+    if len(parts) == 1 or remove_closing_parens(parts[-1]).strip():
+        return None
+
+    # Every ':' in a regular span starts a key, so counting them gives each
+    # node's number of pairs. Any other ':' has to start a role.
+    spans = parts[2::3]
+    joined = '\n'.join(spans)
+    pairs = _feature_pair_pattern.findall(joined)
+    if graph.count(':') != ''.join(parts[1::3]).count(':') + len(pairs):
+        return None
+
+    keys = [key for key, _ in pairs]
+    values = [value for _, value in pairs]
+    offsets = [0]
+    offsets.extend(accumulate(span.count(':') for span in spans))
+    spaced = joined.count(':') == joined.count(' :')
+
+    return FeatureTable(parts, offsets, keys, values, spaced)
+
+
+def _replace_spans(table, replacements):
+    parts = list(table.parts)
+    parts[2::3] = replacements
+    return ''.join(parts)
 
 
 def filter_feats(graph, features_to_keep=[], filter_all=False):
+    """
+    Removes every feature not in features_to_keep, or all features if
+    filter_all is True.
+
+    Works on the feature table, so the graph is rebuilt once rather than
+    once per node. Produces the same output as filter_feats_regex, which it
+    falls back to when the table cannot represent the graph.
+    """
+
+    if not features_to_keep and not filter_all:
+        return graph
+
+    table = feature_table(graph)
+    if table is None or not all(_feature_name_pattern.fullmatch(feature)
+                                for feature in features_to_keep):
+        return filter_feats_regex(graph, features_to_keep, filter_all)
+
+    # The regex version replaces each span without its surrounding spaces,
+    # which are kept. Removed pairs leave extra spaces that are collapsed
+    # below.
+    rows = zip(table.offsets, table.offsets[1:])
+    if filter_all:
+        replacements = ['   ' if start < end else '' for start, end in rows]
+    else:
+        keep = set(':' + feature for feature in features_to_keep)
+        pairs = [key + ' ' + value if key in keep else ''
+                 for key, value in zip(table.keys, table.values)]
+        replacements = [' ' + ' '.join(pairs[start:end]) + ' '
+                        if start < end else '' for start, end in rows]
+
+    # Replaces '  ' with ' ' for consistency
+    return _spaces_pattern.sub(' ', _replace_spans(table, replacements))
+
+
+def squash(graph, features=None, table=None):
+    """
+    Joins the features of each node into a single ':key=value:key=value'
+    token. features are the spans find_features returns, as squash used to
+    take them, and are squashed with squash_regex if given. table is the
+    graph's feature_table, if already computed.
+
+    Produces the same output as squash_regex, including its handling of a
+    last value that starts with '+' (':ind +' becomes ':ind=++'), and falls
+    back to it when the table cannot represent the graph.
+    """
+
+    if features is not None:
+        return squash_regex(graph, features)
+    if table is None:
+        table = feature_table(graph)
+    if table is None or not table.spaced:
+        return squash_regex(graph, find_features(
+            graph, list(_all_nodes_pattern.finditer(graph))))
+
+    rows = list(zip(table.offsets, table.offsets[1:]))
+    pairs = list(map('='.join, zip(table.keys, table.values)))
+    for start, end in rows:
+        if start < end and table.values[end - 1].startswith('+'):
+            pairs[end - 1] = table.keys[end - 1] + '=+' + table.values[end - 1]
+    replacements = [' ' + ''.join(pairs[start:end]) + ' '
+                    if start < end else '' for start, end in rows]
+
+    return _replace_spans(table, replacements)
+
+
+def filter_feats_regex(graph, features_to_keep=[], filter_all=False):
+    """
+    Reference implementation of filter_feats.
+    """
+
     if not features_to_keep and not filter_all:
         return graph
 
-    all_nodes = list(get_all_nodes_pattern().finditer(graph))
+    all_nodes = list(_all_nodes_pattern.finditer(graph))
     features = find_features(graph, all_nodes)
 
     if filter_all:
         for feature in features:
-            graph = re.sub(re.escape(feature.strip()), ' ', graph, count=1)
+            graph = graph.replace(feature.strip(), ' ', 1)
     else:
-        inclusion_pattern = re.compile(
-            ':({})\ [\w+-]+'.format('|'.join(features_to_keep))
-        )
+        inclusion_pattern = get_inclusion_pattern(tuple(features_to_keep))
 
         for feature in features:
 
             # removes any of the features that we don't want to keep
             cleaned_feat = ' '.join(feature[x.start(): x.end()] for x in
                                     inclusion_pattern.finditer(feature))
-            graph = re.sub(re.escape(feature.strip()), cleaned_feat, graph, count=1)
+            graph = graph.replace(feature.strip(), cleaned_feat, 1)
 
     # Replaces '  ' with ' ' for consistency
-    graph = re.sub(' +', ' ', graph)
+    graph = _spaces_pattern.sub(' ', graph)
     return graph
 
 
-def squash(graph, features):
-    inter_feature_pattern = re.compile('\w [\+\w-]')
-    intra_feature_pattern = re.compile('[\+\w-] :')
+def squash_regex(graph, features):
+    """
+    Reference implementation of squash, given the spans find_features
+    returns.
+    """
 
     for i in range(len(features)):
         feature = features[i]
         feature_repl = feature
 
         # Find all instances we are looking to replace
-        inter_feats = inter_feature_pattern.findall(feature)
-        intra_feats = intra_feature_pattern.findall(feature)
+        inter_feats = _squash_inter_feature_pattern.findall(feature)
+        intra_feats = _squash_intra_feature_pattern.findall(feature)
 
         for intra, inter in zip(intra_feats, inter_feats):
-            intra_repl = re.sub(' ', '', intra)
-            inter_repl = re.sub(' ', '=', inter)
-            feature_repl = re.sub(re.escape(intra), intra_repl, feature_repl, count=1)
-            feature_repl = re.sub(re.escape(inter), inter_repl, feature_repl, count=1)
+            intra_repl = intra.replace(' ', '')
+            inter_repl = inter.replace(' ', '=')
+            feature_repl = feature_repl.replace(intra, intra_repl, 1)
+            feature_repl = feature_repl.replace(inter, inter_repl, 1)
 
         # Handle fencepost since inter_feats has 1 extra element
         inter = inter_feats[-1]
-        inter_repl = re.sub(' ', '=', inter)
-        feature_repl = re.sub(inter, inter_repl, feature_repl, count=1)
+        inter_repl = inter.replace(' ', '=')
 
-        graph = re.sub(re.escape(feature), feature_repl, graph, count=1)
+        # The fencepost has always been matched as a regex, where a trailing
+        # '+' value means "one or more spaces". Only that case needs re.
+        if inter.endswith('+'):
+            feature_repl = re.sub(inter, inter_repl, feature_repl, count=1)
+        else:
+            feature_repl = feature_repl.replace(inter, inter_repl, 1)
+
+        graph = graph.replace(feature, feature_repl, 1)
 
     return graph
 
@@ -203,62 +581,89 @@ def main():
                              'into a single token. "expand" will unsquash '
                              'squashed features. "stable" will keep the format '
                              'of the features. (default="stable")')
+    add_workers_argument(parser)
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
-    instance_nodes_pattern = get_instance_node_pattern(args.reverse)
-    all_nodes_pattern = get_all_nodes_pattern()
+    profiler = open_profiler(args, [transform_graphs] + TRANSFORMS)
+    options = {'recover': args.reverse, 'feature_type': args.feature_type}
+    transform = partial(transform_graphs, **options)
+    cache = open_cache(args, 'transform_graphs', options)
 
+    # Streams the input so memory does not grow with the size of the file
     with open(args.input, 'r') as f, open(args.output, 'w') as output:
-        lines = list(f.readlines())
-
-        # Input should be in the format:
-        # <original graph> \t <translation graph> \n
+        lines = imap_lines(transform, f, args.workers, cache=cache)
         for graphs in tqdm(lines):
-            graphs = graphs.split('\t')
+            output.write(graphs)
 
-            for i in range(len(graphs)):
-                graph = graphs[i]
+    if cache is not None:
+        cache.close()
+        print(cache.stats())
 
-                # Grabs all instance nodes
-                instance_nodes = list(instance_nodes_pattern.findall(graph))
+    if profiler is not None:
+        profiler.close(args.profile)
 
-                # Only care about first match - for some reason, reverse option
-                # will cause multiple matches
-                if args.reverse:
-                    instance_nodes = [node[0] for node in instance_nodes]
 
-                # Removes or adds node labels depending on flags
-                if not args.reverse:
-                    graph = simplify(graph, instance_nodes)
-                else:
-                    graph = reverse(graph, instance_nodes)
+def transform_graphs(line, recover=False, feature_type='stable'):
+    """
+    Simplifies every graph in a line of tab separated graphs, or recovers
+    them if recover is True, and formats the features according to
+    feature_type.
+    """
 
-                #  Handle features
-                if args.feature_type == 'expand':
-                    graph = expand(graph)
-                elif args.feature_type == 'squash':
-                    all_nodes = list(all_nodes_pattern.finditer(graph))
-                    features = find_features(graph, all_nodes)
-                    graph = squash(graph, features)
+    # Input should be in the format:
+    # <original graph> \t <translation graph> \n
+    graphs = line.split('\t')
 
-                graphs[i] = graph
+    for i in range(len(graphs)):
+        graph = graphs[i]
+
+        # Removes or adds node labels depending on flags
+        if not recover:
+            graph = simplify(graph)
+        else:
+            graph = reverse(graph)
 
-            output.write('\t'.join(graphs))
+        #  Handle features
+        if feature_type == 'expand':
+            graph = expand(graph)
+        elif feature_type == 'squash':
+            graph = squash(graph)
+
+        graphs[i] = graph
+
+    return '\t'.join(graphs)
 
 
 def get_invalid_node_pattern():
-    return re.compile(':[\w-]+\( :')
+    return _invalid_node_pattern
 
 
 def get_all_nodes_pattern():
-    return re.compile('((:[\w-]*)?((\()|( <\*>)) [\w+]+( / [\w+]+)?)')
+    return _all_nodes_pattern
 
 
 def get_instance_node_pattern(reverse=False):
     if reverse:
-        return re.compile('((:[\w-]*)?\( [\w+]+)')
+        return _simplified_instance_node_pattern
     else:
-        return re.compile('\d{5} /\ [\w+]+')
+        return _instance_node_pattern
+
+
+@lru_cache(maxsize=None)
+def get_inclusion_pattern(features_to_keep):
+    """
+    Returns the pattern matching the features in features_to_keep (a tuple,
+    so the compiled pattern can be cached per set of features).
+    """
+
+    return re.compile(r':({})\ [\w+-]+'.format('|'.join(features_to_keep)))
+
+
+# The transforms --profile records, in every script that uses them
+TRANSFORMS = [simplify, simplify_regex, reverse, reverse_regex, expand,
+              filter_feats, squash, feature_table, check_parens, validate]
 
 
 if __name__ == '__main__':
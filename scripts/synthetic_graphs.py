@@ -0,0 +1,224 @@
+import argparse
+import random
+
+
+# Vocabulary of the generated graphs, taken from the shapes of the Tanaka
+# graphs: surface and abstract predicates (one with a '+' and one in
+# Japanese), roles and feature values
+PREDICATES = ['_dog_n_1', '_bark_v_1', '_cooperate_v_1', '_look_v_up',
+              '_big_a_1', '_in_p_loc', '_the_q', '_a+bit_x', '_犬_n', '_x_1',
+              'udef_q', 'pronoun_q', 'def_explicit_q', 'compound', 'pron',
+              'nominalization', 'neg', 'card', 'loc_nonsp']
+ROLES = ['ARG1-NEQ', 'ARG2-NEQ', 'ARG3-H', 'ARG1-EQ', 'RSTR-H-of', 'MOD-EQ',
+         'L-INDEX-NEQ', 'R-INDEX-NEQ']
+FEATURES = [('sf', 'PROP'), ('tense', 'PRES'), ('mood', 'INDICATIVE'),
+            ('prog', '-'), ('perf', '-'), ('pers', '3'), ('num', 'SG'),
+            ('ind', '+'), ('cvarsort', 'e'), ('pt', 'std')]
+
+LAYOUTS = ['pairs', 'single', 'parses']
+
+FIRST_ID = 10000
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generates random DMRS graphs in penman notation for '
+                    'benchmarks. The same seed and options always generate '
+                    'the same file.'
+    )
+    parser.add_argument('output', type=str,
+                        help='Output file.')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='Number of lines (or parses). (default=1000)')
+    parser.add_argument('--nodes', type=int, default=20,
+                        help='Nodes per graph. (default=20)')
+    parser.add_argument('--reentrancy', type=float, default=0.15,
+                        help='Chance that a node also has a role pointing '
+                             'back to an earlier node. (default=0.15)')
+    parser.add_argument('--features', type=float, default=0.3,
+                        help='Chance that a node has each feature, e.g. 0 for '
+                             'graphs like clean_parse.py writes without '
+                             '--full. (default=0.3)')
+    parser.add_argument('--layout', type=str, default='pairs',
+                        choices=LAYOUTS,
+                        help='"pairs" writes tab separated graph pairs like '
+                             'clean_parse.py, "single" one graph per line '
+                             'and "parses" blocks of raw parser output like '
+                             'the graphs files clean_parse.py and '
+                             'aggregate_cleaner.py read. (default="pairs")')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed. (default=0)')
+    parser.add_argument('--chain', action='store_true',
+                        help='Hangs every node off the one before it, so '
+                             'graphs are as deep as they have nodes.')
+    args = parser.parse_args()
+
+    with open(args.output, 'w') as f:
+        f.writelines(generate_lines(args.count, args.nodes, args.reentrancy,
+                                    args.features, args.layout, args.seed,
+                                    args.chain))
+
+
+def generate_lines(count, nodes, reentrancy=0.15, features=0.3,
+                   layout='pairs', seed=0, chain=False):
+    """
+    Return
+    ------
+    list
+        The lines of a file of count graphs, graph pairs or parses (see
+        --layout), each with nodes nodes. With chain, each node is the
+        only child of the one before.
+    """
+
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        if layout == 'pairs':
+            lines.append('{}\t{}\n'.format(
+                generate_graph(rng, nodes, reentrancy, features, chain),
+                generate_graph(rng, nodes, reentrancy, features, chain)))
+        elif layout == 'single':
+            lines.append(generate_graph(rng, nodes, reentrancy, features,
+                                        chain) + '\n')
+        elif layout == 'parses':
+            lines.append('# ::id {}\n'.format(i + 1))
+            lines.append('# ::snt sentence {}\n'.format(i + 1))
+            lines.extend(line + '\n' for line
+                         in generate_parse(rng, nodes, reentrancy, features,
+                                           chain))
+            lines.append('\n')
+        else:
+            raise ValueError('unknown layout {!r}'.format(layout))
+    return lines
+
+
+def generate_tree(rng, nodes, reentrancy=0.15, features=0.3, chain=False):
+    """
+    Generates the structure of a graph. Every node but the root hangs off a
+    random earlier node, so ids are in depth-first order as in the parser's
+    output, and reentrancies only point to nodes that come earlier.
+
+    Return
+    ------
+    list
+        (id, predicate, features, children, reentrancies) for every node in
+        depth-first order, where children are indices into the list and
+        reentrancies (role, id) pairs.
+    """
+
+    if chain:
+        parents = [None] + list(range(nodes - 1))
+    else:
+        parents = [None] + [rng.randrange(i) for i in range(1, nodes)]
+    children = [[] for _ in range(nodes)]
+    for child, parent in enumerate(parents[1:], 1):
+        children[parent].append(child)
+
+    # Renumbers the nodes in depth-first order
+    order = []
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(reversed(children[node]))
+    position = {node: i for i, node in enumerate(order)}
+
+    # reverse resolves a reentrancy with '<*> \w+', so one cannot point to a
+    # predicate with a '+'
+    predicates = [rng.choice(PREDICATES) for _ in range(nodes)]
+    targets = []
+
+    tree = []
+    for i, node in enumerate(order):
+        feats = [feature for feature in FEATURES if rng.random() < features]
+        reentrant = []
+        if targets and rng.random() < reentrancy:
+            reentrant.append((rng.choice(ROLES),
+                              FIRST_ID + rng.choice(targets)))
+        if '+' not in predicates[i]:
+            targets.append(i)
+        tree.append((FIRST_ID + i, predicates[i], feats,
+                     [position[child] for child in children[node]],
+                     reentrant))
+    return tree
+
+
+def generate_graph(rng, nodes, reentrancy=0.15, features=0.3, chain=False):
+    """
+    Return
+    ------
+    str
+        A graph as clean_parse.py writes it, e.g.
+        '( 10000 / _dog_n_1 :num SG :ARG1-NEQ( 10001 / udef_q ) )'.
+    """
+
+    tree = generate_tree(rng, nodes, reentrancy, features, chain)
+    tokens = []
+
+    # Written with a stack rather than recursion, so chains can be deeper
+    # than the recursion limit. None closes a node.
+    stack = [(0, '(')]
+    while stack:
+        item = stack.pop()
+        if item is None:
+            tokens.append(')')
+            continue
+
+        index, opening = item
+        if opening is None:
+            opening = ':{}('.format(rng.choice(ROLES))
+        node_id, predicate, feats, children, reentrant = tree[index]
+        tokens.append('{} {} / {}'.format(opening, node_id, predicate))
+        tokens.extend(':{} {}'.format(key, value) for key, value in feats)
+        for role, target in reentrant:
+            tokens.append(':{} {}'.format(role, target))
+        stack.append(None)
+        stack.extend((child, None) for child in reversed(children))
+
+    return ' '.join(tokens)
+
+
+def generate_parse(rng, nodes, reentrancy=0.15, features=0.3, chain=False):
+    """
+    Return
+    ------
+    list
+        The lines of a graph as the parser writes it: one role or feature
+        per indented line, with :lnk and some :carg lines that clean_block
+        drops.
+    """
+
+    tree = generate_tree(rng, nodes, reentrancy, features, chain)
+    lines = []
+
+    # (index, opening, indent), or None to close a node
+    stack = [(0, '(', 0)]
+    while stack:
+        item = stack.pop()
+        if item is None:
+            lines[-1] += ')'
+            continue
+
+        index, opening, indent = item
+        if opening is None:
+            opening = ':{} ('.format(rng.choice(ROLES))
+        node_id, predicate, feats, children, reentrant = tree[index]
+        lines.append('{}{}{} / {}'.format(' ' * indent, opening, node_id,
+                                           predicate))
+        inner = ' ' * (indent + 3)
+        lines.append('{}:lnk "<{}:{}>"'.format(inner, index, index + 1))
+        if rng.random() < 0.1:
+            lines.append('{}:carg "Kim"'.format(inner))
+        lines.extend('{}:{} {}'.format(inner, key, value)
+                     for key, value in feats)
+        for role, target in reentrant:
+            lines.append('{}:{} {}'.format(inner, role, target))
+        stack.append(None)
+        stack.extend((child, None, indent + 3)
+                     for child in reversed(children))
+
+    return lines
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+# Bump when a transform changes its output so old entries are not reused
+CACHE_VERSION = 4
+
+DEFAULT_SIZE_MB = 1024
+
+
+class TransformCache:
+    """
+    On-disk cache of transformed lines, keyed by a hash of the line, the
+    transform name and its options. Results are stored as JSON in SQLite and
+    the least recently used entries are evicted once the stored values exceed
+    max_bytes.
+    """
+
+    def __init__(self, path, name, options, max_bytes=DEFAULT_SIZE_MB << 20):
+        self.namespace = repr((CACHE_VERSION, name, sorted(options.items())))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                        'key TEXT PRIMARY KEY, value TEXT, '
+                        'size INTEGER, last_used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_last_used '
+                        'ON entries (last_used)')
+        self.db.commit()
+        self.total_bytes = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def key(self, text):
+        digest = hashlib.sha1(self.namespace.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_many(self, keys):
+        """
+        Return
+        ------
+        dict
+            Maps the keys that are cached to their values.
+        """
+
+        found = {}
+        unique = list(set(keys))
+
+        # SQLite limits the number of parameters per query
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows = self.db.execute(
+                'SELECT key, value FROM entries WHERE key IN ({})'.format(
+                    ','.join('?' * len(batch))), batch)
+            found.update((key, json.loads(value)) for key, value in rows)
+
+        if found:
+            now = time.time()
+            self.db.executemany('UPDATE entries SET last_used = ? WHERE key = ?',
+                                ((now, key) for key in found))
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """
+        Stores (key, value) pairs and evicts old entries if the cache is
+        over its size limit.
+        """
+
+        now = time.time()
+        for key, value in items:
+            value = json.dumps(value, ensure_ascii=False)
+            size = len(value.encode('utf-8'))
+            old = self.db.execute('SELECT size FROM entries WHERE key = ?',
+                                  (key,)).fetchone()
+            self.total_bytes += size - (old[0] if old else 0)
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                            (key, value, size, now))
+
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.db.execute('SELECT key, size FROM entries '
+                                   'ORDER BY last_used LIMIT 1000').fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+
+            self.db.executemany('DELETE FROM entries WHERE key = ?',
+                                ((key,) for key, _ in rows))
+            for key, size in rows:
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return ('Cache: {} hits, {} misses ({:.1%} hit rate), {:.1f}MB '
+                'stored'.format(self.hits, self.misses,
+                                self.hits / total if total else 0,
+                                self.total_bytes / (1 << 20)))
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache', type=str, default=None,
+                        help='SQLite file caching transformed lines between '
+                             'runs. Only lines that changed since a previous '
+                             'run with the same options are recomputed.')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_SIZE_MB,
+                        help='Maximum size of the cache in MB. Least recently '
+                             'used entries are evicted first. '
+                             '(default={})'.format(DEFAULT_SIZE_MB))
+
+
+def open_cache(args, name, options):
+    """
+    Returns a TransformCache for the transform if --cache was given,
+    otherwise None.
+    """
+
+    if not args.cache:
+        return None
+
+    directory = os.path.dirname(args.cache)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return TransformCache(args.cache, name, options, args.cache_size << 20)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+
+# The scripts import each other by name, as with PYTHONPATH=.:scripts
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'scripts')]
@@ -0,0 +1,79 @@
+import os
+import sys
+from functools import partial
+
+import pytest
+
+from evaluate_smatch import INVALID, _SeededRandom, compute_f, read_pairs, \
+                            score_pair
+from parallel import imap_lines
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures')
+
+# smatch is a submodule, which evaluate_smatch.py finds with --smatch
+sys.path.insert(0, os.path.join(ROOT, 'smatch'))
+smatch = pytest.importorskip('smatch')
+
+
+def read_fixture_pairs():
+    with open(os.path.join(FIXTURES, 'smatch_pred.txt')) as predicted, \
+         open(os.path.join(FIXTURES, 'smatch_gold.txt')) as gold:
+        return list(read_pairs(smatch.amr.AMR.get_amr_line, predicted,
+                               gold))
+
+
+def smatch_counts(pred, label, seed=0, restarts=4):
+    # What smatch itself computes for the pair, hill-climbing every pair,
+    # with the restarts drawn as score_pair draws them
+    smatch.random = _SeededRandom(seed)
+    smatch.iteration_num = restarts + 1
+    counts = smatch.get_amr_match(pred, label)
+    smatch.match_triple_dict.clear()
+    return list(counts)
+
+
+def test_read_pairs(capsys):
+    pairs = read_fixture_pairs()
+
+    # The gold file has one more graph, which is ignored
+    assert len(pairs) == 5
+    assert 'different number of graphs' in capsys.readouterr().err
+    assert all('\n' not in pred and '\n' not in label
+               for pred, label in pairs)
+    assert pairs[1][0] == INVALID
+
+
+def test_fast_paths():
+    pairs = read_fixture_pairs()
+    identical = [pair for pair in pairs if pair[0] == pair[1]]
+    invalid = [pair for pair in pairs if pair[0] == INVALID]
+    assert len(identical) == 2 and len(invalid) == 1
+
+    for pred, label in identical:
+        match, test, gold = score_pair(pred + '\n' + label)
+        assert match == test == gold
+    for pred, label in identical + invalid:
+        assert score_pair(pred + '\n' + label) == smatch_counts(pred, label)
+
+
+def test_same_as_smatch():
+    for pred, label in read_fixture_pairs():
+        assert score_pair(pred + '\n' + label) == smatch_counts(pred, label)
+
+
+def test_workers_and_order():
+    pairs = ['\n'.join(pair) for pair in read_fixture_pairs()]
+    serial = [score_pair(pair) for pair in pairs]
+    assert list(imap_lines(partial(score_pair), pairs * 4, 2, 3)) \
+        == serial * 4
+    assert [score_pair(pair) for pair in reversed(pairs)] \
+        == serial[::-1]
+
+
+def test_compute_f():
+    assert compute_f(3, 4, 6) == smatch.compute_f(3, 4, 6)
+    assert compute_f(0, 4, 6) == (0.0, 0.0, 0.0)
+    assert compute_f(0, 0, 6) == (0.0, 0.0, 0.0)
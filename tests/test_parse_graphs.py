@@ -0,0 +1,117 @@
+import os
+import textwrap
+import time
+
+import pytest
+
+from parse_graphs import find_shards, parse_shard, parse_shards
+
+
+# Stands in for parser/mrs_to_penman.py. The grammar argument says what it
+# does: "ok" writes a graph, "fail" exits with 3, "flaky" fails on its first
+# run in a subdirectory, and "hang" starts a child that would write a
+# "survivor" file later and then hangs, as ACE runs under the parser.
+FAKE_PARSER = textwrap.dedent('''
+    import argparse
+    import os
+    import subprocess
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ace-binary')
+    parser.add_argument('-g')
+    parser.add_argument('-i')
+    args = parser.parse_args()
+
+    with open(os.path.join(args.i, 'attempts'), 'a') as f:
+        f.write('x')
+    with open(os.path.join(args.i, 'attempts')) as f:
+        attempts = len(f.read())
+
+    if args.g == 'fail' or (args.g == 'flaky' and attempts == 1):
+        print('( 10000 / _half_n_1 )')
+        sys.exit(3)
+    if args.g == 'hang':
+        survivor = os.path.join(args.i, 'survivor')
+        subprocess.Popen([sys.executable, '-c',
+                          'import time; time.sleep(1.5); '
+                          'open({!r}, "w").close()'.format(survivor)])
+        time.sleep(60)
+    print('( 10000 / _dog_n_1 )')
+''')
+
+
+@pytest.fixture
+def fake_parser(tmp_path):
+    path = tmp_path / 'mrs_to_penman.py'
+    path.write_text(FAKE_PARSER)
+    return str(path)
+
+
+def make_shard(tmp_path, name='0'):
+    path = tmp_path / 'data' / 'dev.en' / name
+    path.mkdir(parents=True)
+    return str(path)
+
+
+def read(path, name):
+    with open(os.path.join(path, name)) as f:
+        return f.read()
+
+
+def test_parse(tmp_path, fake_parser):
+    shard = make_shard(tmp_path)
+    assert parse_shard(shard, 'ok', 'ace', fake_parser)
+    assert read(shard, 'graphs') == '( 10000 / _dog_n_1 )\n'
+    assert not os.path.exists(os.path.join(shard, 'graphs.partial'))
+
+
+def test_retry(tmp_path, fake_parser):
+    shard = make_shard(tmp_path)
+    assert parse_shard(shard, 'flaky', 'ace', fake_parser, retries=1)
+    assert read(shard, 'attempts') == 'xx'
+    assert read(shard, 'graphs') == '( 10000 / _dog_n_1 )\n'
+
+
+def test_failure_keeps_old_graphs(tmp_path, fake_parser):
+    shard = make_shard(tmp_path)
+    with open(os.path.join(shard, 'graphs'), 'w') as f:
+        f.write('old\n')
+
+    assert not parse_shard(shard, 'fail', 'ace', fake_parser, retries=2)
+    assert read(shard, 'attempts') == 'xxx'
+    assert read(shard, 'graphs') == 'old\n'
+    assert not os.path.exists(os.path.join(shard, 'graphs.partial'))
+
+
+def test_timeout_kills_process_group(tmp_path, fake_parser):
+    shard = make_shard(tmp_path)
+    start = time.perf_counter()
+    assert not parse_shard(shard, 'hang', 'ace', fake_parser, timeout=0.5,
+                           retries=0)
+    assert time.perf_counter() - start < 10
+    assert not os.path.exists(os.path.join(shard, 'graphs'))
+    assert not os.path.exists(os.path.join(shard, 'graphs.partial'))
+
+    # The child would have written its file by now if it outlived the parser
+    time.sleep(2)
+    assert not os.path.exists(os.path.join(shard, 'survivor'))
+
+
+def test_parse_shards_resumes(tmp_path, fake_parser):
+    done = make_shard(tmp_path, '0')
+    with open(os.path.join(done, 'graphs'), 'w') as f:
+        f.write('old\n')
+    todo = make_shard(tmp_path, '1')
+    failing = make_shard(tmp_path, '2')
+
+    data = str(tmp_path / 'data')
+    assert list(find_shards(data)) == [('en', todo), ('en', failing)]
+
+    grammars = {todo: 'ok', failing: 'fail'}
+    shards = [(path, grammars[path]) for _, path in find_shards(data)]
+    assert parse_shards(shards, 'ace', fake_parser, jobs=2,
+                        retries=0) == [failing]
+    assert read(done, 'graphs') == 'old\n'
+    assert read(todo, 'graphs') == '( 10000 / _dog_n_1 )\n'
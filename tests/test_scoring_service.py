@@ -0,0 +1,41 @@
+from scoring_service import ScoringService, read_gold
+from simplify_graph import simplify
+
+
+GOLD = [
+    '( 10000 / _dog_n_1 :ARG1-NEQ( 10001 / udef_q ) )\n',
+    '( 10000 / _bark_v_1 :ARG1-NEQ( 10001 / pron ) )\n',
+    '( 10000 / _cat_n_1 :RSTR-H-of( 10001 / _the_q ) )\n',
+]
+
+
+def test_gold_separated_by_empty_lines(tmp_path):
+    # The way postprocess_predictions.py and SMATCH write graphs
+    path = tmp_path / 'dev.gold.txt'
+    path.write_text('\n'.join(GOLD))
+    assert read_gold(str(path)) == GOLD
+
+    service = ScoringService(read_gold(str(path)))
+    predictions = [simplify(graph) for graph in GOLD]
+    service.handle({'run': 'dev', 'predictions': predictions[:2]})
+    reply = service.handle({'run': 'dev', 'predictions': predictions[2:],
+                            'end': True})
+
+    assert reply['graphs'] == 3
+    assert reply['total']['f1'] == 1.0
+
+
+def test_gold_one_per_line(tmp_path):
+    path = tmp_path / 'dev.gold.txt'
+    path.write_text(''.join(GOLD))
+    assert read_gold(str(path)) == GOLD
+
+
+def test_too_few_gold_graphs(tmp_path):
+    path = tmp_path / 'dev.gold.txt'
+    path.write_text('\n'.join(GOLD))
+
+    service = ScoringService(read_gold(str(path)))
+    reply = service.handle_line('{"run": "dev", "predictions": ["( a )", '
+                                '"( b )", "( c )", "( d )"]}')
+    assert reply == {'error': '4 predictions but 3 gold graphs'}
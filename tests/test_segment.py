@@ -0,0 +1,73 @@
+import pytest
+
+from functools import partial
+
+import segment
+from parallel import imap_lines
+from segment import segment_pair, surfaces
+
+
+# MeCab's default output for '犬が吠えた。' with the IPA dictionary
+MECAB_OUTPUT = (
+    '犬\t名詞,一般,*,*,*,*,犬,イヌ,イヌ\n'
+    'が\t助詞,格助詞,一般,*,*,*,が,ガ,ガ\n'
+    '吠え\t動詞,自立,*,*,一段,連用形,吠える,ホエ,ホエ\n'
+    'た\t助動詞,*,*,*,特殊・タ,基本形,た,タ,タ\n'
+    '。\t記号,句点,*,*,*,*,。,。,。\n'
+    'EOS\n'
+)
+
+PAIRS = [
+    ('The dog barked at the cat.\n', '犬が猫に吠えた。\n'),
+    ('I will see you again tomorrow.\n', '明日また会いましょう。\n'),
+    ('She reads a book every night.\n', '彼女は毎晩本を読む。\n'),
+]
+
+
+def test_surfaces():
+    assert surfaces(MECAB_OUTPUT) == ['犬', 'が', '吠え', 'た', '。']
+    assert surfaces('EOS\n') == []
+
+
+@pytest.mark.parametrize('pair', [
+    ('The dog (a poodle) barked.\n', '犬が吠えた。\n'),
+    ('The dog barked at the cat.\n', '犬（プードル）が吠えた。\n'),
+    ('The dog barked at the cat.\n', '犬(プードル)が吠えた。\n'),
+    ('Chapter one\n', '第一章\n'),
+])
+def test_filtered_before_tagging(pair):
+    # None of these need a tagger, so none is created
+    taggers = dict(segment._taggers)
+    assert segment_pair(pair) is None
+    assert segment._taggers == taggers
+
+
+def _tagger_args():
+    MeCab = pytest.importorskip('MeCab')
+    try:
+        MeCab.Tagger('')
+    except RuntimeError:
+        pytest.skip('MeCab has no default dictionary')
+    return ''
+
+
+def test_same_tokens_as_parse_to_node():
+    # segment.py used to walk parseToNode, whose first and last nodes have
+    # empty surfaces
+    tagger_args = _tagger_args()
+    tagger = segment.get_tagger(tagger_args)
+    for engl, jpn in PAIRS:
+        tokens = []
+        node = tagger.parseToNode(jpn)
+        while node:
+            tokens.append(node.surface)
+            node = node.next
+        assert segment_pair((engl, jpn), tagger_args) == (
+            engl, ' '.join(tokens).strip())
+
+
+def test_workers_keep_order():
+    tagger_args = _tagger_args()
+    expected = [segment_pair(pair, tagger_args) for pair in PAIRS]
+    fn = partial(segment_pair, tagger_args=tagger_args)
+    assert list(imap_lines(fn, PAIRS * 10, 2, 4)) == expected * 10